@@ -1,70 +1,473 @@
 # agents/classifier_agent.py
 
-from utils.file_parser import detect_format, read_file
-from utils.intent_classifier import classify_intent
-from utils.information_extractor import extract_information
-from utils.client import query_nvidia
+from utils.file_parser import detect_format, read_file, check_size, DocumentError
+from utils.intent_classifier import classify_intent, normalize_intent, ALLOWED_INTENTS
+from utils.information_extractor import extract_with_rules, missing_fields, EXTRACTION_SCHEMA, EXTRACTION_TYPES
+from utils.local_classifier import classify_local, classify_with_threshold, local_verdict, tier_stats
+from utils.client import query_nvidia, LLMError
+from utils.llm_router import model_key
+from utils.tracing import span, event, metrics
+from utils.json_repair import repair_json, coerce_fields, StreamingObjectParser
+from utils.chunker import select_text, map_chunks, count_tokens, PROMPT_TOKEN_BUDGET, CHUNK_TOKENS, MAX_MAP_CHUNKS
+from utils.email_parser import parse_email, render_email
+from agents.json_agent import handle_json_document
 from memory.memory_store import MemoryStore
+from memory.result_cache import content_hash
+from memory.near_duplicates import signature
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import contextvars
 import json
+import logging
+import os
+import time
 
-def classify_and_route(filename: str, content: str):
-    try:
-        # Parse the file content
-        parsed_content = read_file(filename, content)
+logger = logging.getLogger(__name__)
+
+# Bump whenever the intent or extraction prompts change so cached results are not reused
+PROMPT_VERSION = "7"
+
+# Parsing stops once this many characters are available; prompts only use the head of the text
+PARSE_CHAR_BUDGET = int(os.getenv("PARSE_CHAR_BUDGET", "8000"))
+
+# "fused" asks for intent and extraction in one completion, "separate" uses one call for each
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "fused")
+
+# "budget" extracts from the best chunks that fit PROMPT_TOKEN_BUDGET in one call; "map_reduce"
+# extracts from up to MAX_MAP_CHUNKS chunks of long documents in parallel and merges the results
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "budget")
+
+# Follow-up calls asking only for extraction fields that came back cut off or unusable; 0 disables
+REPAIR_REPROMPTS = int(os.getenv("REPAIR_REPROMPTS", "1"))
+
+# Attachments of one email classified at the same time
+ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", "4"))
+
+FIELD_DESCRIPTIONS = {
+    "sender": "who sent/created the document",
+    "recipients": "who received the document",
+    "dates": "any dates found",
+    "emails": "any email addresses",
+    "amounts": "any monetary amounts",
+    "key_details": "other important information",
+}
+
+def extraction_fields(fields):
+    return "\n".join(f"            - {field}: {FIELD_DESCRIPTIONS[field]}" for field in fields)
+
+def classify_and_extract(parsed_content: str, fields=EXTRACTION_SCHEMA):
+    """
+    Get the intent label and the extraction JSON from a single completion.
+    Returns (intent, result); either is None when it failed validation.
+    """
+    fused_prompt = f"""
+            Classify the intent of this document and extract key information from it:
+            {select_text(parsed_content)}
+
+            The intent must be exactly one of: {", ".join(ALLOWED_INTENTS)}.
+            Use 'Email' if no specific intent is detected.
+
+            Return a JSON object with two keys:
+            - intent: the intent label
+            - extraction: an object with these fields:
+{extraction_fields(fields)}
+
+            Format the response as valid JSON only.
+            """
 
-        # Validate parsed content
-        if not parsed_content:
-            raise ValueError("No content parsed from file")
+    # Transport failures (LLMError) propagate; only an unrepairable reply falls back to separate calls
+    parser = StreamingObjectParser()
+    reply, truncated = parse_reply(query_nvidia(fused_prompt, task="fused", until=parser.feed), "fused", parser)
+    if reply is None:
+        return None, None
 
-        # Get format and classify
-        file_format = detect_format(filename)
-        intent = classify_intent(parsed_content)
+    intent = normalize_intent(reply.get("intent"))
+    result = reply.get("extraction")
+    if not isinstance(result, dict):
+        return intent, None
+    return intent, checked_extraction(parsed_content, result, fields, truncated, "fused")
 
-        # Try AI-powered extraction
-        try:
-            extraction_prompt = f"""
+def extract_fields(parsed_content: str, fields=EXTRACTION_SCHEMA, task="extract", reprompts=REPAIR_REPROMPTS):
+    """Extraction-only completion for the given fields; None if the reply is not a JSON object"""
+    extraction_prompt = f"""
             Extract key information from this document:
-            {parsed_content[:2000]}
-            
+            {select_text(parsed_content)}
+
             Return a JSON object with these fields:
-            - sender: who sent/created the document
-            - recipients: who received the document
-            - dates: any dates found
-            - emails: any email addresses
-            - amounts: any monetary amounts
-            - key_details: other important information
-            
+{extraction_fields(fields)}
+
             Format the response as valid JSON only.
             """
-            
-            ai_result = query_nvidia(extraction_prompt)
-            result = json.loads(ai_result)
-            
-        except Exception as ai_error:
-            result = extract_information(parsed_content)
-
-        # Validate extracted data
-        if not isinstance(result, dict):
-            result = {"error": "Invalid extraction result", "raw_content": str(result)[:100]}
-
-        # Add metadata to result
-        result.update({
-            "file_format": file_format,
-            "extraction_method": "nvidia_ai" if "ai_error" not in locals() else "regex",
-            "processed_at": datetime.now().isoformat()
-        })
-
-        # Convert result dict to JSON string for database storage
-        try:
-            result_str = json.dumps(result)
-        except TypeError:
-            result_str = json.dumps({"error": "Failed to serialize result"})
-
-        # Add to database with validation
-        
-
-        return file_format, intent, result
+    parser = StreamingObjectParser()
+    reply, truncated = parse_reply(query_nvidia(extraction_prompt, task=task, until=parser.feed), task, parser)
+    if reply is None:
+        return None
+    return checked_extraction(parsed_content, reply, fields, truncated, task, reprompts)
+
+def checked_extraction(parsed_content, reply, fields, truncated, task, reprompts=REPAIR_REPROMPTS):
+    """
+    Coerce a decoded extraction to EXTRACTION_TYPES, then ask again for just the
+    fields that were unusable or lost to truncation instead of redoing the whole extraction.
+    """
+    result, coerced, invalid = coerce_fields(reply, {field: EXTRACTION_TYPES[field] for field in fields})
+    for field in coerced:
+        metrics.inc("json_coerced_fields_total", task=task, field=field)
+    for field in invalid:
+        metrics.inc("json_invalid_fields_total", task=task, field=field)
+
+    bad = list(invalid)
+    if truncated:
+        # Fields after the cut never arrived and the last one that did may be incomplete
+        present = [field for field in reply if field in fields]
+        bad += [field for field in fields
+                if field not in bad and (field not in reply or present[-1:] == [field])]
+    if not bad or reprompts <= 0:
+        return result
+
+    event("json.reprompt", task=task, fields=bad)
+    try:
+        fixed = extract_fields(parsed_content, bad, task="repair", reprompts=reprompts - 1)
+    except LLMError as e:
+        # Keep the fields that did parse rather than losing the whole extraction
+        logger.warning(f"Repair call for {', '.join(bad)} failed: {str(e)}")
+        fixed = None
+    for field, value in (fixed or {}).items():
+        if value is not None or field not in result:
+            result[field] = value
+    return result
+
+def extract_map_reduce(parsed_content: str, fields=EXTRACTION_SCHEMA):
+    """Extract from the best chunks in parallel and merge; None if no chunk produced a result"""
+    partials = map_chunks(parsed_content, lambda chunk: extract_fields(chunk, fields))
+    partials = [partial for partial in partials if partial]
+    if not partials:
+        return None
+    merged = {}
+    for partial in partials:
+        merge_partial(merged, partial)
+    return merged
+
+def merge_partial(merged, partial):
+    """Reduce step: lists are unioned in order, dicts merged recursively, the first non-empty scalar wins"""
+    for field, value in partial.items():
+        current = merged.get(field)
+        if isinstance(current, list) and isinstance(value, list):
+            seen = {json.dumps(item, sort_keys=True, default=str) for item in current}
+            for item in value:
+                key = json.dumps(item, sort_keys=True, default=str)
+                if key not in seen:
+                    seen.add(key)
+                    current.append(item)
+        elif isinstance(current, dict) and isinstance(value, dict):
+            merge_partial(current, value)
+        elif not current and value:
+            merged[field] = list(value) if isinstance(value, list) else value
+        elif field not in merged:
+            merged[field] = value
+
+def parse_reply(reply, task, parser=None):
+    """
+    Decode a JSON object reply, repairing fences, quoting, commas and truncation.
+    A StreamingObjectParser that already decoded this streamed reply is used as is.
+    Returns (result, truncated); result is None (a json_parse_total failure) when nothing usable is left.
+    """
+    with span("json.parse", task=task) as current:
+        # A hedged call may have been answered by a different stream than the one the parser saw
+        streamed = parser is not None and parser.done and not parser.failed and parser.text.strip() == reply
+        if streamed:
+            result, repairs = parser.value, sorted(parser.repairs)
+        else:
+            try:
+                result, repairs = repair_json(reply)
+            except ValueError:
+                result, repairs = None, []
+        ok = isinstance(result, dict)
+        current.set(ok=ok, chars=len(reply), repairs=repairs, streamed=streamed)
+    metrics.inc("json_parse_total", task=task, status=("repaired" if repairs else "ok") if ok else "invalid")
+    for repair in repairs:
+        metrics.inc("json_repairs_total", task=task, repair=repair)
+    return (result if ok else None), "truncated" in repairs
+
+# Keys finish() and the near-duplicate path add on top of the extracted fields
+RESULT_METADATA = ("file_format", "extraction_method", "processed_at", "llm_error",
+                   "near_duplicate_of", "changed_fields", "attachments")
+
+def merge_extraction(prefill, ai_result):
+    """Rule-based values win; the AI result only fills fields the rules left empty"""
+    merged = dict(ai_result or {})
+    for field, value in prefill.items():
+        if value or field not in merged:
+            merged[field] = value
+    return merged
+
+def reuse_near_duplicate(prefill, previous):
+    """
+    Earlier extraction refreshed with this document's rule-based values, plus the
+    fields whose values differ from the earlier document.
+    """
+    previous = {field: value for field, value in previous.items() if field not in RESULT_METADATA}
+    result = merge_extraction(prefill, previous)
+    changed = []
+    for field, value in prefill.items():
+        old = previous.get(field)
+        if isinstance(value, dict) and isinstance(old, dict):
+            # Keep the earlier details the rules know nothing about
+            result[field] = {**old, **{key: item for key, item in value.items() if item}}
+            if any(item and old.get(key) != item for key, item in value.items()):
+                changed.append(field)
+        elif value and old and value != old:
+            changed.append(field)
+    return result, changed
+
+def prepare_document(filename: str, content, near_duplicates=False):
+    """
+    CPU-bound half of classify_and_route: format detection, JSON mapping, parsing,
+    rule-based pre-fill, the local intent verdict and (with near_duplicates=True) the
+    MinHash signature. Needs no store or network, so utils/staged_pipeline.py runs it
+    in worker processes; the returned dict is what complete_document() consumes.
+    """
+    file_format = detect_format(filename)
+    prepared = {"filename": filename, "file_format": file_format}
+
+    # Structured JSON is extracted locally through the field mappings
+    if file_format == "JSON":
+        with span("json.mapping") as current:
+            structured = handle_json_document(content)
+            current.set(mapped=structured is not None)
+        if structured is not None:
+            prepared["structured"] = structured
+            return prepared
+
+    # Parse the file content; map-reduce may use up to MAX_MAP_CHUNKS chunks of it
+    parse_budget = PARSE_CHAR_BUDGET
+    if EXTRACTION_MODE == "map_reduce":
+        parse_budget = max(PARSE_CHAR_BUDGET, MAX_MAP_CHUNKS * CHUNK_TOKENS * 4)
+    attachments = []
+    with span("parse", format=file_format) as current:
+        if filename.lower().endswith(".eml"):
+            # Headers and the newest body go in the prompt; PDF/JSON attachments become child documents
+            check_size(content)
+            message = parse_email(content)
+            parsed_content = render_email(message)[:parse_budget]
+            attachments = message["attachments"]
+            current.set(attachments=len(attachments))
+        else:
+            parsed_content = read_file(filename, content, max_chars=parse_budget)
+        current.set(chars=len(parsed_content or ""))
 
+    # Validate parsed content
+    if not parsed_content:
+        raise DocumentError("No content parsed from file")
+
+    # Deterministic pre-fill; the LLM is only asked for the fields the rules could not find
+    with span("rules") as current:
+        prefill = extract_with_rules(parsed_content)
+        wanted = missing_fields(prefill)
+
+        # Cheap local rules first; the LLM only labels documents they are unsure about
+        intent, confidence, tier, tier_seconds = local_verdict(parsed_content)
+        current.set(intent=intent, confidence=round(confidence, 3), missing=wanted)
+
+    # tier_stats is per process, so complete_document() records the verdict where the stats are read
+    prepared.update(parsed_content=parsed_content, prefill=prefill, wanted=wanted, intent=intent,
+                    local_tier=(tier, tier_seconds))
+    if near_duplicates:
+        prepared["signature"] = signature(parsed_content)
+    if attachments:
+        prepared["attachments"] = [prepare_attachment(name, data, near_duplicates) for name, data in attachments]
+    return prepared
+
+def prepare_attachment(filename, data, near_duplicates=False):
+    """prepare_document for one attachment; a broken attachment is recorded instead of failing the email"""
+    attachment = {"filename": filename, "content_hash": content_hash(data)}
+    try:
+        attachment["prepared"] = prepare_document(filename, data, near_duplicates=near_duplicates)
     except Exception as e:
-        raise
+        logger.warning(f"Could not parse attachment {filename}: {str(e)}")
+        attachment["error"] = str(e)
+    return attachment
+
+def start_attachments(attachments, mode=None, near_duplicates=None):
+    """
+    Complete the prepared attachments of an email in parallel with the email
+    itself; returns a function that waits for their results, or None.
+    """
+    if not attachments:
+        return None
+    executor = ThreadPoolExecutor(max_workers=min(ATTACHMENT_WORKERS, len(attachments)))
+    # Copy the context so the attachments' spans land in the email's trace
+    futures = [executor.submit(contextvars.copy_context().run, complete_attachment, attachment, mode, near_duplicates)
+               for attachment in attachments]
+    executor.shutdown(wait=False)
+    return lambda: [future.result() for future in futures]
+
+def complete_attachment(attachment, mode=None, near_duplicates=None):
+    """
+    Entry for the email's "attachments" list. The "extracted" result of a
+    classified attachment is logged by MemoryStore as a child of the email's log.
+    """
+    entry = {"filename": attachment["filename"], "content_hash": attachment["content_hash"]}
+    if "error" in attachment:
+        return dict(entry, error=attachment["error"])
+    try:
+        with span("attachment", filename=attachment["filename"]):
+            file_format, intent, result = complete_document(attachment["prepared"], attachment["content_hash"],
+                                                            mode=mode, near_duplicates=near_duplicates)
+    except Exception as e:
+        logger.warning(f"Could not classify attachment {attachment['filename']}: {str(e)}")
+        return dict(entry, error=str(e))
+    return dict(entry, file_format=file_format, intent=intent, extracted=result)
+
+def classify_and_route(filename: str, content: str, cache=None, mode=None, near_duplicates=None):
+    """
+    Detect format and intent and extract the schema fields. cache is an optional
+    ResultCache for exact repeats; near_duplicates an optional NearDuplicateIndex
+    whose matches reuse the earlier extraction instead of calling the LLM.
+    """
+    mode = mode or PIPELINE_MODE
+    digest = content_hash(content) if cache is not None or near_duplicates is not None else None
+
+    # Serve repeated documents from the result cache without any LLM call
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(digest, f"{PROMPT_VERSION}-{mode}-{EXTRACTION_MODE}", model_key())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            event("cache.hit")
+            return cached
+
+    prepared = prepare_document(filename, content, near_duplicates=near_duplicates is not None)
+    return complete_document(prepared, digest, cache, cache_key, mode, near_duplicates)
+
+def complete_document(prepared, digest=None, cache=None, cache_key=None, mode=None, near_duplicates=None):
+    """
+    I/O-bound half of classify_and_route: near-duplicate reuse, the LLM calls and
+    the result metadata, for a dict from prepare_document(). digest is the content
+    hash the near-duplicate index records the document under.
+    """
+    mode = mode or PIPELINE_MODE
+    filename, file_format = prepared["filename"], prepared["file_format"]
+
+    if "structured" in prepared:
+        result, sample_text = prepared["structured"]
+        intent, llm_error = label_intent(filename, sample_text)
+        return finish(cache, cache_key, file_format, intent, result, "json_mapping", llm_error)
+
+    parsed_content, prefill, wanted = prepared["parsed_content"], prepared["prefill"], prepared["wanted"]
+    intent = prepared["intent"]
+    tier_stats.record(*prepared["local_tier"])
+    attachments = start_attachments(prepared.get("attachments"), mode, near_duplicates)
+
+    # A resend or forward of a known document reuses its extraction instead of calling the LLM
+    sig = None
+    if near_duplicates is not None:
+        with span("near_duplicate") as current:
+            sig = prepared["signature"] if "signature" in prepared else signature(parsed_content)
+            match = near_duplicates.query(sig)
+            earlier = near_duplicates.store.fetch_latest_by_hash(match[0]) if match else None
+            current.set(similarity=match[1] if match else None, found=earlier is not None)
+        if earlier is not None:
+            log_id, earlier_intent, previous = earlier
+            result, changed = reuse_near_duplicate(prefill, previous)
+            result["near_duplicate_of"] = {"log_id": log_id, "content_hash": match[0],
+                                           "similarity": round(match[1], 3)}
+            result["changed_fields"] = changed
+            near_duplicates.add(digest, sig)
+            return finish(cache, cache_key, file_format, earlier_intent, result, "near_duplicate",
+                          attachments=attachments)
+
+    ai_result = None
+    llm_error = None
+    # Long documents in map-reduce mode get a separate label call and parallel chunk extraction
+    map_reduce = EXTRACTION_MODE == "map_reduce" and count_tokens(parsed_content) > PROMPT_TOKEN_BUDGET
+
+    try:
+        # One round-trip for both intent and extraction; separate calls only fill what failed
+        if intent is None:
+            started = time.perf_counter()
+            if mode == "fused" and wanted and not map_reduce:
+                intent, ai_result = classify_and_extract(parsed_content, wanted)
+                if intent is None or ai_result is None:
+                    event("fallback.separate_calls", intent=intent is not None, extraction=ai_result is not None)
+            if intent is None:
+                intent = llm_intent(parsed_content)
+            tier_stats.record("llm", time.perf_counter() - started)
+
+        if ai_result is None and wanted:
+            if map_reduce:
+                ai_result = extract_map_reduce(parsed_content, wanted)
+            else:
+                ai_result = extract_fields(parsed_content, wanted)
+    except LLMError as e:
+        # No network: fall back to the local verdicts rather than failing the document
+        logger.warning(f"LLM unavailable for {filename}, using local results: {str(e)}")
+        llm_error = str(e)
+        event("fallback.local", error=type(e).__name__, intent=intent is None)
+        if intent is None:
+            intent = classify_local(parsed_content)[0]
+
+    result = merge_extraction(prefill, ai_result)
+    if ai_result is None:
+        extraction_method = "regex"
+    elif len(wanted) < len(EXTRACTION_SCHEMA):
+        extraction_method = "regex+nvidia_ai"
+    else:
+        extraction_method = "nvidia_ai"
+
+    if sig is not None and not llm_error:
+        near_duplicates.add(digest, sig)
+    return finish(cache, cache_key, file_format, intent, result, extraction_method, llm_error, attachments)
+
+def llm_intent(text):
+    """classify_intent() checked against ALLOWED_INTENTS; an unusable label falls back to the rule-based tier"""
+    label = classify_intent(text)
+    intent = normalize_intent(label)
+    if intent is None:
+        logger.warning(f"LLM returned an unknown intent {str(label)[:40]!r}, using the local intent")
+        event("fallback.local_intent", label=str(label)[:40])
+        intent = classify_local(text)[0]
+    return intent
+
+def label_intent(filename, text):
+    """Intent only: local rules, then a single LLM label call; returns (intent, llm_error)"""
+    intent, _ = classify_with_threshold(text)
+    if intent is not None:
+        return intent, None
+    started = time.perf_counter()
+    try:
+        intent = llm_intent(text)
+    except LLMError as e:
+        logger.warning(f"LLM unavailable for {filename}, using local intent: {str(e)}")
+        event("fallback.local", error=type(e).__name__, intent=True)
+        return classify_local(text)[0], str(e)
+    tier_stats.record("llm", time.perf_counter() - started)
+    return intent, None
+
+def finish(cache, cache_key, file_format, intent, result, extraction_method, llm_error=None, attachments=None):
+    # Add metadata to result
+    result.update({
+        "file_format": file_format,
+        "extraction_method": extraction_method,
+        "processed_at": datetime.now().isoformat()
+    })
+    if llm_error:
+        result["llm_error"] = llm_error
+    if attachments is not None:
+        result["attachments"] = attachments()
+        # A failed attachment keeps the whole email out of the cache so it is retried next time
+        llm_error = llm_error or next((entry.get("error") or entry["extracted"]["llm_error"]
+                                       for entry in result["attachments"]
+                                       if "error" in entry or "llm_error" in entry["extracted"]), None)
+    metrics.inc("documents_total", format=file_format, method=extraction_method)
+
+    # Convert result dict to JSON string for database storage
+    try:
+        result_str = json.dumps(result)
+    except TypeError:
+        result_str = json.dumps({"error": "Failed to serialize result"})
+
+    # Only cache clean results so failed extractions are retried next time
+    if cache_key is not None and not llm_error and "error" not in result:
+        cache.put(cache_key, file_format, intent, result)
+
+    return file_format, intent, result
@@ -1,6 +1,7 @@
 # agents/email_agent.py
 
 from utils.client import query_nvidia
+from utils.chunker import select_text
 
 def email(email_content: str) -> str:
     prompt = f"""
@@ -13,7 +14,7 @@ Given this email, extract the following:
 
 Email:
 \"\"\"
-{email_content}
+{select_text(email_content)}
 \"\"\"
 """
     return query_nvidia(prompt)
@@ -1,9 +1,243 @@
 # agents/json_agent.py
 
+import io
 import json
+import logging
+import os
+import re
+
+from utils.file_parser import check_size, DocumentError
+from utils.tracing import metrics
+
+logger = logging.getLogger(__name__)
 
 TARGET_FIELDS = ["customer_name", "order_id", "items", "total_price"]
 
+# Output field -> JSONPath-style selectors. List fields collect every match,
+# scalar fields take the first one. Override with a JSON file via JSON_FIELD_MAPPINGS.
+DEFAULT_FIELD_MAPPINGS = {
+    "sender": ["$.sender", "$.from", "$.seller.name", "$.vendor.name", "$.supplier.name", "$.company.name"],
+    "recipients": ["$.recipients[*]", "$.to", "$.buyer.name", "$.customer.name", "$.customer_name", "$.bill_to.name"],
+    "dates": ["$.date", "$.invoice_date", "$.order_date", "$.due_date", "$.created_at"],
+    "emails": ["$..email", "$..emails[*]"],
+    "amounts": ["$.total_amount", "$.total", "$.total_price", "$.amount", "$.subtotal", "$.tax_amount"],
+    "key_details": {
+        "invoice_number": ["$.invoice_number", "$.invoice_id", "$.invoice_no"],
+        "order_id": ["$.order_id", "$.order_number", "$.po_number"],
+        "customer_name": ["$.customer_name", "$.customer.name", "$.buyer.name"],
+        "items": ["$.items", "$.line_items"],
+        "total_price": ["$.total_price", "$.total_amount", "$.total"],
+        "currency": ["$.currency"],
+        "notes": ["$.notes", "$.message", "$.body"],
+    },
+}
+LIST_FIELDS = {"recipients", "dates", "emails", "amounts"}
+
+# A document counts as mapped once this many output fields were found
+MIN_MAPPED_FIELDS = 2
+
+# Arrays of records are decoded incrementally from chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+# Records mapped per document; the rest are skipped and the result is marked "truncated"
+MAX_STREAMED_RECORDS = int(os.getenv("JSON_MAX_RECORDS", "10000"))
+
+_PATH_TOKEN = re.compile(r"\.\.(\w+)|\.(\w+)|\[(\d+)\]|\[\*\]|\['([^']+)'\]|\[\"([^\"]+)\"\]")
+
+
+def load_field_mappings():
+    path = os.getenv("JSON_FIELD_MAPPINGS")
+    if not path:
+        return DEFAULT_FIELD_MAPPINGS
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _descend(node, key):
+    """Every value stored under key at any depth below node"""
+    if isinstance(node, dict):
+        for k, value in node.items():
+            if k == key:
+                yield value
+            yield from _descend(value, key)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _descend(value, key)
+
+
+def select(data, path):
+    """
+    Evaluate a JSONPath subset against data and return the list of matches.
+    Supported: $ root, .key, ['key'], [n], [*] and ..key recursive descent.
+    """
+    if not path.startswith("$"):
+        raise ValueError(f"Selector must start with '$': {path}")
+    nodes = [data]
+    position = 1
+    while position < len(path):
+        match = _PATH_TOKEN.match(path, position)
+        if not match:
+            raise ValueError(f"Unsupported selector syntax at {path[position:]!r} in {path}")
+        position = match.end()
+        recursive, key, index, quoted_single, quoted_double = match.groups()
+        key = key or quoted_single or quoted_double
+        next_nodes = []
+        for node in nodes:
+            if recursive:
+                next_nodes.extend(_descend(node, recursive))
+            elif key is not None:
+                if isinstance(node, dict) and key in node:
+                    next_nodes.append(node[key])
+            elif index is not None:
+                if isinstance(node, list) and int(index) < len(node):
+                    next_nodes.append(node[int(index)])
+            elif isinstance(node, list):
+                next_nodes.extend(node)
+            elif isinstance(node, dict):
+                next_nodes.extend(node.values())
+        nodes = next_nodes
+    return [node for node in nodes if node is not None]
+
+
+def _first(data, selectors):
+    for selector in selectors:
+        matches = select(data, selector)
+        if matches:
+            return matches[0]
+    return None
+
+
+def _collect(data, selectors):
+    values = []
+    for selector in selectors:
+        for match in select(data, selector):
+            for value in (match if isinstance(match, list) else [match]):
+                if value not in values:
+                    values.append(value)
+    return values or None
+
+
+def map_record(record, mappings=None):
+    """Apply the field mappings to one JSON record; returns (result, number of fields found)"""
+    mappings = mappings or load_field_mappings()
+    result = {}
+    for field, selectors in mappings.items():
+        if isinstance(selectors, dict):
+            details = {name: _first(record, paths) for name, paths in selectors.items()}
+            result[field] = {name: value for name, value in details.items() if value is not None} or None
+        elif field in LIST_FIELDS:
+            result[field] = _collect(record, selectors)
+        else:
+            result[field] = _first(record, selectors)
+    return result, sum(1 for value in result.values() if value)
+
+
+def _open_text_stream(content):
+    if isinstance(content, os.PathLike):
+        return open(content, encoding="utf-8")
+    if isinstance(content, (bytes, bytearray)):
+        return io.TextIOWrapper(io.BytesIO(content), encoding="utf-8")
+    if isinstance(content, str):
+        return io.StringIO(content)
+    if isinstance(content, io.TextIOBase):
+        return content
+    # Binary file objects such as uploads or BytesIO
+    return io.TextIOWrapper(content, encoding="utf-8")
+
+
+def iter_json_records(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield the records of a top-level JSON array one at a time without loading
+    the whole document. Any other top-level value is yielded as a single record.
+    """
+    decoder = json.JSONDecoder()
+    buffer = stream.read(chunk_size).lstrip("﻿ \t\r\n")
+    if not buffer.startswith("["):
+        yield json.loads(buffer + stream.read())
+        return
+
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position >= len(buffer):
+                raise json.JSONDecodeError("Need more data", buffer, position)
+            record, end = decoder.raw_decode(buffer, position)
+            # A number or literal touching the end of the buffer may continue in the next chunk
+            if end < len(buffer) or eof:
+                yield record
+                position = end
+                continue
+        except json.JSONDecodeError:
+            if eof:
+                raise
+        more = stream.read(chunk_size)
+        eof = not more
+        buffer = buffer[position:] + more
+        position = 0
+
+
+def handle_json_document(content, mappings=None):
+    """
+    Extract a JSON document locally through the field mappings.
+    Returns (result, sample_text) where sample_text is a compact rendering of the
+    first record for intent classification, or None if the document is unmapped.
+    Arrays longer than MAX_STREAMED_RECORDS are cut short with "truncated": true.
+    """
+    check_size(content)
+    mappings = mappings or load_field_mappings()
+    # A caller's file object is rewound afterwards so an unmapped document can still be parsed from it
+    start = content.tell() if hasattr(content, "seek") and content.seekable() else None
+    stream = _open_text_stream(content)
+    truncated = False
+    try:
+        records = []
+        mapped = 0
+        first_record = None
+        for count, record in enumerate(iter_json_records(stream)):
+            if count == MAX_STREAMED_RECORDS:
+                truncated = True
+                break
+            if first_record is None:
+                first_record = record
+            result, found = map_record(record, mappings) if isinstance(record, dict) else ({}, 0)
+            if found >= MIN_MAPPED_FIELDS:
+                mapped += 1
+            records.append(result)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise DocumentError(f"Error parsing JSON: {str(e)}") from e
+    finally:
+        if stream is not content:
+            if isinstance(stream, io.TextIOWrapper) and stream.buffer is content:
+                # The caller's file stays open
+                stream.detach()
+            else:
+                stream.close()
+        if start is not None:
+            content.seek(start)
+
+    if truncated:
+        metrics.inc("json_records_truncated_total")
+        logger.warning(f"JSON document has more than {MAX_STREAMED_RECORDS} records; only the first "
+                       f"{MAX_STREAMED_RECORDS} were mapped (JSON_MAX_RECORDS)")
+
+    if not mapped:
+        return None
+
+    sample_text = json.dumps(first_record)[:4000]
+    if len(records) == 1 and not truncated:
+        return records[0], sample_text
+    return {
+        "record_count": len(records),
+        "unmapped_records": len(records) - mapped,
+        "truncated": truncated,
+        "records": records,
+    }, sample_text
+
+
 def handle_json(content: str) -> str:
     try:
         data = json.loads(content)
@@ -0,0 +1,302 @@
+# api.py
+# Headless HTTP service for the classifier pipeline:  uvicorn api:app --host 0.0.0.0 --port 8000
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse
+from dotenv import load_dotenv
+
+# Settings in .env must be in the environment before the pipeline modules read them
+load_dotenv()
+
+from agents.classifier_agent import classify_and_route
+from memory.archive import MemoryArchive
+from memory.batch_writer import BatchWriter
+from memory.memory_store import MemoryStore, LOG_COLUMNS
+from memory.near_duplicates import NearDuplicateIndex
+from memory.result_cache import ResultCache, content_hash
+from utils.batch_runner import load_document, SUPPORTED_EXTENSIONS
+from utils.file_parser import MAX_INPUT_BYTES, DocumentError
+from utils.job_workers import WorkerPool
+from utils.llm_router import router_stats
+from utils.tracing import metrics, start_trace
+
+logger = logging.getLogger(__name__)
+
+API_DB_FILE = os.getenv("API_DB_FILE", "memory.db")
+# Threads running synchronous classify_and_route calls; they mostly wait on the shared LLM client
+API_THREADS = int(os.getenv("API_THREADS", "64"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Where uploads are spooled; queued jobs keep their file here until they finish (default: the temp directory)
+SPOOL_DIR = os.getenv("API_SPOOL_DIR") or None
+
+LOG_FIELDS = [column.strip() for column in LOG_COLUMNS.split(",")]
+
+
+class Pipeline:
+    """Process-wide resources shared by every request"""
+
+    def __init__(self, db_file):
+        from memory.vector_index import VectorIndex  # deferred: numpy is only needed once the service starts
+
+        self.store = MemoryStore(db_file)
+        self.cache = ResultCache(self.store)
+        self.near_duplicates = NearDuplicateIndex(self.store)
+        self.vectors = VectorIndex(self.store)
+        self.archive = MemoryArchive(self.store)
+        self.writer = BatchWriter(self.store)
+        self.workers = WorkerPool(self.store, cache=self.cache, near_duplicates=self.near_duplicates,
+                                  writer=self.writer)
+        self.jobs = self.workers.queue
+        self.executor = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix="api")
+
+    def start(self):
+        self.workers.start()
+        self.archive.start()
+
+    def close(self):
+        self.archive.stop(timeout=5)
+        self.workers.stop(timeout=5)
+        self.executor.shutdown(wait=True)
+        self.writer.close()
+        self.vectors.close()
+        self.store.close()
+
+    def process(self, filename, path):
+        """Synchronous pipeline run for one spooled upload; logged through the shared writer"""
+        content = load_document(path)
+        with start_trace("document", source=filename) as trace:
+            file_format, intent, result = classify_and_route(filename, content, cache=self.cache,
+                                                             near_duplicates=self.near_duplicates)
+        digest = content_hash(content)
+        # The writer stores the trace's summary once the row is written, including its time in the queue
+        self.writer.log(source=filename, filetype=file_format, intent=intent, extracted=result,
+                        content_hash=digest, trace=trace)
+        return {"format": file_format, "intent": intent, "content_hash": digest, "result": result,
+                "trace": trace.summary()}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.pipeline = Pipeline(API_DB_FILE)
+    app.state.pipeline.start()
+    try:
+        yield
+    finally:
+        app.state.pipeline.close()
+
+
+app = FastAPI(title="Multi-Agent AI Classifier", lifespan=lifespan)
+
+
+def check_filename(filename):
+    if not filename or not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(415, f"Unsupported file type; expected one of {', '.join(SUPPORTED_EXTENSIONS)}")
+    return os.path.basename(filename)
+
+
+async def spool(chunks, filename):
+    """Write an upload stream to a temporary file without holding it in memory; returns the path"""
+    suffix = os.path.splitext(filename)[1].lower()
+    handle, path = tempfile.mkstemp(suffix=suffix, prefix="upload-", dir=SPOOL_DIR)
+    size = 0
+    try:
+        with os.fdopen(handle, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_INPUT_BYTES:
+                    raise HTTPException(413, f"Upload larger than the {MAX_INPUT_BYTES} byte limit")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+async def upload_chunks(upload):
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def submit(request, filename, path, wait):
+    """Run now and return the result, or queue the document and return its job id"""
+    pipeline = request.app.state.pipeline
+    loop = asyncio.get_running_loop()
+    try:
+        if wait:
+            try:
+                return await loop.run_in_executor(pipeline.executor, pipeline.process, filename, path)
+            except DocumentError as e:
+                # The document's fault (too large, corrupt, empty); anything else is a server error
+                raise HTTPException(422, f"Could not process {filename}: {str(e)}")
+        # The job keeps the spooled file, which the queue deletes once the job is finished
+        job_id = await loop.run_in_executor(pipeline.executor, pipeline.jobs.enqueue_file, filename, path)
+        path = None
+        pipeline.workers.notify()
+        return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+    finally:
+        if path is not None:
+            os.unlink(path)
+
+
+@app.post("/documents")
+async def create_document(request: Request, file: UploadFile = File(...), wait: bool = True):
+    """Multipart upload of one document; wait=false queues it as a job"""
+    filename = check_filename(file.filename)
+    path = await spool(upload_chunks(file), filename)
+    return await submit(request, filename, path, wait)
+
+
+@app.post("/documents/raw")
+async def create_raw_document(request: Request, filename: str = Query(...), wait: bool = True):
+    """Raw request body streamed straight to disk, e.g. curl --data-binary @invoice.pdf"""
+    filename = check_filename(filename)
+    path = await spool(request.stream(), filename)
+    return await submit(request, filename, path, wait)
+
+
+@app.post("/batches", status_code=202)
+async def create_batch(request: Request, files: List[UploadFile] = File(...)):
+    """Queue several documents under one batch id"""
+    pipeline = request.app.state.pipeline
+    loop = asyncio.get_running_loop()
+    batch_id = pipeline.jobs.new_batch_id()
+    job_ids = []
+    for upload in files:
+        filename = check_filename(upload.filename)
+        path = await spool(upload_chunks(upload), filename)
+        try:
+            job_ids.append(await loop.run_in_executor(pipeline.executor, pipeline.jobs.enqueue_file,
+                                                      filename, path, batch_id))
+        except BaseException:
+            os.unlink(path)
+            raise
+    pipeline.workers.notify()
+    return {"batch_id": batch_id, "job_ids": job_ids}
+
+
+def job_view(pipeline, job):
+    if job["status"] == "done" and job["log_id"]:
+        entry = pipeline.store.fetch_log(job["log_id"])
+        if entry:
+            job = dict(job, result=json.loads(entry[4]))
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(request: Request, job_id: int):
+    pipeline = request.app.state.pipeline
+    job = pipeline.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return job_view(pipeline, job)
+
+
+@app.get("/batches/{batch_id}")
+def get_batch(request: Request, batch_id: str, limit: int = Query(500, le=5000)):
+    pipeline = request.app.state.pipeline
+    jobs = pipeline.jobs.jobs(batch_ids=[batch_id], limit=limit)
+    if not jobs:
+        raise HTTPException(404, "Unknown batch")
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return {"batch_id": batch_id, "counts": counts, "jobs": jobs}
+
+
+def log_view(entry):
+    log = dict(zip(LOG_FIELDS, entry))
+    try:
+        log["extracted"] = json.loads(log["extracted"])
+    except (TypeError, ValueError):
+        pass
+    return log
+
+
+@app.get("/logs")
+def list_logs(request: Request, intent: Optional[str] = None, sender: Optional[str] = None,
+              date_from: Optional[str] = None, date_to: Optional[str] = None,
+              limit: int = Query(20, le=500), offset: int = 0):
+    store = request.app.state.pipeline.store
+    logs = store.fetch_logs(intent_filter=intent, limit=limit, offset=offset,
+                            date_from=date_from, date_to=date_to, sender=sender)
+    return [log_view(entry) for entry in logs]
+
+
+@app.get("/logs/{log_id}")
+def get_log(request: Request, log_id: int, trace: bool = False):
+    store = request.app.state.pipeline.store
+    entry = store.fetch_log(log_id)
+    if entry is None:
+        raise HTTPException(404, "Unknown log")
+    log = log_view(entry)
+    children = store.fetch_children(log_id)
+    if children:
+        # Documents attached to this email, logged on their own
+        log["attachments"] = [log_view(child) for child in children]
+    if trace:
+        log["trace"] = store.fetch_trace(log_id)
+    return log
+
+
+@app.get("/search")
+def search_logs(request: Request, q: str, limit: int = Query(10, le=200), offset: int = 0):
+    try:
+        logs = request.app.state.pipeline.store.search(q, limit=limit, offset=offset)
+    except Exception as e:
+        raise HTTPException(400, f"Invalid search query: {str(e)}")
+    return [log_view(entry) for entry in logs]
+
+
+def similar_view(results):
+    return [dict(log_view(entry), score=round(score, 4)) for score, entry in results]
+
+
+@app.get("/similar")
+def similar_logs(request: Request, q: str, k: int = Query(10, ge=1, le=200), intent: Optional[str] = None):
+    return similar_view(request.app.state.pipeline.vectors.similar_logs(q, k=k, intent=intent))
+
+
+@app.get("/logs/{log_id}/similar")
+def similar_to_log(request: Request, log_id: int, k: int = Query(10, ge=1, le=200), intent: Optional[str] = None):
+    pipeline = request.app.state.pipeline
+    if pipeline.store.fetch_log(log_id) is None:
+        raise HTTPException(404, "Unknown log")
+    return similar_view(pipeline.vectors.similar_logs(log_id=log_id, k=k, intent=intent))
+
+
+@app.get("/health")
+def health(request: Request):
+    pipeline = request.app.state.pipeline
+    try:
+        pipeline.store.conn.execute("SELECT 1").fetchone()
+    except Exception as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=503)
+    return {"status": "ok", "jobs": pipeline.jobs.counts(), "writer": pipeline.writer.stats(),
+            "llm_backends": router_stats(), "maintenance": pipeline.archive.last_report}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the classifier HTTP API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
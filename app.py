@@ -1,32 +1,69 @@
 # app.py
 
 import streamlit as st
-from agents.classifier_agent import classify_and_route
-from memory.memory_store import MemoryStore
 from dotenv import load_dotenv
-import json
-import hashlib
 
+# Settings in .env must be in the environment before the pipeline modules read them
 load_dotenv()
 
+from memory.archive import MemoryArchive
+from memory.memory_store import MemoryStore
+from memory.result_cache import ResultCache
+from memory.near_duplicates import NearDuplicateIndex
+from memory.vector_index import VectorIndex
+from utils.intent_classifier import ALLOWED_INTENTS
+from utils.local_classifier import tier_stats
+from utils.job_workers import WorkerPool
+import json
+import re
+
 st.set_page_config(page_title="Multi-Agent AI Classifier", layout="wide")
 st.title("📂 Multi-Agent AI Classifier")
 
 st.sidebar.header("Upload or Paste Data")
 
-uploaded_file = st.sidebar.file_uploader("Choose a file", type=["pdf", "json", "txt", "eml"])
+uploaded_files = st.sidebar.file_uploader(
+    "Choose files", type=["pdf", "json", "txt", "eml"], accept_multiple_files=True
+)
 raw_text = st.sidebar.text_area("Add text content", help="Paste any text, email or JSON content here")
 submit_button = st.sidebar.button("Process")
 
-# Create a single MemoryStore instance
-memory_store = MemoryStore()
+@st.cache_resource
+def get_memory_store():
+    # One thread-safe store per server process instead of a new connection on every rerun
+    return MemoryStore()
+
+@st.cache_resource
+def get_vector_index():
+    # Registers as a store listener, so it must exist before the workers start logging
+    return VectorIndex(get_memory_store())
+
+@st.cache_resource
+def get_memory_archive():
+    # Archives, compacts and vacuums the log in the background (see memory/archive.py)
+    return MemoryArchive(get_memory_store()).start()
+
+@st.cache_resource
+def get_worker_pool():
+    # Started once per server process and shared by every session
+    store = get_memory_store()
+    return WorkerPool(store, cache=ResultCache(store), near_duplicates=NearDuplicateIndex(store)).start()
+
+memory_store = get_memory_store()
+vector_index = get_vector_index()
+get_memory_archive()
+result_cache = ResultCache(memory_store)
+worker_pool = get_worker_pool()
+job_queue = worker_pool.queue
+
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b-\x1f]')
 
 def clean_content(content: str) -> str:
     """Clean and sanitize content before processing"""
     if isinstance(content, bytes):
         content = content.decode('utf-8', errors='ignore')
     # Remove null bytes and other control characters except newlines and tabs
-    return ''.join(char for char in content if char >= ' ' or char in '\n\t')
+    return CONTROL_CHARS.sub('', content)
 
 def is_json_file(filename, content):
     """Validate if the content is valid JSON"""
@@ -43,81 +80,83 @@ def is_json_file(filename, content):
             return False
     return False
 
-# Replace the processing section
+# Uploads are queued and processed by background workers, so the page never blocks on the LLM
 if submit_button:
-    content = None
-    file_name = "manual_input.txt"
-
-    try:
-        if uploaded_file:
-            file_name = uploaded_file.name
-            file_bytes = uploaded_file.read()
-            # For PDFs, keep as bytes; for others, decode to string
-            if file_name.lower().endswith(".pdf"):
-                content = file_bytes
-            else:
-                try:
-                    content = file_bytes.decode('utf-8', errors='ignore')
-                except Exception:
-                    content = file_bytes  # fallback to bytes if decode fails
-
-            # If it's a JSON file, validate it
-            if file_name.lower().endswith(".json"):
-                try:
-                    json.loads(content)
-                except Exception:
-                    st.error("Invalid JSON file format")
-                    st.stop()
-
-        elif raw_text.strip():
-            content = clean_content(raw_text)
-            file_name = "text_input.txt"
-        else:
-            st.warning("Please upload a file or add text content.")
-            st.stop()
-
-        # Deduplication: always hash bytes
-        if isinstance(content, str):
-            content_bytes = content.encode()
+    documents = []
+    for uploaded_file in uploaded_files or []:
+        file_name = uploaded_file.name
+        file_bytes = uploaded_file.read()
+        # For PDFs and emails (MIME-parsed with their attachments), keep as bytes; for others, decode to string
+        if file_name.lower().endswith((".pdf", ".eml")):
+            content = file_bytes
         else:
-            content_bytes = content
-        content_hash = hashlib.md5(content_bytes).hexdigest()
-        file_identifier = f"{file_name}_{content_hash}"
+            content = file_bytes.decode('utf-8', errors='ignore')
 
-        if content is None:
-            st.error("No content to process")
-            st.stop()
-
-        # Process file
-        with st.spinner("Classifying and Routing..."):
+        # If it's a JSON file, validate it
+        if file_name.lower().endswith(".json"):
             try:
-                file_format, intent, result = classify_and_route(file_name, content)
-                st.success(f"{file_format} file processed successfully.")
-
-                try:
-                    memory_store.log(
-                        source=file_name,
-                        filetype=file_format,
-                        intent=intent,
-                        extracted=result
-                    )
-                    
-                except Exception as e:
-                    st.error(f"Failed to save to database: {str(e)}")
-
-                st.subheader("📌 Results")
-                st.markdown(f"- **Format**: `{file_format}`")
-                st.markdown(f"- **Intent**: `{intent}`")
-                st.subheader("🧠 Extracted Information")
-                st.code(result, language="markdown")
-
-            except Exception as e:
-                st.error(f"Error during classification: {str(e)}")
-                st.stop()
-
-    except Exception as e:
-        st.error(f"Error processing file: {str(e)}")
-        st.stop()
+                json.loads(content)
+            except Exception:
+                st.error(f"Invalid JSON file format: {file_name}")
+                continue
+        documents.append((file_name, content))
+
+    if raw_text.strip():
+        documents.append(("text_input.txt", clean_content(raw_text)))
+
+    if not documents:
+        st.warning("Please upload a file or add text content.")
+    else:
+        batch_id = job_queue.new_batch_id()
+        for file_name, content in documents:
+            job_queue.enqueue(file_name, content, batch_id=batch_id)
+        st.session_state.setdefault("batch_ids", []).append(batch_id)
+        worker_pool.notify()
+        st.success(f"Queued {len(documents)} document(s) for processing.")
+
+STATUS_ICONS = {"queued": "🕒", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+@st.fragment(run_every=2)
+def show_jobs():
+    batch_ids = st.session_state.get("batch_ids")
+    if not batch_ids:
+        return
+    st.subheader("📦 Jobs")
+    counts = job_queue.counts()
+    st.caption(f"Queue: {counts['queued']} queued, {counts['running']} running, "
+               f"{counts['done']} done, {counts['failed']} failed")
+    for job in job_queue.jobs(batch_ids=batch_ids):
+        label = f"{STATUS_ICONS.get(job['status'], '')} #{job['id']} {job['source']}"
+        if job["status"] in ("queued", "running"):
+            st.progress(job["progress"], text=f"{label} · {job['stage']}")
+        elif job["status"] == "failed":
+            st.error(f"{label}: {job['error']}")
+        else:
+            with st.expander(f"{label} · {job['file_format']} · {job['intent']}"):
+                entry = memory_store.fetch_log(job["log_id"]) if job["log_id"] else None
+                if entry:
+                    st.markdown(f"- **Format**: `{job['file_format']}`")
+                    st.markdown(f"- **Intent**: `{job['intent']}`")
+                    st.markdown("**🧠 Extracted Information**")
+                    st.code(entry[4], language="json")
+                    trace = memory_store.fetch_trace(job["log_id"])
+                    if trace:
+                        st.markdown(f"**⏱️ Trace** ({trace['total_ms']:.0f} ms)")
+                        st.json(trace, expanded=False)
+
+show_jobs()
+
+cache_stats = result_cache.stats()
+st.sidebar.markdown("---")
+st.sidebar.caption(
+    f"Result cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+    f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries"
+)
+for tier, stats in tier_stats.snapshot().items():
+    st.sidebar.caption(
+        f"Intent tier `{tier}`: {stats['count']} ({stats['hit_rate']:.0%}), "
+        f"{stats['avg_latency_ms']:.1f} ms avg"
+    )
 
 # --- Memory Log Section ---
 st.markdown("---")
@@ -127,19 +166,49 @@ st.header("📝 Memory Log")
 intents_in_db = memory_store.fetch_intents()
 
 # Only allow these intents for filtering
-allowed_intents = [
-    "Email",
-    "Email+Invoice", 
-    "Email+RFQ", 
-    "Email+Complaint", 
-    "Email+Regulation"
-]
+allowed_intents = ALLOWED_INTENTS
 # Filter only allowed intents and add "All"
 intents = ["All"] + [i for i in allowed_intents if i in intents_in_db]
 selected_intent = st.selectbox("Filter by Intent", intents)
 
+col_search, col_similar, col_sender, col_page = st.columns([3, 3, 2, 1])
+search_query = col_search.text_input("Full-text search", help="SQLite FTS5 syntax, e.g. invoice AND acme")
+similar_query = col_similar.text_input("Similar to", help="Finds logs about the same thing, even without shared keywords")
+sender_filter = col_sender.text_input("Sender starts with")
+page = col_page.number_input("Page", min_value=1, value=1, step=1)
+page_size = 10
+
+# Similarity score per log id, for the entries found by a semantic search
+scores = {}
+similar_to = st.session_state.get("similar_to")
+if similar_to is not None:
+    st.caption(f"Logs similar to log {similar_to}")
+    if st.button("Clear similar logs"):
+        st.session_state.pop("similar_to")
+        st.rerun()
+
 # Fetch logs based on allowed intent
-logs = memory_store.fetch_logs(intent_filter=selected_intent, limit=10)
+intent_filter = None if selected_intent == "All" else selected_intent
+if similar_to is not None or similar_query.strip():
+    results = vector_index.similar_logs(
+        text=similar_query if similar_to is None else None, log_id=similar_to,
+        k=page * page_size, intent=intent_filter
+    )[(page - 1) * page_size:]
+    logs = [entry for _, entry in results]
+    scores = {entry[0]: score for score, entry in results}
+elif search_query.strip():
+    try:
+        logs = memory_store.search(search_query, limit=page_size, offset=(page - 1) * page_size)
+    except Exception as e:
+        st.error(f"Invalid search query: {str(e)}")
+        logs = []
+else:
+    logs = memory_store.fetch_logs(
+        intent_filter=selected_intent,
+        limit=page_size,
+        offset=(page - 1) * page_size,
+        sender=sender_filter.strip() or None
+    )
 
 if st.button("Delete All Logs"):
     memory_store.delete_all_logs()
@@ -150,18 +219,18 @@ if logs:
         log_id, source, filetype, intent, extracted, timestamp = entry
         # Only show logs with allowed intents
         if intent in allowed_intents:
-            with st.expander(f"ID: {log_id} | {intent} | {source} | {timestamp}"):
+            score = f" | similarity {scores[log_id]:.2f}" if log_id in scores else ""
+            with st.expander(f"ID: {log_id} | {intent} | {source} | {timestamp}{score}"):
                 st.markdown(f"**Type:** {filetype}")
                 st.markdown(f"**Intent:** {intent}")
                 st.markdown(f"**Extracted:**\n```\n{extracted}\n```")
                 st.markdown(f"**Timestamp:** {timestamp}")
+                if st.button("Find similar", key=f"similar_{log_id}"):
+                    st.session_state["similar_to"] = log_id
+                    st.rerun()
                 if st.button(f"Delete Log {log_id}", key=f"delete_{log_id}"):
                     memory_store.delete_log(log_id)
                     st.success(f"Log {log_id} deleted. Please refresh the page.")
 else:
     st.info("No logs found for the selected intent.")
 
-# At the very end of the file, close the connection
-if __name__ == '__main__':
-    # Close connection when app exits
-    memory_store.conn.close()
@@ -0,0 +1,178 @@
+# benchmarks/corpus.py
+# Synthetic documents modelled on sample_input/: JSON invoices, complaint/RFQ/invoice
+# emails and multi-page text PDFs, generated at configurable sizes without extra dependencies.
+import argparse
+import json
+import os
+import random
+import textwrap
+from datetime import date, timedelta
+
+VENDORS = ["Tech Solutions Pvt. Ltd.", "Acme Components", "Bright Circuits LLC", "Nordic Supply AB"]
+CUSTOMERS = ["Sameer Beedi", "Priya Nair", "John Carter", "Mei Lin"]
+PRODUCTS = [("Arduino Uno R3 Board", 850.0), ("Jumper Wire Set (Male to Female)", 150.0),
+            ("Breadboard (400 Points)", 120.0), ("Raspberry Pi 4 (4GB)", 4500.0),
+            ("USB-C Power Supply", 650.0), ("Servo Motor SG90", 180.0)]
+
+EMAIL_BODIES = {
+    "Complaint": ("Complaint regarding order {order}",
+                  "I am writing to complain about order {order}. The {product} arrived damaged and "
+                  "does not work. I am very disappointed with the service and request a refund or a replacement."),
+    "RFQ": ("Request for quotation - {product}",
+            "Please quote your best price and lead time for {qty} units of {product}. "
+            "We also need your minimum order quantity and payment terms."),
+    "Invoice": ("Invoice {invoice} for order {order}",
+                "Please find the invoice {invoice} for order {order}. The total amount due is "
+                "INR {total:,.2f} and payment is due by {due}."),
+    "Regulation": ("Compliance update: data retention regulation",
+                   "Under the new regulation effective from {due}, all suppliers must follow the updated "
+                   "compliance policy. Section 4.2 of the directive describes the audit requirements."),
+}
+
+
+def _line_items(rng, count):
+    items = []
+    for _ in range(count):
+        description, unit_price = rng.choice(PRODUCTS)
+        quantity = rng.randint(1, 10)
+        items.append({"description": description, "quantity": quantity,
+                      "unit_price": unit_price, "total_price": round(unit_price * quantity, 2)})
+    return items
+
+
+def json_invoice(rng, index, items=3):
+    issued = date(2025, 1, 1) + timedelta(days=rng.randint(0, 365))
+    line_items = _line_items(rng, items)
+    subtotal = round(sum(item["total_price"] for item in line_items), 2)
+    vendor, customer = rng.choice(VENDORS), rng.choice(CUSTOMERS)
+    return {
+        "invoice_number": f"INV-{1000 + index}",
+        "invoice_date": issued.isoformat(),
+        "due_date": (issued + timedelta(days=14)).isoformat(),
+        "seller": {"name": vendor, "email": f"sales@{vendor.split()[0].lower()}.example.com"},
+        "buyer": {"name": customer, "email": f"{customer.split()[0].lower()}@example.com"},
+        "items": line_items,
+        "subtotal": subtotal,
+        "tax_rate": 0.18,
+        "tax_amount": round(subtotal * 0.18, 2),
+        "total_amount": round(subtotal * 1.18, 2),
+        "notes": "Thank you for your purchase. Payment is due within 14 days.",
+    }
+
+
+def email_text(rng, index, intent=None, paragraphs=3):
+    intent = intent or rng.choice(list(EMAIL_BODIES))
+    subject, body = EMAIL_BODIES[intent]
+    customer, vendor = rng.choice(CUSTOMERS), rng.choice(VENDORS)
+    fields = {
+        "order": f"PO-{5000 + index}", "invoice": f"INV-{1000 + index}",
+        "product": rng.choice(PRODUCTS)[0], "qty": rng.randint(10, 500),
+        "total": rng.uniform(500, 50000),
+        "due": (date(2025, 1, 1) + timedelta(days=rng.randint(0, 365))).strftime("%B %d, %Y"),
+    }
+    filler = ("We appreciate your prompt attention to this matter and look forward to your response. "
+              "Please let us know if any further information is required from our side.")
+    lines = [
+        f"From: {customer} <{customer.split()[0].lower()}@example.com>",
+        f"To: support@{vendor.split()[0].lower()}.example.com",
+        f"Subject: {subject.format(**fields)}",
+        f"Date: {fields['due']}",
+        "",
+        f"Dear {vendor} team,",
+        "",
+        body.format(**fields),
+    ]
+    lines += ["", filler] * max(0, paragraphs - 1)
+    lines += ["", "Regards,", customer]
+    return "\n".join(lines), intent
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def text_pdf(pages_of_lines):
+    """Minimal single-font PDF with one text page per entry of pages_of_lines"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    for lines in pages_of_lines:
+        stream = "BT /F1 10 Tf 50 780 Td 13 TL " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects.append((content_id, f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream"))
+        objects.append((page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                                 f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"))
+        page_ids.append(page_id)
+    objects.append((1, "<< /Type /Catalog /Pages 2 0 R >>"))
+    objects.append((2, f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in page_ids)}] /Count {len(page_ids)} >>"))
+    objects.append((font_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id, body in objects:
+        offsets[object_id] = len(out)
+        out += f"{object_id} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for object_id in range(1, len(objects) + 1):
+        out += f"{offsets[object_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def pdf_document(rng, index, pages=2):
+    text, intent = email_text(rng, index, paragraphs=4)
+    lines = [line.encode("latin-1", errors="replace").decode("latin-1") for line in text.splitlines()]
+    # Wrap long lines so they fit the page, then repeat the body across pages
+    wrapped = [part for line in lines for part in (textwrap.wrap(line, 95) or [""])]
+    return text_pdf([wrapped[:55] for _ in range(pages)]), intent
+
+
+def generate_corpus(out_dir, count=30, pdf_pages=2, json_items=3, email_paragraphs=3, seed=7):
+    """
+    Write count documents (an even mix of JSON, email and PDF) into out_dir and
+    return a list of {"path", "format", "intent"} entries, also saved as manifest.jsonl.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = []
+    for index in range(count):
+        kind = ("json", "email", "pdf")[index % 3]
+        if kind == "json":
+            path = os.path.join(out_dir, f"invoice_{index:05d}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(json_invoice(rng, index, json_items), f, indent=4)
+            intent = "Invoice"
+        elif kind == "email":
+            path = os.path.join(out_dir, f"email_{index:05d}.txt")
+            text, intent = email_text(rng, index, paragraphs=email_paragraphs)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            path = os.path.join(out_dir, f"document_{index:05d}.pdf")
+            data, intent = pdf_document(rng, index, pdf_pages)
+            with open(path, "wb") as f:
+                f.write(data)
+        manifest.append({"path": os.path.basename(path), "format": kind, "intent": f"Email+{intent}"})
+
+    with open(os.path.join(out_dir, "manifest.jsonl"), "w", encoding="utf-8") as f:
+        for entry in manifest:
+            f.write(json.dumps(entry) + "\n")
+    return [dict(entry, path=os.path.join(out_dir, entry["path"])) for entry in manifest]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark corpus")
+    parser.add_argument("out_dir")
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--pdf-pages", type=int, default=2)
+    parser.add_argument("--json-items", type=int, default=3)
+    parser.add_argument("--email-paragraphs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    docs = generate_corpus(args.out_dir, args.count, args.pdf_pages, args.json_items,
+                           args.email_paragraphs, args.seed)
+    print(f"Wrote {len(docs)} documents to {args.out_dir}")
@@ -0,0 +1,89 @@
+# benchmarks/import_budget.py
+# Startup budget check: importing the pipeline must stay cheap and must not pull in
+# the LLM client stack or the PDF parser until a document actually needs them.
+#
+#   python -m benchmarks.import_budget                  # exit 1 when over budget
+#   IMPORT_BUDGET_MS=150 python -m benchmarks.import_budget
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+MODULES = ["agents.classifier_agent", "utils.batch_runner", "memory.memory_store", "api", "app"]
+# Loaded on first use only: LLM calls, PDF parsing, vector search and .env loading in the entry points
+DEFERRED = ["openai", "httpx", "pdfplumber", "pdfminer", "numpy", "dotenv", "http.server"]
+# The servers load .env on import, and the Streamlit script builds the vector index as it runs
+ALLOWED = {"api": ["dotenv"], "app": ["dotenv", "numpy"]}
+# Web frameworks the servers import; their cost is not counted against the budget
+FRAMEWORKS = ["fastapi", "streamlit"]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+PROBE = """
+import json, sys
+sys.path.insert(0, {root!r})
+import {module}
+print(json.dumps(sorted(name for name in {deferred!r} if name in sys.modules)))
+"""
+
+
+def measure(module, root):
+    """
+    Cumulative import time of module in a fresh interpreter, less any FRAMEWORKS it imports,
+    and the deferred modules it loaded beyond its ALLOWED ones
+    """
+    deferred = [name for name in DEFERRED if name not in ALLOWED.get(module, [])]
+    # Importing the Streamlit script runs it, so files it creates (memory.db) go to a scratch directory
+    with tempfile.TemporaryDirectory() as scratch:
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, root=root, deferred=deferred)],
+            cwd=scratch, capture_output=True, text=True, check=True
+        )
+    cumulative_us = None
+    framework_us = 0
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        # The top-level entry for the module is the one with no nesting indent
+        if match.group(4) == module and len(match.group(3)) <= 1:
+            cumulative_us = int(match.group(2))
+        elif match.group(4) in FRAMEWORKS:
+            framework_us += int(match.group(2))
+    if cumulative_us is None:
+        raise RuntimeError(f"python -X importtime reported no import of {module}")
+    loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+    return (cumulative_us - framework_us) / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when importing the pipeline gets slow or eager")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N fresh interpreters")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failures = []
+    report = {}
+    for module in MODULES:
+        runs = [measure(module, root) for _ in range(args.repeat)]
+        best_ms = min(ms for ms, _ in runs)
+        loaded = runs[0][1]
+        report[module] = {"import_ms": round(best_ms, 1), "deferred_loaded": loaded}
+        if best_ms > args.budget_ms:
+            failures.append(f"{module} took {best_ms:.1f} ms to import (budget {args.budget_ms:.0f} ms)")
+        if loaded:
+            failures.append(f"{module} eagerly imports {', '.join(loaded)}")
+
+    print(json.dumps({"budget_ms": args.budget_ms, "modules": report}, indent=2))
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
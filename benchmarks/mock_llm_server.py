@@ -0,0 +1,220 @@
+# benchmarks/mock_llm_server.py
+# Local OpenAI-compatible /v1/chat/completions stub (plain and SSE streaming) with configurable
+# latency, per-token generation time and failure rates. Point NVIDIA_BASE_URL at it to exercise
+# the pipeline without the hosted API.
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_FIELD_LINE = re.compile(r"^\s*- (\w+):", re.MULTILINE)
+_LABEL_KEYWORDS = [
+    ("Email+Complaint", ("complain", "damaged", "refund")),
+    ("Email+RFQ", ("quotation", "please quote", "rfq")),
+    ("Email+Regulation", ("regulation", "compliance", "directive")),
+    ("Email+Invoice", ("invoice", "amount due", "total_amount")),
+]
+_SAMPLE_VALUES = {
+    "sender": "Mock Sender",
+    "recipients": ["support@example.com"],
+    "dates": ["2025-05-29"],
+    "emails": ["mock@example.com"],
+    "amounts": ["$100.00"],
+    "key_details": {"summary": "mock extraction"},
+}
+
+
+def damage(content, rng):
+    """The ways real models break JSON: fences and prose, trailing commas, Python quoting, max_tokens cut-offs"""
+    data = json.loads(content)
+    kind = rng.choice(("fence", "trailing_comma", "single_quotes", "truncated"))
+    if kind == "fence":
+        return f"Here is the JSON:\n```json\n{json.dumps(data, indent=2)}\n```"
+    if kind == "trailing_comma":
+        return content[:-1] + ",}"
+    if kind == "single_quotes":
+        return repr(data)
+    return content[:int(len(content) * 0.7)]
+
+
+def guess_label(prompt):
+    lowered = prompt.lower()
+    for label, keywords in _LABEL_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return label
+    return "Email"
+
+
+def mock_reply(prompt):
+    """Answer the pipeline's prompt shapes: label only, fused intent+extraction, or extraction"""
+    if "Return only the label" in prompt:
+        # Models tend to explain themselves after the label
+        label = guess_label(prompt)
+        return f"{label}\n\nThe content matches the {label} intent based on its wording and the fields it mentions."
+    fields_section = prompt.split("fields:", 1)[-1]
+    fields = _FIELD_LINE.findall(fields_section) or list(_SAMPLE_VALUES)
+    extraction = {field: _SAMPLE_VALUES.get(field, "mock") for field in fields if field not in ("intent", "extraction")}
+    if "two keys" in prompt:
+        return json.dumps({"intent": guess_label(prompt), "extraction": extraction})
+    return json.dumps(extraction)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Keep up with benchmark concurrency without refusing connections
+    request_queue_size = 256
+
+    def __init__(self, address, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0, rate_limit_rate=0.0,
+                 malformed_rate=0.0, token_ms=0.0, seed=None):
+        super().__init__(address, MockLLMHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.token_ms = token_ms
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def draw(self):
+        with self.rng_lock:
+            self.requests += 1
+            latency = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return latency, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, 200
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request, content, finish_reason, usage):
+        """Server-sent events in chat.completion.chunk format, one ~4 character token per event"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        base = {"id": f"mock-{self.server.requests}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": request.get("model", "mock")}
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+        try:
+            for index, piece in enumerate(pieces):
+                time.sleep(self.server.token_ms / 1000)
+                delta = {"content": piece, **({"role": "assistant"} if index == 0 else {})}
+                last = index == len(pieces) - 1
+                send(dict(base, choices=[{"index": 0, "delta": delta,
+                                          "finish_reason": finish_reason if last else None}]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send(dict(base, choices=[], usage=usage))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            self.close_connection = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        latency, status = self.server.draw()
+        time.sleep(latency)
+        if status == 429:
+            self._send_json(429, {"error": {"message": "Rate limited (mock)"}}, {"Retry-After": "0"})
+            return
+        if status == 500:
+            self._send_json(500, {"error": {"message": "Internal error (mock)"}})
+            return
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        content = mock_reply(prompt)
+        if content.startswith("{") and self.server.malformed_rate:
+            with self.server.rng_lock:
+                if self.server.rng.random() < self.server.malformed_rate:
+                    content = damage(content, self.server.rng)
+        finish_reason = "stop"
+        max_chars = 4 * (request.get("max_tokens") or 0)
+        if max_chars and len(content) > max_chars:
+            content, finish_reason = content[:max_chars], "length"
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        completion_tokens = max(1, len(content) // 4)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if request.get("stream"):
+            self._send_stream(request, content, finish_reason, usage)
+            return
+
+        time.sleep(self.server.token_ms * completion_tokens / 1000)
+        self._send_json(200, {
+            "id": f"mock-{self.server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """Start the mock on a background thread; returns the server (see server.base_url)"""
+    server = MockLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Generation time per completion token")
+    args = parser.parse_args()
+    server = MockLLMServer((args.host, args.port), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                           malformed_rate=args.malformed_rate, token_ms=args.token_ms)
+    print(f"Mock LLM server listening on {server.base_url}")
+    server.serve_forever()
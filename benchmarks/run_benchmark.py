@@ -0,0 +1,223 @@
+# benchmarks/run_benchmark.py
+# End-to-end pipeline benchmark against the local mock LLM server.
+#
+#   python -m benchmarks.run_benchmark --docs 60 --workers 8 --latency-ms 80 --output bench.json
+#   python -m benchmarks.run_benchmark --baseline bench.json   # exit 1 on regression
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.mock_llm_server import start_mock_server
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(samples, percentile):
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(1000 * sum(samples) / len(samples), 3),
+        "p50_ms": round(1000 * percentile(samples, 50), 3),
+        "p95_ms": round(1000 * percentile(samples, 95), 3),
+        "p99_ms": round(1000 * percentile(samples, 99), 3),
+        "max_ms": round(1000 * max(samples), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - started
+
+
+def run(args):
+    server = start_mock_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                               malformed_rate=args.malformed_rate, token_ms=args.token_ms, seed=args.seed)
+    local = None
+    if args.local_latency_ms is not None:
+        # A second mock standing in for a small local model that only labels and repairs
+        local = start_mock_server(latency_ms=args.local_latency_ms, jitter_ms=args.jitter_ms / 4,
+                                  token_ms=args.token_ms / 4, seed=args.seed + 1)
+        os.environ["LLM_BACKENDS"] = json.dumps([
+            {"name": "remote", "base_url": server.base_url, "model": "mock-large", "cost_per_1k_tokens": 1.0},
+            {"name": "local", "base_url": local.base_url, "model": "mock-small", "api_key_env": None,
+             "tasks": ["classify", "repair"]},
+        ])
+    # The client reads its configuration at import time, so set it before importing the pipeline
+    os.environ["NVIDIA_BASE_URL"] = server.base_url
+    os.environ.setdefault("NVIDIA_API_KEY", "mock")
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+    os.environ.setdefault("LLM_MAX_RETRIES", "2")
+
+    from agents.classifier_agent import classify_and_route, PARSE_CHAR_BUDGET
+    from memory.batch_writer import BatchWriter
+    from memory.memory_store import MemoryStore
+    from utils.batch_runner import load_document, percentile, run_batch
+    from utils.file_parser import read_file
+    from utils.intent_classifier import classify_intent
+    from utils.llm_router import router_stats
+    from utils.tracing import metrics
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = generate_corpus(os.path.join(tmp, "corpus"), args.docs, args.pdf_pages,
+                                 args.json_items, args.email_paragraphs, args.seed)
+        documents = [(os.path.basename(d["path"]), load_document(d["path"])) for d in corpus]
+
+        # Stage 1: parsing only
+        parsed, samples = [], []
+        for name, content in documents:
+            text, elapsed = timed(read_file, name, content, max_chars=PARSE_CHAR_BUDGET)
+            parsed.append(text)
+            samples.append(elapsed)
+        stages["read_file"] = summarize(samples, percentile)
+
+        # Stage 2: a single intent call per document
+        samples, errors = [], 0
+        for text in parsed:
+            try:
+                samples.append(timed(classify_intent, text)[1])
+            except Exception:
+                errors += 1
+        stages["classify_intent"] = dict(summarize(samples, percentile), errors=errors)
+
+        # Stage 3: the full pipeline with concurrent workers
+        def route(document):
+            return timed(classify_and_route, *document)
+
+        started = time.perf_counter()
+        outcomes, errors = [], 0
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for future in [executor.submit(route, document) for document in documents]:
+                try:
+                    outcomes.append(future.result())
+                except Exception:
+                    errors += 1
+        wall = time.perf_counter() - started
+        llm_fallbacks = sum(1 for (_, _, result), _ in outcomes if "llm_error" in result)
+        stages["classify_and_route"] = dict(
+            summarize([elapsed for _, elapsed in outcomes], percentile),
+            errors=errors,
+            llm_fallbacks=llm_fallbacks,
+            docs_per_sec=round(len(outcomes) / wall, 3) if wall else 0.0,
+        )
+        replies = {status: metrics.total("json_parse_total", status=status) for status in ("ok", "repaired", "invalid")}
+        stages["json_replies"] = dict(
+            replies,
+            repair_rate=round(replies["repaired"] / max(1, sum(replies.values())), 3),
+            reprompts=metrics.total("llm_requests_total", task="repair"),
+        )
+
+        # Stage 3b: the same documents through run_batch's process-pool parse stage and LLM stage
+        store = MemoryStore(os.path.join(tmp, "staged.db"))
+        report, _ = run_batch([d["path"] for d in corpus], store, workers=args.workers, resume=False,
+                              parse_workers=args.parse_workers)
+        store.close()
+        stages["staged_pipeline"] = {key: report[key] for key in
+                                     ("processed", "failed", "parse_workers", "docs_per_sec", "latency_p50_s",
+                                      "latency_p95_s")}
+
+        llm_backends = router_stats()
+
+        # Stage 4: persistence, per-row commits and the batched writer
+        store = MemoryStore(os.path.join(tmp, "bench.db"))
+        rows = [(name, fmt, intent, result) for (name, _), ((fmt, intent, result), _) in zip(documents, outcomes)]
+        rows = (rows * (args.db_rows // max(1, len(rows)) + 1))[:args.db_rows]
+        samples = [timed(store.log, *row)[1] for row in rows]
+        stages["memory_store_log"] = dict(summarize(samples, percentile),
+                                          rows_per_sec=round(len(samples) / sum(samples), 1) if samples else 0.0)
+        writer = BatchWriter(store)
+        started = time.perf_counter()
+        for row in rows:
+            writer.log(*row)
+        writer.close()
+        elapsed = time.perf_counter() - started
+        stages["memory_store_batch_writer"] = {"count": len(rows),
+                                               "rows_per_sec": round(len(rows) / elapsed, 1) if elapsed else 0.0}
+        store.close()
+
+    server.shutdown()
+    if local is not None:
+        local.shutdown()
+    return {
+        "config": vars(args),
+        "stages": stages,
+        "docs_per_sec": stages["classify_and_route"].get("docs_per_sec", 0.0),
+        "mock_requests": server.requests,
+        "llm_backends": llm_backends,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of regressions: p95 latencies up or throughput down by more than tolerance"""
+    regressions = []
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage, {})
+        if "p95_ms" in current and previous.get("p95_ms"):
+            if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{stage}.p95_ms {previous['p95_ms']} -> {current['p95_ms']}")
+        for key in ("docs_per_sec", "rows_per_sec"):
+            if key in current and previous.get(key):
+                if current[key] < previous[key] * (1 - tolerance):
+                    regressions.append(f"{stage}.{key} {previous[key]} -> {current[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the classifier pipeline against a mock LLM")
+    parser.add_argument("--docs", type=int, default=30, help="Documents in the synthetic corpus")
+    parser.add_argument("--pdf-pages", type=int, default=2)
+    parser.add_argument("--json-items", type=int, default=3)
+    parser.add_argument("--email-paragraphs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1,
+                        help="Parse processes for the staged_pipeline stage (default: one per core, like PARSE_WORKERS)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean mock LLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock calls answering 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of mock calls answering 429")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Mock generation time per completion token")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of mock JSON replies that are fenced, badly quoted or truncated")
+    parser.add_argument("--local-latency-ms", type=float,
+                        help="Also route intent labels and repairs to a second, free mock backend with this latency")
+    parser.add_argument("--db-rows", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Previous JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,19 +1,72 @@
 # main.py
-import sys
-from agents.classifier_agent import classify_and_route
-from utils.file_parser import read_file
-from memory.memory_store import log_result
+import argparse
+import json
+import logging
 
-def main(file_path):
-    content = read_file(file_path)
-    file_format, intent, result = classify_and_route(file_path, content)
+from dotenv import load_dotenv
 
-    log_result(file_path, file_format, intent, result)
-    print("Classification:", file_format, intent)
-    print("Output:\n", result)
+# Settings in .env must be in the environment before the pipeline modules read them
+load_dotenv()
+
+from memory.memory_store import MemoryStore
+from memory.batch_writer import BatchWriter
+from memory.near_duplicates import NearDuplicateIndex
+from utils.batch_runner import discover_inputs, run_batch
+from utils.staged_pipeline import PARSE_WORKERS, LLM_WORKERS, STAGE_QUEUE_SIZE
+from utils.tracing import start_metrics_server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Classify and extract documents in bulk and log them to the memory store."
+    )
+    parser.add_argument("targets", nargs="+", help="Files, directories, glob patterns or .jsonl manifests")
+    parser.add_argument("--workers", type=int, default=LLM_WORKERS,
+                        help="Documents in the LLM stage at once; size it to the API rate limit")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="Processes parsing documents ahead of the LLM stage (default: one per core); "
+                             "0 parses on the LLM threads")
+    parser.add_argument("--queue-size", type=int, default=STAGE_QUEUE_SIZE,
+                        help="Parsed documents waiting for the LLM stage before parsing pauses (0: 2x --parse-workers)")
+    parser.add_argument("--db", default="memory.db", help="MemoryStore database file")
+    parser.add_argument("--summary", default="batch_summary.json", help="Where to write the per-document summary")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocess documents already in the store")
+    parser.add_argument("--no-near-duplicates", action="store_true",
+                        help="Do not reuse extractions of near-identical earlier documents")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while running")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    paths = discover_inputs(args.targets)
+    if not paths:
+        print("No input files found.")
+        return 1
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    store = MemoryStore(args.db)
+    writer = BatchWriter(store)
+    try:
+        report, records = run_batch(
+            paths,
+            store,
+            workers=args.workers,
+            parse_workers=args.parse_workers,
+            queue_size=args.queue_size,
+            summary_path=args.summary,
+            resume=not args.no_resume,
+            writer=writer,
+            near_duplicates=None if args.no_near_duplicates else NearDuplicateIndex(store)
+        )
+    finally:
+        writer.close()
+        store.close()
+
+    for record in records:
+        print(f"[{record['status']}] {record['path']} {record.get('format', '')} {record.get('intent', '')}".rstrip())
+    print("Report:\n", json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <input_file>")
-    else:
-        main(sys.argv[1])
+    raise SystemExit(main())
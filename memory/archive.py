@@ -0,0 +1,512 @@
+# memory/archive.py
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # Optional: archives are written with zlib when zstandard is not installed
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Logs older than this move from the memory table into compressed monthly archive chunks; 0 never archives.
+# Off by default: archived logs drop out of full-text search (MemoryStore.search).
+ARCHIVE_AFTER_DAYS = float(os.getenv("MEMORY_ARCHIVE_AFTER_DAYS", "0"))
+# Logs older than this are dropped altogether; 0 keeps them forever
+RETENTION_DAYS = float(os.getenv("MEMORY_RETENTION_DAYS", "0"))
+MAINTENANCE_SECONDS = float(os.getenv("MEMORY_MAINTENANCE_SECONDS", "3600"))
+# Rows moved per write transaction, so writers never wait long for the database lock
+ARCHIVE_BATCH_ROWS = 250
+# Compaction merges a month's smaller chunks up to this many rows
+CHUNK_ROWS = 20000
+# Free pages handed back per incremental_vacuum transaction
+VACUUM_STEP_PAGES = 1000
+# Pause between maintenance transactions, letting queued writers in
+STEP_PAUSE_SECONDS = 0.05
+# Scans of the archive restarted when a chunk disappears under them before missing chunks are skipped
+ARCHIVE_READ_ATTEMPTS = 3
+
+CODEC = "zstd" if zstandard is not None else "zlib"
+# One compressed JSON array per column, small filter columns first: SQLite reads a row's
+# columns in order, so decoding them never touches the pages of the extracted/trace blobs.
+# parent_id is last only because a later migration added it.
+ARCHIVE_COLUMNS = ["ids", "timestamp", "intent", "sender", "type", "source", "content_hash",
+                   "amount_total", "doc_date", "extracted", "trace", "parent_id"]
+# memory table columns in ARCHIVE_COLUMNS order ("ids" is the id column)
+_MEMORY_COLUMNS = ["id"] + ARCHIVE_COLUMNS[1:]
+# LOG_COLUMNS of memory/memory_store.py
+_LOG_FIELDS = ["ids", "source", "type", "intent", "extracted", "timestamp"]
+_FILTER_FIELDS = ["ids", "timestamp", "intent", "sender"]
+
+
+def _compress(values):
+    data = json.dumps(values, separators=(",", ":"), default=str).encode()
+    if CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data), len(data)
+    return zlib.compress(data, 6), len(data)
+
+
+def _decompress(codec, blob):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive chunk is zstd-compressed; install zstandard to read it")
+        return json.loads(zstandard.ZstdDecompressor().decompress(blob))
+    return json.loads(zlib.decompress(blob))
+
+
+def read_chunk(conn, chunk_id, columns):
+    """{column: values} of one archive chunk; columns are names from ARCHIVE_COLUMNS"""
+    ordered = [column for column in ARCHIVE_COLUMNS if column in columns]
+    row = conn.execute(f"SELECT codec, row_count, {', '.join(ordered)} FROM memory_archive WHERE id = ?",
+                       (chunk_id,)).fetchone()
+    if row is None:
+        return None
+    # Columns added after a chunk was written are NULL there
+    return {column: _decompress(row[0], blob) if blob is not None else [None] * row[1]
+            for column, blob in zip(ordered, row[2:])}
+
+
+def _live_ids(conn, chunk_id, deleted):
+    if not deleted:
+        return None
+    return {row[0] for row in conn.execute("SELECT id FROM memory_archived WHERE chunk = ?", (chunk_id,))}
+
+
+def read_archived(conn, ids, columns=_LOG_FIELDS):
+    """{id: tuple of columns} for the archived logs among ids"""
+    ids = list(ids)
+    chunks = {}
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        for log_id, chunk_id in conn.execute(
+            f"SELECT id, chunk FROM memory_archived WHERE id IN ({', '.join('?' * len(batch))})", batch
+        ):
+            chunks.setdefault(chunk_id, set()).add(log_id)
+    rows = {}
+    for chunk_id, wanted in chunks.items():
+        data = read_chunk(conn, chunk_id, set(columns) | {"ids"})
+        if data is None:
+            # Rewritten by a concurrent compaction
+            continue
+        for index, log_id in enumerate(data["ids"]):
+            if log_id in wanted:
+                rows[log_id] = tuple(data[column][index] for column in columns)
+    return rows
+
+
+def iter_archived(conn, after_id=0, columns=_LOG_FIELDS):
+    """Archived logs with ids above after_id, a list of tuples of columns per chunk, oldest chunk first"""
+    chunks = conn.execute("SELECT id, deleted FROM memory_archive WHERE last_id > ? ORDER BY first_id",
+                          (after_id,)).fetchall()
+    for chunk_id, deleted in chunks:
+        data = read_chunk(conn, chunk_id, set(columns) | {"ids"})
+        if data is None:
+            # Rewritten by a concurrent compaction
+            continue
+        live = _live_ids(conn, chunk_id, deleted)
+        rows = [tuple(data[column][index] for column in columns) for index, log_id in enumerate(data["ids"])
+                if log_id > after_id and (live is None or log_id in live)]
+        if rows:
+            yield rows
+
+
+def fetch_archived_logs(conn, limit, offset=0, intent=None, lower=None, upper=None, upper_inclusive=True,
+                        sender=None):
+    """
+    Newest-first page of archived logs in LOG_COLUMNS order, filtered like
+    MemoryStore.fetch_logs (timestamps between lower and upper). Chunk metadata
+    skips chunks outside the date range or without the intent; only the filter
+    columns of the rest are decompressed until a page is filled.
+    """
+    clauses, params = [], []
+    if intent:
+        clauses.append("instr(intents, ?) > 0")
+        params.append(json.dumps(intent))
+    if lower:
+        clauses.append("max_timestamp >= ?")
+        params.append(lower)
+    if upper:
+        clauses.append("min_timestamp <= ?")
+        params.append(upper)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sender = sender.lower() if sender else None
+    # Compaction or retention may drop a chunk between the index query and its read; the
+    # scan then starts over from a fresh index, and the last attempt skips missing chunks
+    for attempt in range(ARCHIVE_READ_ATTEMPTS):
+        try:
+            return _archived_page(conn, where, params, limit, offset, intent, lower, upper, upper_inclusive,
+                                  sender, skip_missing=attempt == ARCHIVE_READ_ATTEMPTS - 1)
+        except _Changed:
+            logger.debug("Archive chunk rewritten during a read; re-querying the chunk index")
+
+
+def _archived_page(conn, where, params, limit, offset, intent, lower, upper, upper_inclusive, sender,
+                   skip_missing):
+    chunks = conn.execute(f"SELECT id, deleted FROM memory_archive {where} ORDER BY last_id DESC", params).fetchall()
+    results = []
+    for chunk_id, deleted in chunks:
+        data = read_chunk(conn, chunk_id, _FILTER_FIELDS)
+        if data is None:
+            if skip_missing:
+                continue
+            raise _Changed()
+        live = _live_ids(conn, chunk_id, deleted)
+        matches = []
+        for index in range(len(data["ids"]) - 1, -1, -1):
+            timestamp = data["timestamp"][index]
+            if live is not None and data["ids"][index] not in live:
+                continue
+            if intent and data["intent"][index] != intent:
+                continue
+            if lower and timestamp < lower:
+                continue
+            if upper and (timestamp > upper if upper_inclusive else timestamp >= upper):
+                continue
+            if sender and not (data["sender"][index] or "").lower().startswith(sender):
+                continue
+            matches.append(index)
+        if offset >= len(matches):
+            offset -= len(matches)
+            continue
+        matches, offset = matches[offset:offset + limit - len(results)], 0
+        rest = read_chunk(conn, chunk_id, ["source", "type", "extracted"])
+        if rest is None:
+            if skip_missing:
+                continue
+            raise _Changed()
+        data.update(rest)
+        results.extend(tuple(data[column][index] for column in _LOG_FIELDS) for index in matches)
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _encode_chunk(month, rows):
+    """Compressed chunk of rows (tuples in _MEMORY_COLUMNS order, sorted by id), ready for _insert_chunk()"""
+    columns = list(zip(*rows))
+    blobs, raw_bytes = [], 0
+    for values in columns:
+        blob, size = _compress(list(values))
+        blobs.append(blob)
+        raw_bytes += size
+    timestamps, intents = columns[1], sorted({intent for intent in columns[2] if intent})
+    params = (month, rows[0][0], rows[-1][0], len(rows), min(timestamps), max(timestamps), json.dumps(intents),
+              CODEC, raw_bytes, sum(len(blob) for blob in blobs), *blobs)
+    return params, [(row[0], row[6], row[11]) for row in rows]
+
+
+def _insert_chunk(conn, chunk):
+    params, ids = chunk
+    cursor = conn.execute(f'''
+        INSERT INTO memory_archive (month, first_id, last_id, row_count, min_timestamp, max_timestamp, intents,
+                                    codec, raw_bytes, stored_bytes, {', '.join(ARCHIVE_COLUMNS)})
+        VALUES ({', '.join('?' * len(params))})
+    ''', params)
+    chunk_id = cursor.lastrowid
+    conn.executemany("INSERT OR REPLACE INTO memory_archived (id, chunk, content_hash, parent_id) VALUES (?, ?, ?, ?)",
+                     [(log_id, chunk_id, digest, parent_id) for log_id, digest, parent_id in ids])
+    return chunk_id
+
+
+class _Changed(Exception):
+    """Rows prepared outside the write lock were changed by another connection meanwhile"""
+
+
+class MemoryArchive:
+    """
+    Lifecycle of the memory log. maintain() moves logs older than
+    ARCHIVE_AFTER_DAYS (when set) into compressed columnar chunks (one or more per month),
+    merges small or partly deleted chunks, drops everything older than
+    RETENTION_DAYS, then vacuums and re-analyses the database in small steps.
+    Every step is a short transaction of its own, so writers are never held up
+    for long. Archived logs stay readable through MemoryStore.fetch_logs,
+    fetch_log, fetch_trace and the content-hash lookups; full-text search only
+    covers logs that are not archived yet.
+    """
+
+    def __init__(self, store, archive_after_days=ARCHIVE_AFTER_DAYS, retention_days=RETENTION_DAYS):
+        self.store = store
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def conn(self):
+        return self.store.conn
+
+    @staticmethod
+    def _cutoff(days, now=None):
+        return ((now or datetime.datetime.now()) - datetime.timedelta(days=days)).isoformat()
+
+    def _transaction(self, step):
+        conn = self.conn
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = step(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        time.sleep(STEP_PAUSE_SECONDS)
+        return result
+
+    def archive(self, before=None):
+        """
+        Move logs older than before (an ISO timestamp, by default archive_after_days
+        ago) into archive chunks; returns the number moved. Nothing is archived by
+        default when archive_after_days is 0.
+        """
+        if before is None:
+            if not self.archive_after_days:
+                return 0
+            before = self._cutoff(self.archive_after_days)
+        moved = 0
+        while True:
+            # Oldest first through idx_memory_timestamp, so no sort over the whole backlog
+            rows = self.conn.execute(
+                f"SELECT {', '.join(_MEMORY_COLUMNS)} FROM memory WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                (before, ARCHIVE_BATCH_ROWS)
+            ).fetchall()
+            self.conn.commit()
+            if not rows:
+                return moved
+            months = {}
+            for row in rows:
+                months.setdefault(row[1][:7], []).append(row)
+            # Compressed before taking the write lock
+            chunks = [_encode_chunk(month, sorted(month_rows)) for month, month_rows in months.items()]
+
+            def step(conn):
+                deleted = conn.executemany("DELETE FROM memory WHERE id = ?", [(row[0],) for row in rows]).rowcount
+                if deleted != len(rows):
+                    raise _Changed()
+                for chunk in chunks:
+                    _insert_chunk(conn, chunk)
+
+            try:
+                self._transaction(step)
+            except _Changed:
+                continue
+            moved += len(rows)
+
+    def _mergeable(self, conn, month):
+        """Next run of chunks in month worth rewriting, as (id, deleted): small neighbours, or one with deleted logs"""
+        runs, run, live_total = [], [], 0
+        for chunk_id, row_count, deleted in conn.execute(
+            "SELECT id, row_count, deleted FROM memory_archive WHERE month = ? ORDER BY first_id", (month,)
+        ):
+            live = row_count - deleted
+            full = live >= CHUNK_ROWS and not deleted
+            if full or run and live_total + live > CHUNK_ROWS:
+                runs.append(run)
+                run, live_total = [], 0
+            if not full:
+                run.append((chunk_id, deleted))
+                live_total += live
+        runs.append(run)
+        for run in runs:
+            if len(run) > 1 or any(deleted for _, deleted in run):
+                return run
+        return []
+
+    def compact(self):
+        """Merge each month's small chunks and rewrite chunks holding deleted logs; returns chunks rewritten"""
+        conn = self.conn
+        months = [row[0] for row in conn.execute(
+            "SELECT month FROM memory_archive WHERE row_count < ? OR deleted > 0 GROUP BY month", (CHUNK_ROWS,)
+        )]
+        rewritten = 0
+        for month in months:
+            while True:
+                run = self._mergeable(conn, month)
+                if not run:
+                    break
+                rows = []
+                for chunk_id, deleted in run:
+                    data = read_chunk(conn, chunk_id, ARCHIVE_COLUMNS)
+                    live = _live_ids(conn, chunk_id, deleted)
+                    rows.extend(row for row in zip(*(data[column] for column in ARCHIVE_COLUMNS))
+                                if live is None or row[0] in live)
+                conn.commit()
+                rows.sort()
+                chunks = [_encode_chunk(month, rows[start:start + CHUNK_ROWS])
+                          for start in range(0, len(rows), CHUNK_ROWS)]
+
+                def step(conn):
+                    current = conn.execute(
+                        f"SELECT id, deleted FROM memory_archive WHERE id IN ({', '.join('?' * len(run))})",
+                        [chunk_id for chunk_id, _ in run]
+                    ).fetchall()
+                    if sorted(current) != sorted(run):
+                        raise _Changed()
+                    conn.executemany("DELETE FROM memory_archive WHERE id = ?", [(chunk_id,) for chunk_id, _ in run])
+                    for chunk in chunks:
+                        _insert_chunk(conn, chunk)
+
+                try:
+                    self._transaction(step)
+                except _Changed:
+                    continue
+                rewritten += len(run)
+        return rewritten
+
+    def apply_retention(self, before=None):
+        """Drop logs older than before (default RETENTION_DAYS); returns the number dropped"""
+        if before is None:
+            if not self.retention_days:
+                return 0
+            before = self._cutoff(self.retention_days)
+
+        def drop_rows(conn):
+            return conn.execute(
+                "DELETE FROM memory WHERE id IN (SELECT id FROM memory WHERE timestamp < ? LIMIT ?)",
+                (before, ARCHIVE_BATCH_ROWS)
+            ).rowcount
+
+        def drop_chunk(conn):
+            # Whole chunks go once all of their logs are past retention
+            row = conn.execute("SELECT id, row_count - deleted FROM memory_archive WHERE max_timestamp < ? LIMIT 1",
+                               (before,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM memory_archived WHERE chunk = ?", (row[0],))
+            conn.execute("DELETE FROM memory_archive WHERE id = ?", (row[0],))
+            return row[1]
+
+        dropped = 0
+        while True:
+            count = self._transaction(drop_rows)
+            dropped += count
+            if count < ARCHIVE_BATCH_ROWS:
+                break
+        while True:
+            count = self._transaction(drop_chunk)
+            if count is None:
+                return dropped
+            dropped += count
+
+    def vacuum(self, max_pages=None):
+        """
+        Return free pages to the file system a step at a time. Needs
+        auto_vacuum=INCREMENTAL, which new databases get; older ones need one
+        full enable_incremental_vacuum(). Returns the number of pages freed.
+        """
+        conn = self.conn
+        conn.commit()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        freed = 0
+        while max_pages is None or freed < max_pages:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            step = min(free, VACUUM_STEP_PAGES)
+            # execute() stops after the first page; executescript() steps the pragma to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({step})")
+            progress = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if progress <= 0:
+                break
+            freed += progress
+            time.sleep(STEP_PAUSE_SECONDS)
+        if freed:
+            # Moves the shrunken pages out of the WAL without waiting for readers
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return freed
+
+    def optimize(self):
+        """Refresh query planner statistics where they went stale, sampling at most ~1000 rows per index"""
+        conn = self.conn
+        conn.commit()
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("PRAGMA optimize").fetchall()
+
+    def enable_incremental_vacuum(self):
+        """One-off full VACUUM switching an older database to auto_vacuum=INCREMENTAL; blocks writers meanwhile"""
+        conn = self.conn
+        conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def maintain(self):
+        """Run one full maintenance pass; returns what each step did"""
+        started = time.perf_counter()
+        report = {
+            "dropped": self.apply_retention(),
+            "archived": self.archive(),
+            "chunks_compacted": self.compact(),
+            "pages_freed": self.vacuum(),
+        }
+        self.optimize()
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.last_report = report
+        logger.info(f"Memory maintenance: {report}")
+        return report
+
+    def stats(self):
+        """Row counts and compression of both tiers"""
+        conn = self.conn
+        chunks, archived, raw_bytes, stored_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(row_count - deleted), 0), COALESCE(SUM(raw_bytes), 0), "
+            "COALESCE(SUM(stored_bytes), 0) FROM memory_archive"
+        ).fetchone()
+        return {
+            "hot_rows": conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0],
+            "archived_rows": archived,
+            "chunks": chunks,
+            "compression_ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+            "codec": CODEC,
+            "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+            "freelist_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        }
+
+    def start(self, interval=MAINTENANCE_SECONDS):
+        """Run maintain() every interval seconds on a background thread"""
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.maintain()
+                except Exception as e:
+                    logger.error(f"Memory maintenance failed: {str(e)}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, name="memory-maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    import argparse
+    from memory.memory_store import MemoryStore
+
+    parser = argparse.ArgumentParser(description="Archive, compact and vacuum the memory log")
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--archive-after-days", type=float, default=ARCHIVE_AFTER_DAYS, help="0 never archives")
+    parser.add_argument("--retention-days", type=float, default=RETENTION_DAYS, help="0 keeps logs forever")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch an older database to incremental vacuum with one full VACUUM")
+    parser.add_argument("--stats", action="store_true", help="Only print tier sizes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = MemoryStore(args.db)
+    archive = MemoryArchive(store, args.archive_after_days, args.retention_days)
+    if args.enable_incremental_vacuum:
+        archive.enable_incremental_vacuum()
+    if not args.stats:
+        print(json.dumps(archive.maintain()))
+    print(json.dumps(archive.stats()))
+    store.close()
@@ -0,0 +1,207 @@
+# memory/job_queue.py
+import datetime
+import logging
+import os
+import pathlib
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 2
+# A running job not updated for this long is assumed to belong to a dead worker
+DEFAULT_STALE_SECONDS = 15 * 60
+
+JOB_COLUMNS = ("id, batch_id, source, status, progress, stage, attempts, error, "
+               "file_format, intent, log_id, created_at, started_at, finished_at")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    Document processing queue stored in the MemoryStore database, so no external
+    broker is needed. Producers enqueue() uploads, or enqueue_file() uploads already
+    spooled to disk; any number of worker threads or processes claim() jobs
+    atomically (BEGIN IMMEDIATE) and report progress.
+    """
+
+    def __init__(self, store, max_attempts=DEFAULT_MAX_ATTEMPTS, stale_seconds=DEFAULT_STALE_SECONDS):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.stale_seconds = stale_seconds
+        self.create_table()
+
+    @property
+    def conn(self):
+        # The store hands out a connection per thread
+        return self.store.conn
+
+    def create_table(self):
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT, source TEXT, payload BLOB, is_text INTEGER,
+            status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, stage TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0, error TEXT,
+            file_format TEXT, intent TEXT, log_id INTEGER, worker TEXT,
+            created_at TEXT, started_at TEXT, finished_at TEXT, heartbeat REAL, payload_path TEXT
+        )
+        ''')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        if 'payload_path' not in columns:
+            # Queues created before enqueue_file()
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN payload_path TEXT')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, id)')
+        self.conn.commit()
+
+    @staticmethod
+    def new_batch_id():
+        return uuid.uuid4().hex
+
+    def enqueue(self, source, content, batch_id=None):
+        """Queue one document (str or bytes) and return its job id"""
+        is_text = isinstance(content, str)
+        payload = content.encode() if is_text else bytes(content)
+        cursor = self.conn.execute('''
+        INSERT INTO jobs (batch_id, source, payload, is_text, status, stage, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (batch_id, source, payload, int(is_text), QUEUED, QUEUED, datetime.datetime.now().isoformat()))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def enqueue_file(self, source, path, batch_id=None):
+        """
+        Queue a document already written to path and return its job id. Only the
+        path is stored; the queue deletes the file once the job is done or failed.
+        """
+        cursor = self.conn.execute('''
+        INSERT INTO jobs (batch_id, source, payload_path, status, stage, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (batch_id, source, os.path.abspath(path), QUEUED, QUEUED, datetime.datetime.now().isoformat()))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def _payload_path(self, job_id):
+        row = self.conn.execute('SELECT payload_path FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _remove(path):
+        if path:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.warning(f"Could not remove spooled upload {path}: {str(e)}")
+
+    def claim(self, worker=None):
+        """
+        Atomically take the oldest queued job. Returns (job_id, source, content)
+        with content restored to str or bytes, or a pathlib.Path for jobs queued
+        with enqueue_file(); None when the queue is empty.
+        """
+        conn = self.conn
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, source, payload, is_text, payload_path FROM jobs WHERE status = ? ORDER BY id LIMIT 1',
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            job_id, source, payload, is_text, payload_path = row
+            conn.execute('''
+            UPDATE jobs SET status = ?, stage = 'claimed', progress = 0.05, attempts = attempts + 1,
+                            worker = ?, started_at = ?, heartbeat = ?, error = NULL
+            WHERE id = ?
+            ''', (RUNNING, worker or f"pid-{os.getpid()}", datetime.datetime.now().isoformat(), time.time(), job_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if payload_path:
+            return job_id, source, pathlib.Path(payload_path)
+        content = bytes(payload).decode("utf-8", errors="ignore") if is_text else bytes(payload)
+        return job_id, source, content
+
+    def progress(self, job_id, progress, stage):
+        self.conn.execute(
+            'UPDATE jobs SET progress = ?, stage = ?, heartbeat = ? WHERE id = ? AND status = ?',
+            (progress, stage, time.time(), job_id, RUNNING)
+        )
+        self.conn.commit()
+
+    def complete(self, job_id, file_format, intent, log_id=None):
+        # The payload is no longer needed once the result is in the memory log
+        path = self._payload_path(job_id)
+        self.conn.execute('''
+        UPDATE jobs SET status = ?, stage = ?, progress = 1.0, file_format = ?, intent = ?, log_id = ?,
+                        finished_at = ?, payload = NULL, payload_path = NULL
+        WHERE id = ?
+        ''', (DONE, DONE, file_format, intent, log_id, datetime.datetime.now().isoformat(), job_id))
+        self.conn.commit()
+        self._remove(path)
+
+    def fail(self, job_id, error):
+        """Requeue the job if it has attempts left, otherwise mark it failed"""
+        attempts = self.conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        retry = attempts is not None and attempts[0] < self.max_attempts
+        path = None
+        if retry:
+            self.conn.execute(
+                'UPDATE jobs SET status = ?, stage = ?, progress = 0, error = ? WHERE id = ?',
+                (QUEUED, "retrying", error, job_id)
+            )
+        else:
+            path = self._payload_path(job_id)
+            self.conn.execute('''
+            UPDATE jobs SET status = ?, stage = ?, error = ?, finished_at = ?, payload = NULL, payload_path = NULL
+            WHERE id = ?
+            ''', (FAILED, FAILED, error, datetime.datetime.now().isoformat(), job_id))
+        self.conn.commit()
+        self._remove(path)
+        return retry
+
+    def requeue_stale(self):
+        """Return jobs whose worker stopped sending progress to the queue; returns how many"""
+        cursor = self.conn.execute(
+            'UPDATE jobs SET status = ?, stage = ? WHERE status = ? AND heartbeat < ? '
+            'AND (payload IS NOT NULL OR payload_path IS NOT NULL)',
+            (QUEUED, "requeued", RUNNING, time.time() - self.stale_seconds)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def get(self, job_id):
+        """One job row as a dict, or None"""
+        row = self.conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip([column.strip() for column in JOB_COLUMNS.split(",")], row))
+
+    def jobs(self, batch_ids=None, limit=50):
+        """Newest-first job rows as dicts, optionally restricted to some batches"""
+        params = []
+        where = ""
+        if batch_ids:
+            batch_ids = list(batch_ids)
+            where = f"WHERE batch_id IN ({', '.join('?' * len(batch_ids))})"
+            params.extend(batch_ids)
+        cursor = self.conn.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs {where} ORDER BY id DESC LIMIT ?", (*params, limit)
+        )
+        names = [column.strip() for column in JOB_COLUMNS.split(",")]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def counts(self):
+        cursor = self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(cursor.fetchall()))
+        return counts
+
+    def clear_finished(self):
+        self.conn.execute('DELETE FROM jobs WHERE status IN (?, ?)', (DONE, FAILED))
+        self.conn.commit()
@@ -1,59 +1,358 @@
 # memory/memory_store.py
 import sqlite3
 import datetime
+import json
 import logging
+import threading
 import traceback
 
+from memory.migrations import migrate, promoted_fields, parse_extracted
+from memory.archive import fetch_archived_logs, read_archived
+from utils.tracing import Trace, resume_trace, span
+
 logger = logging.getLogger(__name__)
 
+LOG_COLUMNS = "id, source, type, intent, extracted, timestamp"
+
+INSERT_LOG = '''
+INSERT INTO memory (source, type, intent, extracted, timestamp, content_hash, sender, amount_total, doc_date, trace,
+                    parent_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Applied to every connection. WAL lets readers (the UI) run while a writer commits;
+# synchronous=NORMAL is durable across application crashes in WAL mode.
+CONNECTION_PRAGMAS = [
+    # Only takes effect on a new database; lets memory/archive.py free pages in small steps
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -32000",
+    "PRAGMA foreign_keys = ON",
+]
+
 class MemoryStore:
+    """
+    SQLite-backed log of processed documents. Each thread gets its own connection
+    (sqlite3 connections cannot be shared across threads), so one instance can be
+    used by the Streamlit UI and by background workers at the same time.
+    """
+
     def __init__(self, db_file='memory.db'):
-        self.conn = sqlite3.connect(db_file)
+        self.db_file = db_file
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._closed = False
+        # In-memory databases are private to their connection, so those share one
+        self._shared = self._connect() if db_file == ':memory:' else None
         self.create_table()
 
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=self.db_file != ':memory:')
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            if self._closed:
+                conn.close()
+                raise sqlite3.ProgrammingError("Cannot operate on a closed MemoryStore.")
+            self._connections.append(conn)
+        return conn
+
+    @property
+    def conn(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed MemoryStore.")
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def close(self):
+        """
+        Close the store for good. Later use raises instead of opening fresh connections,
+        so a thread still logging cannot end up writing to a connection nobody commits.
+        """
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Connections owned by other threads are closed when those threads exit
+                pass
+        self._shared = None
+
+    def add_listener(self, callback):
+        """
+        Call callback(rows) after logs are committed, with rows as
+        (id, source, filetype, intent, extracted) tuples, e.g. to keep an index current.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, rows):
+        for callback in self._listeners:
+            try:
+                callback(rows)
+            except Exception as e:
+                # The log is already committed; an index can catch up later
+                logger.warning(f"Log listener {callback!r} failed: {str(e)}")
+
     def create_table(self):
-        self.conn.execute('''
-        CREATE TABLE IF NOT EXISTS memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source TEXT, type TEXT, intent TEXT,
-            extracted TEXT, timestamp TEXT
-        )
-        ''')
+        # Creates the table on a fresh database and upgrades older ones (see memory/migrations.py)
+        migrate(self.conn)
+
+    @staticmethod
+    def _row(source, filetype, intent, extracted, content_hash=None, trace=None, parent_id=None):
+        sender, amount_total, doc_date = promoted_fields(extracted if isinstance(extracted, dict) else {})
+        if isinstance(trace, Trace):
+            trace = trace.summary()
+        return (source, filetype, intent, json.dumps(extracted, default=str), datetime.datetime.now().isoformat(),
+                content_hash, sender, amount_total, doc_date,
+                json.dumps(trace, default=str) if trace is not None else None, parent_id)
+
+    @staticmethod
+    def _split_attachments(extracted):
+        """
+        Classified email attachments (the "attachments" entries with an "extracted"
+        result, see classify_and_route) become logs of their own. Returns the
+        extraction to store, listing them without their results, and the child entries.
+        """
+        attachments = extracted.get("attachments") if isinstance(extracted, dict) else None
+        if not isinstance(attachments, list) or not any(isinstance(a, dict) and "extracted" in a for a in attachments):
+            return extracted, []
+        listed, children = [], []
+        for attachment in attachments:
+            if isinstance(attachment, dict) and "extracted" in attachment:
+                attachment = dict(attachment)
+                children.append({"source": attachment.get("filename"), "filetype": attachment.get("file_format"),
+                                 "intent": attachment.get("intent"), "extracted": attachment.pop("extracted"),
+                                 "content_hash": attachment.get("content_hash")})
+            listed.append(attachment)
+        return dict(extracted, attachments=listed), children
 
-    def log(self, source, filetype, intent, extracted):
+    def _insert_family(self, source, filetype, intent, extracted, content_hash=None, trace=None):
+        """Insert one log and its attachments; returns the (id, source, filetype, intent, extracted) rows written"""
+        extracted, children = self._split_attachments(extracted)
+        log_id = self.conn.execute(INSERT_LOG, self._row(source, filetype, intent, extracted, content_hash,
+                                                         trace)).lastrowid
+        rows = [(log_id, source, filetype, intent, extracted)]
+        for child in children:
+            child_id = self.conn.execute(INSERT_LOG, self._row(**child, parent_id=log_id)).lastrowid
+            rows.append((child_id, child["source"], child["filetype"], child["intent"], child["extracted"]))
+        return rows
+
+    def log(self, source, filetype, intent, extracted, content_hash=None, trace=None):
+        """
+        Insert one log (and its attachments); returns its id. trace is a trace
+        summary, or a utils.tracing.Trace whose summary is stored after the insert,
+        so it includes the db.log span.
+        """
         try:
-            self.conn.execute('''
-            INSERT INTO memory (source, type, intent, extracted, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (source, filetype, intent, str(extracted), datetime.datetime.now().isoformat()))
-            self.conn.commit()
+            if isinstance(trace, Trace):
+                with self.conn:
+                    with resume_trace(trace), span("db.log"):
+                        rows = self._insert_family(source, filetype, intent, extracted, content_hash)
+                    self.conn.execute('UPDATE memory SET trace = ? WHERE id = ?',
+                                      (json.dumps(trace.summary(), default=str), rows[0][0]))
+            else:
+                with span("db.log"), self.conn:
+                    rows = self._insert_family(source, filetype, intent, extracted, content_hash, trace)
             logger.info(f"Successfully inserted log for {source}")
+            if self._listeners:
+                self._notify(rows)
+            return rows[0][0]
         except Exception as e:
             logger.error(f"Database insertion error: {str(e)}")
             logger.error(f"Database traceback: {traceback.format_exc()}")
             raise
 
+    def log_many(self, entries):
+        """
+        Insert many logs in a single transaction. entries are dicts with the
+        keyword arguments of log(). Returns the number of rows written.
+        """
+        return self.log_batch(entries)[1]
+
+    def log_batch(self, entries):
+        """log_many() that returns (the id of each entry's log, number of rows written incl. attachments)"""
+        entries = list(entries)
+        if not entries:
+            return [], 0
+        if any(self._split_attachments(entry["extracted"])[1] for entry in entries):
+            # Children need their parent's id, so rows are inserted one at a time
+            try:
+                with span("db.log_many", rows=len(entries)), self.conn:
+                    families = [self._insert_family(**entry) for entry in entries]
+            except Exception as e:
+                logger.error(f"Database bulk insertion error ({len(entries)} logs): {str(e)}")
+                raise
+            written = [row for family in families for row in family]
+            if self._listeners:
+                self._notify(written)
+            return [family[0][0] for family in families], len(written)
+
+        rows = [self._row(**entry) for entry in entries]
+        try:
+            with span("db.log_many", rows=len(rows)), self.conn:
+                self.conn.executemany(INSERT_LOG, rows)
+                # One write transaction, so the new ids are consecutive
+                last_id = self.conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        except Exception as e:
+            logger.error(f"Database bulk insertion error ({len(rows)} rows): {str(e)}")
+            raise
+        ids = list(range(last_id - len(rows) + 1, last_id + 1))
+        if self._listeners:
+            self._notify([(log_id, entry["source"], entry["filetype"], entry["intent"], entry["extracted"])
+                          for log_id, entry in zip(ids, entries)])
+        return ids, len(rows)
+
     def delete_log(self, log_id):
-        self.conn.execute('DELETE FROM memory WHERE id = ?', (log_id,))
-        self.conn.commit()
+        with self.conn:
+            self.conn.execute('DELETE FROM memory WHERE id = ?', (log_id,))
+            # Archived logs are dropped from their chunk the next time it is compacted
+            self.conn.execute('''
+                UPDATE memory_archive SET deleted = deleted + 1
+                WHERE id = (SELECT chunk FROM memory_archived WHERE id = ?)
+            ''', (log_id,))
+            self.conn.execute('DELETE FROM memory_archived WHERE id = ?', (log_id,))
 
     def delete_all_logs(self):
-        self.conn.execute('DELETE FROM memory')
-        self.conn.commit()
-
-    def fetch_logs(self, intent_filter=None, limit=5):
-        if intent_filter and intent_filter != "All":
-            cursor = self.conn.execute(
-                "SELECT id, source, type, intent, extracted, timestamp FROM memory WHERE intent = ? ORDER BY id DESC LIMIT ?",
-                (intent_filter, limit)
-            )
-        else:
-            cursor = self.conn.execute(
-                "SELECT id, source, type, intent, extracted, timestamp FROM memory ORDER BY id DESC LIMIT ?",
-                (limit,)
-            )
+        with self.conn:
+            self.conn.execute('DELETE FROM memory')
+            self.conn.execute('DELETE FROM memory_archive')
+            self.conn.execute('DELETE FROM memory_archived')
+
+    def fetch_logs(self, intent_filter=None, limit=5, offset=0, date_from=None, date_to=None, sender=None):
+        """
+        Newest-first page of logs, continuing into archived logs (memory/archive.py)
+        past the newest ones. date_from/date_to are ISO dates or datetimes compared
+        against the processing timestamp (date_to is inclusive); sender is a case-insensitive prefix.
+        """
+        intent = intent_filter if intent_filter and intent_filter != "All" else None
+        lower = str(date_from) if date_from else None
+        upper, upper_inclusive = (str(date_to) if date_to else None), True
+        if upper and len(upper) == 10:
+            # A bare date includes the whole day
+            upper = (datetime.date.fromisoformat(upper) + datetime.timedelta(days=1)).isoformat()
+            upper_inclusive = False
+
+        clauses, params = [], []
+        if intent:
+            clauses.append("intent = ?")
+            params.append(intent)
+        if lower:
+            clauses.append("timestamp >= ?")
+            params.append(lower)
+        if upper:
+            clauses.append("timestamp <= ?" if upper_inclusive else "timestamp < ?")
+            params.append(upper)
+        if sender:
+            clauses.append("sender LIKE ?")
+            params.append(f"{sender}%")
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        logs = self.conn.execute(
+            f"SELECT {LOG_COLUMNS} FROM memory {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        ).fetchall()
+        if len(logs) < limit:
+            # The page ran past the newest logs; the rest comes from the archive
+            if logs or not offset:
+                newest = offset + len(logs)
+            else:
+                newest = self.conn.execute(f"SELECT COUNT(*) FROM memory {where}", params).fetchone()[0]
+            logs += fetch_archived_logs(self.conn, limit - len(logs), max(0, offset - newest), intent=intent,
+                                        lower=lower, upper=upper, upper_inclusive=upper_inclusive, sender=sender)
+        return logs
+
+    def search(self, query, limit=10, offset=0):
+        """Full-text search over source, intent, sender and the extracted JSON, best matches first"""
+        cursor = self.conn.execute(f'''
+            SELECT {', '.join('m.' + c.strip() for c in LOG_COLUMNS.split(','))}
+            FROM memory_fts JOIN memory m ON m.id = memory_fts.rowid
+            WHERE memory_fts MATCH ?
+            ORDER BY bm25(memory_fts) LIMIT ? OFFSET ?
+        ''', (query, limit, offset))
         return cursor.fetchall()
 
     def fetch_intents(self):
-        cursor = self.conn.execute("SELECT DISTINCT intent FROM memory")
-        return [row[0] for row in cursor.fetchall()]
+        # Skip-scan over idx_memory_intent: one index seek per distinct intent instead of a full scan
+        cursor = self.conn.execute('''
+            WITH RECURSIVE intents(value) AS (
+                SELECT MIN(intent) FROM memory
+                UNION ALL
+                SELECT (SELECT MIN(intent) FROM memory WHERE intent > value) FROM intents WHERE value IS NOT NULL
+            )
+            SELECT value FROM intents WHERE value IS NOT NULL
+            UNION
+            SELECT DISTINCT j.value FROM memory_archive, json_each(memory_archive.intents) j
+        ''')
+        return sorted(row[0] for row in cursor.fetchall())
+
+    def fetch_log(self, log_id):
+        cursor = self.conn.execute(f'SELECT {LOG_COLUMNS} FROM memory WHERE id = ?', (log_id,))
+        return cursor.fetchone() or read_archived(self.conn, [log_id]).get(log_id)
+
+    def fetch_many(self, log_ids):
+        """{id: row in LOG_COLUMNS order} for the logs among log_ids that exist, archived or not"""
+        log_ids = list(log_ids)
+        rows = {}
+        for start in range(0, len(log_ids), 500):
+            batch = log_ids[start:start + 500]
+            rows.update((row[0], row) for row in self.conn.execute(
+                f"SELECT {LOG_COLUMNS} FROM memory WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ))
+        missing = [log_id for log_id in log_ids if log_id not in rows]
+        if missing:
+            rows.update(read_archived(self.conn, missing))
+        return rows
+
+    def fetch_children(self, log_id):
+        """Logs of the attachments split off log log_id, archived or not, in LOG_COLUMNS order"""
+        rows = self.conn.execute(
+            f"SELECT {LOG_COLUMNS} FROM memory WHERE parent_id = ? ORDER BY id", (log_id,)
+        ).fetchall()
+        archived = [row[0] for row in self.conn.execute(
+            "SELECT id FROM memory_archived WHERE parent_id = ? ORDER BY id", (log_id,)
+        )]
+        if archived:
+            found = read_archived(self.conn, archived)
+            rows += [found[child_id] for child_id in archived if child_id in found]
+        return rows
+
+    def fetch_latest_by_hash(self, digest):
+        """(id, intent, extracted dict) of the newest log with this content hash, or None"""
+        row = self.conn.execute(
+            'SELECT id, intent, extracted FROM memory WHERE content_hash = ? ORDER BY id DESC LIMIT 1', (digest,)
+        ).fetchone()
+        if row is None:
+            archived = self.conn.execute(
+                'SELECT id FROM memory_archived WHERE content_hash = ? ORDER BY id DESC LIMIT 1', (digest,)
+            ).fetchone()
+            row = read_archived(self.conn, [archived[0]], ["ids", "intent", "extracted"]).get(archived[0]) \
+                if archived else None
+        if row is None:
+            return None
+        return row[0], row[1], parse_extracted(row[2])
+
+    def fetch_trace(self, log_id):
+        """The stored pipeline trace of one log, or None if it was logged without one"""
+        row = self.conn.execute('SELECT trace FROM memory WHERE id = ?', (log_id,)).fetchone()
+        if row is None:
+            row = read_archived(self.conn, [log_id], ["trace"]).get(log_id)
+        return json.loads(row[0]) if row and row[0] else None
+
+    def fetch_hashes(self):
+        cursor = self.conn.execute('''
+            SELECT content_hash FROM memory WHERE content_hash IS NOT NULL
+            UNION
+            SELECT content_hash FROM memory_archived WHERE content_hash IS NOT NULL
+        ''')
+        return {row[0] for row in cursor.fetchall()}
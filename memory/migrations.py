@@ -0,0 +1,243 @@
+# memory/migrations.py
+import ast
+import json
+import logging
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+_DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%d.%m.%Y",
+                 "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y"]
+_NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def parse_extracted(extracted):
+    """Decode a stored extraction: JSON today, Python repr in databases written before schema v2"""
+    if isinstance(extracted, dict):
+        return extracted
+    if not extracted:
+        return {}
+    try:
+        value = json.loads(extracted)
+    except ValueError:
+        try:
+            value = ast.literal_eval(extracted)
+        except (ValueError, SyntaxError):
+            return {"raw": extracted}
+    return value if isinstance(value, dict) else {"raw": value}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def promoted_fields(extracted):
+    """Key fields copied out of the extraction into indexed columns: (sender, amount_total, doc_date)"""
+    sender = extracted.get("sender")
+    if isinstance(sender, dict):
+        sender = sender.get("name") or sender.get("email")
+    sender = str(sender) if sender else None
+
+    amounts = []
+    for amount in _as_list(extracted.get("amounts")):
+        if isinstance(amount, (int, float)):
+            amounts.append(float(amount))
+            continue
+        match = _NUMBER.search(str(amount))
+        if match:
+            amounts.append(float(match.group().replace(",", "")))
+
+    doc_date = None
+    for value in _as_list(extracted.get("dates")):
+        text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", str(value)).strip()
+        for fmt in _DATE_FORMATS:
+            try:
+                doc_date = datetime.strptime(text, fmt).date().isoformat()
+                break
+            except ValueError:
+                continue
+        if doc_date:
+            break
+
+    return sender, max(amounts) if amounts else None, doc_date
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _v1_base_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS memory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT, type TEXT, intent TEXT,
+        extracted TEXT, timestamp TEXT
+    )
+    ''')
+    if 'content_hash' not in _columns(conn, 'memory'):
+        conn.execute('ALTER TABLE memory ADD COLUMN content_hash TEXT')
+
+
+def _v2_json_columns_indexes_fts(conn):
+    for column, sql_type in (("sender", "TEXT"), ("amount_total", "REAL"), ("doc_date", "TEXT")):
+        if column not in _columns(conn, 'memory'):
+            conn.execute(f'ALTER TABLE memory ADD COLUMN {column} {sql_type}')
+
+    # Rewrite repr() rows as JSON and fill the promoted columns in batches
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, extracted FROM memory WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, extracted in rows:
+            data = parse_extracted(extracted)
+            updates.append((json.dumps(data, default=str), *promoted_fields(data), row_id))
+        conn.executemany(
+            'UPDATE memory SET extracted = ?, sender = ?, amount_total = ?, doc_date = ? WHERE id = ?',
+            updates
+        )
+        last_id = rows[-1][0]
+
+    # executescript() would commit mid-migration, so statements are run one by one
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_memory_intent ON memory (intent, id)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_type ON memory (type)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_timestamp ON memory (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_content_hash ON memory (content_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_sender ON memory (sender COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_doc_date ON memory (doc_date)',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+            source, intent, sender, extracted,
+            content='memory', content_rowid='id'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS memory_fts_insert AFTER INSERT ON memory BEGIN
+            INSERT INTO memory_fts (rowid, source, intent, sender, extracted)
+            VALUES (new.id, new.source, new.intent, new.sender, new.extracted);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS memory_fts_delete AFTER DELETE ON memory BEGIN
+            INSERT INTO memory_fts (memory_fts, rowid, source, intent, sender, extracted)
+            VALUES ('delete', old.id, old.source, old.intent, old.sender, old.extracted);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS memory_fts_update AFTER UPDATE ON memory BEGIN
+            INSERT INTO memory_fts (memory_fts, rowid, source, intent, sender, extracted)
+            VALUES ('delete', old.id, old.source, old.intent, old.sender, old.extracted);
+            INSERT INTO memory_fts (rowid, source, intent, sender, extracted)
+            VALUES (new.id, new.source, new.intent, new.sender, new.extracted);
+        END
+        ''',
+    ):
+        conn.execute(statement)
+    conn.execute("INSERT INTO memory_fts (memory_fts) VALUES ('rebuild')")
+
+
+def _v3_trace_column(conn):
+    # Per-record pipeline trace (span timings and token counts, see utils/tracing.py)
+    if 'trace' not in _columns(conn, 'memory'):
+        conn.execute('ALTER TABLE memory ADD COLUMN trace TEXT')
+
+
+def _v4_archive_tables(conn):
+    # Compressed monthly chunks of old logs, one JSON array per column (see memory/archive.py),
+    # and where each archived log id went, so lookups by id or content hash stay cheap
+    for statement in (
+        '''
+        CREATE TABLE IF NOT EXISTS memory_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT NOT NULL,
+            first_id INTEGER NOT NULL, last_id INTEGER NOT NULL,
+            row_count INTEGER NOT NULL, deleted INTEGER NOT NULL DEFAULT 0,
+            min_timestamp TEXT, max_timestamp TEXT, intents TEXT,
+            codec TEXT NOT NULL, raw_bytes INTEGER, stored_bytes INTEGER,
+            ids BLOB, timestamp BLOB, intent BLOB, sender BLOB, type BLOB, source BLOB, content_hash BLOB,
+            amount_total BLOB, doc_date BLOB, extracted BLOB, trace BLOB
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_memory_archive_month ON memory_archive (month, first_id)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_archive_last_id ON memory_archive (last_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS memory_archived (
+            id INTEGER PRIMARY KEY, chunk INTEGER NOT NULL, content_hash TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_memory_archived_chunk ON memory_archived (chunk)',
+        'CREATE INDEX IF NOT EXISTS idx_memory_archived_content_hash ON memory_archived (content_hash)',
+    ):
+        conn.execute(statement)
+
+
+def _v5_parent_id(conn):
+    # Attachments split off an email are logged as documents of their own, pointing at the email's log
+    if 'parent_id' not in _columns(conn, 'memory'):
+        conn.execute('ALTER TABLE memory ADD COLUMN parent_id INTEGER')
+    if 'parent_id' not in _columns(conn, 'memory_archive'):
+        conn.execute('ALTER TABLE memory_archive ADD COLUMN parent_id BLOB')
+    if 'parent_id' not in _columns(conn, 'memory_archived'):
+        conn.execute('ALTER TABLE memory_archived ADD COLUMN parent_id INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_memory_parent ON memory (parent_id) WHERE parent_id IS NOT NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_memory_archived_parent ON memory_archived (parent_id) '
+                 'WHERE parent_id IS NOT NULL')
+
+
+def _v6_fts_update_columns(conn):
+    # Only changes to the indexed columns need re-indexing; MemoryStore.log stores a
+    # record's trace with an UPDATE after the insert it times
+    conn.execute('DROP TRIGGER IF EXISTS memory_fts_update')
+    conn.execute('''
+    CREATE TRIGGER memory_fts_update AFTER UPDATE OF source, intent, sender, extracted ON memory BEGIN
+        INSERT INTO memory_fts (memory_fts, rowid, source, intent, sender, extracted)
+        VALUES ('delete', old.id, old.source, old.intent, old.sender, old.extracted);
+        INSERT INTO memory_fts (rowid, source, intent, sender, extracted)
+        VALUES (new.id, new.source, new.intent, new.sender, new.extracted);
+    END
+    ''')
+
+
+# Append new migrations here; a database at user_version N runs MIGRATIONS[N:]
+MIGRATIONS = [
+    _v1_base_table,
+    _v2_json_columns_indexes_fts,
+    _v3_trace_column,
+    _v4_archive_tables,
+    _v5_parent_id,
+    _v6_fts_update_columns,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """
+    Bring the database up to SCHEMA_VERSION, one transaction per migration.
+    BEGIN IMMEDIATE plus re-reading user_version makes concurrent openers safe.
+    """
+    conn.commit()
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                conn.execute('COMMIT')
+                return version
+            migration = MIGRATIONS[version]
+            logger.info(f"Applying memory schema migration v{version + 1}: {migration.__name__}")
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
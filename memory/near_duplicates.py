@@ -0,0 +1,236 @@
+# memory/near_duplicates.py
+import hashlib
+import logging
+import os
+import re
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity above which a document counts as a near-duplicate
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+
+# 64 MinHash values in 16 LSH bands of 4: pairs at 0.85 similarity collide in some band
+# with probability > 0.9999, pairs below 0.3 rarely do, and candidates are verified anyway
+NUM_HASHES = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_HASHES // BANDS
+SHINGLE_SIZE = 3
+# Shorter texts have too few shingles for a meaningful estimate
+MIN_SHINGLES = 8
+MAX_CANDIDATES = 20
+
+_EMPTY = (1 << 64) - 1
+# Headers that differ on every resend and would only add noise
+_VOLATILE_HEADER = re.compile(r"(?im)^[ \t>]*(?:date|sent|message-id|received|x-[\w-]+)[ \t]*:.*$")
+_QUOTE_MARKER = re.compile(r"(?m)^[ \t]*(?:>[ \t]?)+")
+_WORD = re.compile(r"\w+")
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def shingles(text):
+    """Word n-grams of the text with volatile headers and quote markers removed"""
+    text = _QUOTE_MARKER.sub("", _VOLATILE_HEADER.sub("", text))
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    """
+    One-permutation MinHash: every shingle is hashed once and kept as the minimum of
+    its bin, so the cost is linear in the text. Empty bins borrow from the next
+    non-empty one. Returns None when the text is too short to compare.
+    """
+    values = shingles(text)
+    if len(values) < MIN_SHINGLES:
+        return None
+    bins = [_EMPTY] * NUM_HASHES
+    for shingle in values:
+        value = _hash64(shingle.encode())
+        index = value % NUM_HASHES
+        value //= NUM_HASHES
+        if value < bins[index]:
+            bins[index] = value
+    for index in range(NUM_HASHES):
+        if bins[index] == _EMPTY:
+            for step in range(1, NUM_HASHES):
+                borrowed = bins[(index + step) % NUM_HASHES]
+                if borrowed != _EMPTY:
+                    bins[index] = borrowed + step
+                    break
+    return array("Q", bins)
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_HASHES
+
+
+def band_buckets(sig):
+    """(band, bucket) keys; documents sharing any key are candidates"""
+    buckets = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        # Signed 63-bit so it fits an SQLite INTEGER
+        buckets.append((band, _hash64(rows.tobytes()) >> 1))
+    return buckets
+
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH index over processed documents, stored in the MemoryStore database.
+    Entries are keyed on content hash, so a match can be resolved to the latest
+    memory row with that hash whether it was logged directly or through a BatchWriter.
+    Documents are added as they are processed; backfill() indexes ones logged earlier.
+    """
+
+    def __init__(self, store, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.store = store
+        self.threshold = threshold
+        self.create_table()
+
+    @property
+    def conn(self):
+        # The store hands out a connection per thread
+        return self.store.conn
+
+    def create_table(self):
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS near_dup_signatures (
+            content_hash TEXT PRIMARY KEY, signature BLOB NOT NULL, created_at REAL
+        ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS near_dup_bands (
+            band INTEGER NOT NULL, bucket INTEGER NOT NULL, content_hash TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, content_hash)
+        ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+    def add(self, digest, sig):
+        if sig is None:
+            return
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO near_dup_signatures (content_hash, signature, created_at) VALUES (?, ?, ?)',
+                (digest, sig.tobytes(), time.time())
+            )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO near_dup_bands (band, bucket, content_hash) VALUES (?, ?, ?)',
+                [(band, bucket, digest) for band, bucket in band_buckets(sig)]
+            )
+
+    def query(self, sig, exclude=None):
+        """Best (content_hash, similarity) at or above the threshold, or None"""
+        if sig is None:
+            return None
+        buckets = band_buckets(sig)
+        values = ", ".join("(?, ?)" for _ in buckets)
+        params = [value for pair in buckets for value in pair]
+        rows = self.conn.execute(f'''
+            WITH probe(band, bucket) AS (VALUES {values})
+            SELECT s.content_hash, s.signature
+            FROM (
+                SELECT b.content_hash, COUNT(*) AS shared
+                FROM probe JOIN near_dup_bands b ON b.band = probe.band AND b.bucket = probe.bucket
+                GROUP BY b.content_hash ORDER BY shared DESC LIMIT ?
+            ) c JOIN near_dup_signatures s ON s.content_hash = c.content_hash
+        ''', (*params, MAX_CANDIDATES)).fetchall()
+
+        best = None
+        for digest, blob in rows:
+            if digest == exclude:
+                continue
+            candidate = array("Q")
+            candidate.frombytes(blob)
+            score = similarity(sig, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (digest, score)
+        return best
+
+    def remove(self, digest):
+        with self.conn:
+            self.conn.execute('DELETE FROM near_dup_bands WHERE content_hash = ?', (digest,))
+            self.conn.execute('DELETE FROM near_dup_signatures WHERE content_hash = ?', (digest,))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM near_dup_bands')
+            self.conn.execute('DELETE FROM near_dup_signatures')
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM near_dup_signatures').fetchone()[0]
+
+    def hashes(self):
+        return {row[0] for row in self.conn.execute('SELECT content_hash FROM near_dup_signatures')}
+
+
+def backfill(index, paths):
+    """
+    Index documents logged before the index existed or without it (e.g. main.py
+    --no-near-duplicates). Memory rows keep only the extraction, so signatures are
+    computed from the original files again, exactly as the pipeline does; files
+    whose content hash was never logged or is already indexed are skipped.
+    Returns {"indexed", "skipped", "failed"} counts.
+    """
+    # Imported here: the classifier imports this module
+    from agents.classifier_agent import prepare_document
+    from memory.result_cache import content_hash
+    from utils.batch_runner import load_document
+
+    logged = index.store.fetch_hashes()
+    indexed = index.hashes()
+    report = {"indexed": 0, "skipped": 0, "failed": 0}
+    for path in paths:
+        try:
+            content = load_document(path)
+            digest = content_hash(content)
+            if digest not in logged or digest in indexed:
+                report["skipped"] += 1
+                continue
+            prepared = prepare_document(os.path.basename(path), content, near_duplicates=True)
+        except Exception as e:
+            logger.warning(f"Could not index {path}: {str(e)}")
+            report["failed"] += 1
+            continue
+        # Email attachments are logged, and so matched, under their own content hash
+        entries = [(digest, prepared.get("signature"))] + [
+            (attachment["content_hash"], attachment["prepared"].get("signature"))
+            for attachment in prepared.get("attachments", ()) if "prepared" in attachment
+        ]
+        added = 0
+        for entry_digest, sig in entries:
+            # Mapped JSON and very short texts have no signature, as in the pipeline
+            if sig is not None and entry_digest in logged and entry_digest not in indexed:
+                index.add(entry_digest, sig)
+                indexed.add(entry_digest)
+                added += 1
+        report["indexed"] += added
+        report["skipped"] += not added
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from memory.memory_store import MemoryStore
+    from utils.batch_runner import discover_inputs
+
+    parser = argparse.ArgumentParser(description="Add already logged documents to the near-duplicate index")
+    parser.add_argument("targets", nargs="+", help="The original files: files, directories, globs or .jsonl manifests")
+    parser.add_argument("--db", default="memory.db")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = MemoryStore(args.db)
+    index = NearDuplicateIndex(store)
+    report = backfill(index, discover_inputs(args.targets))
+    print(json.dumps(dict(report, signatures=index.count())))
+    store.close()
@@ -0,0 +1,146 @@
+# memory/result_cache.py
+import hashlib
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def content_hash(content) -> str:
+    """MD5 of the raw document bytes, used as the cache/deduplication key"""
+    if isinstance(content, os.PathLike):
+        digest = hashlib.md5()
+        with open(content, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.md5(content).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent classify_and_route result cache stored in the MemoryStore database.
+    Entries are keyed on content hash, prompt version and model name, expire after
+    ttl_seconds and are evicted least-recently-used once max_entries is exceeded.
+    """
+
+    def __init__(self, store, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.create_table()
+
+    @property
+    def conn(self):
+        # The store hands out a connection per thread
+        return self.store.conn
+
+    def create_table(self):
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            content_hash TEXT, prompt_version TEXT, model_name TEXT,
+            file_format TEXT, intent TEXT, result TEXT,
+            created_at REAL, last_access REAL
+        )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_result_cache_last_access ON result_cache (last_access)'
+        )
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache_stats (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(digest, prompt_version, model_name):
+        return f"{digest}:{prompt_version}:{model_name}"
+
+    def _bump(self, name, amount=1):
+        self.conn.execute('''
+        INSERT INTO result_cache_stats (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (name, amount))
+
+    def get(self, key):
+        """Return (file_format, intent, result) for a live entry, or None on a miss"""
+        now = time.time()
+        row = self.conn.execute(
+            'SELECT file_format, intent, result, created_at FROM result_cache WHERE key = ?',
+            (key,)
+        ).fetchone()
+
+        if row and now - row[3] > self.ttl_seconds:
+            self.conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+            self._bump("expirations")
+            row = None
+
+        if row is None:
+            self._bump("misses")
+            self.conn.commit()
+            return None
+
+        self.conn.execute('UPDATE result_cache SET last_access = ? WHERE key = ?', (now, key))
+        self._bump("hits")
+        self.conn.commit()
+        return row[0], row[1], json.loads(row[2])
+
+    def put(self, key, file_format, intent, result):
+        digest, prompt_version, model_name = key.split(":", 2)
+        now = time.time()
+        try:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO result_cache
+                (key, content_hash, prompt_version, model_name, file_format, intent, result, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (key, digest, prompt_version, model_name, file_format, intent,
+                  json.dumps(result), now, now))
+            self.evict(now)
+            self.conn.commit()
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Result for {key} is not cacheable: {str(e)}")
+
+    def evict(self, now=None):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        now = now or time.time()
+        expired = self.conn.execute(
+            'DELETE FROM result_cache WHERE created_at < ?', (now - self.ttl_seconds,)
+        ).rowcount
+        if expired:
+            self._bump("expirations", expired)
+
+        overflow = self.conn.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self.conn.execute('''
+            DELETE FROM result_cache WHERE key IN (
+                SELECT key FROM result_cache ORDER BY last_access ASC LIMIT ?
+            )
+            ''', (overflow,))
+            self._bump("evictions", overflow)
+
+    def clear(self):
+        self.conn.execute('DELETE FROM result_cache')
+        self.conn.commit()
+
+    def stats(self):
+        counters = dict(self.conn.execute('SELECT name, value FROM result_cache_stats').fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "expirations": counters.get("expirations", 0),
+            "entries": self.conn.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0],
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,443 @@
+# memory/vector_index.py
+import logging
+import math
+import os
+import re
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: appends are not serialised across processes, which only risks duplicate entries
+    fcntl = None
+
+from memory.archive import iter_archived
+from memory.migrations import parse_extracted
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIM = 256
+# Below this many vectors an exhaustive scan takes a few milliseconds; above it an IVF partition is trained
+IVF_MIN_VECTORS = int(os.getenv("VECTOR_IVF_MIN_VECTORS", "20000"))
+# Partitions scanned per query; more is slower and closer to an exhaustive scan
+IVF_PROBES = int(os.getenv("VECTOR_IVF_PROBES", "8"))
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE = 100_000
+# Retrain once this share of the vectors arrived after the last training; they are scanned exhaustively meanwhile
+RETRAIN_FRACTION = 0.2
+# Candidates fetched per requested result, so deleted or filtered-out logs can be dropped
+OVERFETCH = 4
+SCAN_CHUNK = 65536
+
+_MAGIC = b"MAVEC001"
+_HEADER_SIZE = 16
+RECORD = np.dtype([("id", "<i8"), ("vec", "<f2", (VECTOR_DIM,))])
+
+# Columns of memory/archive.py chunks in the order _records expects
+_ARCHIVED_FIELDS = ["ids", "source", "type", "intent", "extracted"]
+
+_WORD = re.compile(r"\w+")
+# Keys the pipeline adds to each extraction; they describe the processing, not the document
+_METADATA_KEYS = {"file_format", "extraction_method", "processed_at", "llm_error",
+                  "near_duplicate_of", "changed_fields"}
+
+
+def _values(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _METADATA_KEYS:
+                yield from _values(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _values(item)
+    elif value is not None:
+        yield str(value)
+
+
+def log_text(source, intent, extracted):
+    """Text a log is embedded from: its source name, intent and extracted values"""
+    return " ".join([source or "", intent or "", *_values(parse_extracted(extracted))])
+
+
+def embed(text):
+    """
+    Hashed term-frequency vector: word unigrams and bigrams hashed with CRC32
+    (stable across processes) into VECTOR_DIM signed buckets, log-scaled and
+    L2-normalised. IDF weights are applied at query time so they follow the
+    whole collection rather than the moment a log was added.
+    """
+    words = _WORD.findall(text.lower())
+    counts = {}
+    for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+        value = zlib.crc32(feature.encode())
+        counts[value] = counts.get(value, 0) + 1
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for value, count in counts.items():
+        vector[value % VECTOR_DIM] += (1.0 + math.log(count)) * (1.0 if value >> 31 else -1.0)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def _nearest(vectors, centroids):
+    return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+
+class VectorIndex:
+    """
+    Similarity search over the memory log. Vectors are appended to a file next
+    to the database (memory.db.vectors) that every process sharing the database
+    maps, so the index survives restarts and is never rebuilt on startup. Once
+    it holds IVF_MIN_VECTORS vectors, spherical k-means centroids
+    (memory.db.vectors.ivf.npz) partition it and queries scan only the
+    IVF_PROBES closest partitions plus the vectors added since training.
+
+    New logs arrive through a MemoryStore listener; sync() indexes rows written
+    by processes that run without an index.
+    """
+
+    def __init__(self, store, path=None):
+        self.store = store
+        self._temporary = path is None and store.db_file == ":memory:"
+        if self._temporary:
+            handle, path = tempfile.mkstemp(suffix=".vectors")
+            os.close(handle)
+        self.path = path or f"{store.db_file}.vectors"
+        self.ivf_path = f"{self.path}.ivf.npz"
+        self.lock = threading.RLock()
+        self._training = False
+        self._ensure_file()
+        self._reset()
+        self.refresh()
+        store.add_listener(self.add)
+        self.sync()
+
+    def _ensure_file(self):
+        with self._locked() as f:
+            if f.tell() == 0:
+                f.write(_MAGIC + struct.pack("<II", VECTOR_DIM, 0))
+        with open(self.path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        if header[:8] != _MAGIC or struct.unpack("<I", header[8:12])[0] != VECTOR_DIM:
+            raise ValueError(f"{self.path} is not a {VECTOR_DIM}-dimensional vector index")
+
+    def _reset(self):
+        self.data = np.zeros(0, dtype=RECORD)
+        self.count = 0
+        self.max_id = 0
+        self.inode = None
+        self.df = np.zeros(VECTOR_DIM, dtype=np.int64)
+        self.idf = np.ones(VECTOR_DIM, dtype=np.float32)
+        self.idf_count = 0
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.ivf = None
+        self.ivf_mtime = None
+
+    @contextmanager
+    def _locked(self):
+        """The vector file opened for appending, under an exclusive lock shared by all processes"""
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Map vectors appended by any process since the last call and pick up a retrained partition"""
+        with self.lock:
+            stat = os.stat(self.path)
+            if self.inode is not None and stat.st_ino != self.inode:
+                # rebuild() in another process replaced the file
+                self._reset()
+            self.inode = stat.st_ino
+            count = max(0, (stat.st_size - _HEADER_SIZE) // RECORD.itemsize)
+            if count > self.count:
+                self._map(count)
+            self._load_ivf()
+        self._maybe_train()
+
+    def _map(self, count):
+        data = np.memmap(self.path, dtype=RECORD, mode="r", offset=_HEADER_SIZE, shape=(count,))
+        start = self.count
+        for offset in range(start, count, SCAN_CHUNK):
+            self.df += np.count_nonzero(data["vec"][offset:min(count, offset + SCAN_CHUNK)], axis=0)
+        self.max_id = max(self.max_id, int(data["id"][start:count].max()))
+        self.data = data
+        self.count = count
+        if count > 2 * self.idf_count:
+            # The collection doubled: refresh the IDF weights and every norm that depends on them
+            self.idf = (np.log((1 + count) / (1 + self.df)) + 1).astype(np.float32)
+            self.idf_count = count
+            start = 0
+        weights = self.idf * self.idf
+        norms = [np.sqrt(np.square(data["vec"][offset:min(count, offset + SCAN_CHUNK)].astype(np.float32)) @ weights)
+                 for offset in range(start, count, SCAN_CHUNK)]
+        self.norms = np.concatenate(([self.norms[:start]] if start else []) + norms).astype(np.float32)
+
+    def _load_ivf(self):
+        try:
+            mtime = os.stat(self.ivf_path).st_mtime_ns
+        except FileNotFoundError:
+            self.ivf, self.ivf_mtime = None, None
+            return
+        if mtime == self.ivf_mtime:
+            return
+        with np.load(self.ivf_path) as saved:
+            centroids, assign = saved["centroids"], saved["assign"]
+        if len(assign) > self.count:
+            # Trained on vectors this process has not mapped yet; try again on the next refresh
+            return
+        self._set_ivf(centroids, assign)
+        self.ivf_mtime = mtime
+
+    def _set_ivf(self, centroids, assign):
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=len(centroids)))))
+        self.ivf = (centroids, order, offsets, len(assign))
+
+    def _maybe_train(self):
+        with self.lock:
+            trained = self.ivf[3] if self.ivf is not None else 0
+            due = self.count >= IVF_MIN_VECTORS and self.count - trained > RETRAIN_FRACTION * self.count
+            if not due or self._training:
+                return
+            self._training = True
+        threading.Thread(target=self._train_in_background, name="vector-index-train", daemon=True).start()
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        except Exception as e:
+            logger.error(f"Vector index training failed: {str(e)}")
+        finally:
+            self._training = False
+
+    def train(self, seed=0):
+        """Partition the mapped vectors with spherical k-means (sqrt(n) centroids); returns the partition count"""
+        with self.lock:
+            data, count = self.data, self.count
+        if count == 0:
+            return 0
+        rng = np.random.default_rng(seed)
+        sample = data["vec"][np.sort(rng.choice(count, size=min(count, KMEANS_SAMPLE), replace=False))]
+        sample = sample.astype(np.float32)
+        partitions = max(1, min(len(sample), int(math.sqrt(count))))
+        centroids = sample[rng.choice(len(sample), size=partitions, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.concatenate([_nearest(sample[i:i + 8192], centroids) for i in range(0, len(sample), 8192)])
+            order = np.argsort(assign, kind="stable")
+            members, starts = np.unique(assign[order], return_index=True)
+            centroids[members] = np.add.reduceat(sample[order], starts, axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        assign = np.concatenate([_nearest(data["vec"][i:min(count, i + 8192)].astype(np.float32), centroids)
+                                 for i in range(0, count, 8192)])
+
+        handle, tmp = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(os.path.abspath(self.ivf_path)))
+        with os.fdopen(handle, "wb") as f:
+            np.savez(f, centroids=centroids, assign=assign)
+        os.replace(tmp, self.ivf_path)
+        with self.lock:
+            self._set_ivf(centroids, assign)
+            self.ivf_mtime = os.stat(self.ivf_path).st_mtime_ns
+        logger.info(f"Trained vector index: {count} vectors in {partitions} partitions")
+        return partitions
+
+    @staticmethod
+    def _records(rows):
+        records = np.zeros(len(rows), dtype=RECORD)
+        for index, (log_id, source, _, intent, extracted) in enumerate(rows):
+            records[index] = (log_id, embed(log_text(source, intent, extracted)))
+        return records
+
+    def add(self, rows):
+        """MemoryStore listener: embed and append newly logged (id, source, filetype, intent, extracted) rows"""
+        records = self._records(rows)
+        with self._locked() as f:
+            f.write(records.tobytes())
+        self.refresh()
+
+    def sync(self, batch_size=5000):
+        """
+        Index logs newer than anything in the index, e.g. written by main.py or
+        archived before the index saw them; returns how many were added
+        """
+        latest = self.store.conn.execute(
+            "SELECT MAX(latest) FROM (SELECT MAX(id) AS latest FROM memory UNION ALL SELECT MAX(id) FROM memory_archived)"
+        ).fetchone()[0]
+        if latest is None or latest <= self.max_id:
+            return 0
+        added = 0
+        with self._locked() as f:
+            # Another process may have indexed them while we waited for the lock
+            self.refresh()
+            after = self.max_id
+            for rows in iter_archived(self.store.conn, after, _ARCHIVED_FIELDS):
+                f.write(self._records(rows).tobytes())
+                added += len(rows)
+            last = after
+            while True:
+                rows = self.store.conn.execute(
+                    "SELECT id, source, type, intent, extracted FROM memory WHERE id > ? ORDER BY id LIMIT ?",
+                    (last, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                f.write(self._records(rows).tobytes())
+                f.flush()
+                added += len(rows)
+                last = rows[-1][0]
+            f.flush()
+            self.refresh()
+        return added
+
+    def rebuild(self):
+        """
+        Re-embed every log, archived or not, into a fresh file, dropping deleted
+        logs and stale partitions; returns the count
+        """
+        handle, tmp = tempfile.mkstemp(suffix=".vectors", dir=os.path.dirname(os.path.abspath(self.path)))
+        count = 0
+        with self._locked(), os.fdopen(handle, "wb") as f:
+            f.write(_MAGIC + struct.pack("<II", VECTOR_DIM, 0))
+            for rows in iter_archived(self.store.conn, 0, _ARCHIVED_FIELDS):
+                f.write(self._records(rows).tobytes())
+                count += len(rows)
+            cursor = self.store.conn.execute("SELECT id, source, type, intent, extracted FROM memory ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                f.write(self._records(rows).tobytes())
+                count += len(rows)
+            f.flush()
+            if os.path.exists(self.ivf_path):
+                os.remove(self.ivf_path)
+            os.replace(tmp, self.path)
+        with self.lock:
+            self._reset()
+        self.refresh()
+        return count
+
+    def query(self, text, k=10, exclude=()):
+        """[(log_id, score)] of the k logs closest to text by TF-IDF cosine similarity, best first"""
+        self.sync()
+        with self.lock:
+            data, norms, idf, ivf, count = self.data, self.norms, self.idf, self.ivf, self.count
+        if count == 0 or k <= 0:
+            return []
+        vector = embed(text)
+        weights = idf * idf
+        weighted = vector * weights
+        query_norm = math.sqrt(float(np.square(vector) @ weights)) or 1.0
+
+        if ivf is None:
+            candidates = [slice(start, min(count, start + SCAN_CHUNK)) for start in range(0, count, SCAN_CHUNK)]
+        else:
+            centroids, order, offsets, trained = ivf
+            probes = np.argsort(-(centroids @ vector))[:IVF_PROBES]
+            rows = np.sort(np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes]))
+            candidates = [rows] + [slice(start, min(count, start + SCAN_CHUNK))
+                                   for start in range(trained, count, SCAN_CHUNK)]
+
+        keep = k * OVERFETCH + len(exclude)
+        best_rows, best_scores = [], []
+        for selection in candidates:
+            vectors = data["vec"][selection].astype(np.float32)
+            if not len(vectors):
+                continue
+            scores = (vectors @ weighted) / (norms[selection] * query_norm + 1e-12)
+            rows = np.arange(count)[selection] if isinstance(selection, slice) else selection
+            if len(scores) > keep:
+                top = np.argpartition(-scores, keep)[:keep]
+                rows, scores = rows[top], scores[top]
+            best_rows.append(rows)
+            best_scores.append(scores)
+        if not best_rows:
+            return []
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        results, seen = [], set(exclude)
+        for index in np.argsort(-scores):
+            if scores[index] <= 0:
+                break
+            log_id = int(data["id"][rows[index]])
+            if log_id in seen:
+                continue
+            seen.add(log_id)
+            results.append((log_id, float(scores[index])))
+            if len(results) == keep:
+                break
+        return results
+
+    def similar_logs(self, text=None, log_id=None, k=10, intent=None):
+        """
+        Logs most similar to a free-text query or to an existing log, as
+        (score, row) pairs with row in LOG_COLUMNS order; intent keeps only
+        that intent. Deleted logs are skipped.
+        """
+        exclude = ()
+        if log_id is not None:
+            row = self.store.fetch_log(log_id)
+            if row is None:
+                return []
+            text, exclude = log_text(row[1], row[3], row[4]), (log_id,)
+        if not text or not text.strip():
+            return []
+
+        fetch = k
+        while True:
+            hits = self.query(text, fetch, exclude)
+            # Archived logs are looked up in their chunks (memory/archive.py)
+            rows = self.store.fetch_many(hit_id for hit_id, _ in hits)
+            results = [(score, rows[hit_id]) for hit_id, score in hits
+                       if hit_id in rows and (not intent or rows[hit_id][3] == intent)]
+            # Widen the search when filtering or deletions left too few
+            if len(results) >= k or len(hits) < fetch * OVERFETCH or fetch * OVERFETCH >= 8192:
+                return results[:k]
+            fetch *= 4
+
+    def close(self):
+        with self.lock:
+            self._reset()
+        if self._temporary:
+            for path in (self.path, self.ivf_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from memory.memory_store import MemoryStore
+
+    parser = argparse.ArgumentParser(description="Maintain or query the memory log vector index")
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed every log into a fresh index")
+    parser.add_argument("--train", action="store_true", help="Retrain the IVF partition now")
+    parser.add_argument("--query", help="Print the logs most similar to this text")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = MemoryStore(args.db)
+    index = VectorIndex(store)
+    if args.rebuild:
+        print(f"Indexed {index.rebuild()} logs")
+    else:
+        print(f"Indexed {index.sync()} new logs ({index.count} vectors)")
+    if args.train:
+        print(f"Trained {index.train()} partitions")
+    if args.query:
+        started = time.perf_counter()
+        results = index.similar_logs(args.query, k=args.k)
+        print(f"{len(results)} results in {1000 * (time.perf_counter() - started):.1f} ms")
+        for score, row in results:
+            print(f"{score:.3f}  #{row[0]}  {row[3]}  {row[1]}")
+    store.close()
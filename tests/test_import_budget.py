@@ -0,0 +1,18 @@
+# tests/test_import_budget.py
+import os
+
+import pytest
+
+from benchmarks.import_budget import IMPORT_BUDGET_MS, MODULES, measure
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_entry_point_imports_stay_cheap_and_lazy(module):
+    # Best of three fresh interpreters, as the benchmark script does, to ride out a cold disk cache
+    runs = [measure(module, ROOT) for _ in range(3)]
+    best_ms = min(ms for ms, _ in runs)
+    assert best_ms <= IMPORT_BUDGET_MS, f"{module} took {best_ms:.1f} ms to import"
+    for _, loaded in runs:
+        assert loaded == [], f"{module} eagerly imports {', '.join(loaded)}"
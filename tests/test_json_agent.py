@@ -0,0 +1,19 @@
+# tests/test_json_agent.py
+import io
+import json
+
+from agents.classifier_agent import prepare_document
+from agents.json_agent import handle_json_document
+
+UNMAPPED = json.dumps({"zzz": "hello world unrelated", "qqq": 3}).encode()
+
+
+def test_unmapped_binary_stream_is_rewound_for_the_parser():
+    stream = io.BytesIO(b"  " + UNMAPPED)
+    stream.seek(2)
+    assert handle_json_document(stream) is None
+    assert stream.tell() == 2
+
+    prepared = prepare_document("notes.json", io.BytesIO(UNMAPPED))
+    assert "structured" not in prepared
+    assert json.loads(prepared["parsed_content"]) == json.loads(UNMAPPED)
@@ -0,0 +1,173 @@
+# utils/batch_runner.py
+import glob
+import json
+import logging
+import os
+import pathlib
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from memory.result_cache import content_hash
+from utils.local_classifier import tier_stats
+from utils.staged_pipeline import StagedPipeline, PARSE_WORKERS, STAGE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".json", ".txt", ".eml")
+
+
+def discover_inputs(targets):
+    """
+    Expand CLI targets into a sorted, de-duplicated list of file paths.
+    A target can be a directory (searched recursively), a glob pattern,
+    a .jsonl manifest (one {"path": ...} object or path string per line) or a file.
+    """
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            for root, _, files in os.walk(target):
+                paths.extend(
+                    os.path.join(root, name) for name in files
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS)
+                )
+        elif target.lower().endswith(".jsonl") and os.path.isfile(target):
+            base_dir = os.path.dirname(os.path.abspath(target))
+            with open(target, encoding="utf-8") as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    path = entry["path"] if isinstance(entry, dict) else entry
+                    paths.append(path if os.path.isabs(path) else os.path.join(base_dir, path))
+        elif os.path.isfile(target):
+            paths.append(target)
+        else:
+            paths.extend(p for p in glob.glob(target, recursive=True) if os.path.isfile(p))
+    return sorted(set(paths))
+
+
+def load_document(path):
+    """
+    PDFs are passed on as paths so the parser can memory-map them and stop after the
+    pages it needs, emails so the MIME parser can stream them; other documents are
+    read as text like the Streamlit upload does.
+    """
+    if path.lower().endswith((".pdf", ".eml")):
+        return pathlib.Path(path)
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="ignore")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_batch(paths, store, workers=4, summary_path=None, resume=True, writer=None, near_duplicates=None,
+              parse_workers=PARSE_WORKERS, queue_size=STAGE_QUEUE_SIZE):
+    """
+    Classify and extract many documents through a StagedPipeline: parse_workers
+    processes parse (0 parses on the LLM threads) and workers threads make the
+    LLM calls, with at most queue_size parsed documents waiting between them.
+    Results are logged through writer (e.g. a BatchWriter) or directly to the store;
+    documents whose result could not be written are reported as failed.
+    With resume=True, documents whose content hash is already in the store are skipped.
+    near_duplicates is an optional NearDuplicateIndex used to reuse earlier extractions.
+    """
+    writer = writer or store
+    done_hashes = store.fetch_hashes() if resume else set()
+    records = []
+    logged = []
+    started_at = datetime.now().isoformat()
+    started = time.perf_counter()
+    tiers_before = dict(tier_stats.counts)
+
+    def handle(item, outcome, error):
+        path, digest = item
+        if error is not None:
+            logger.error(f"Failed to process {path}: {str(error)}")
+            records.append({"path": path, "content_hash": digest, "status": "failed", "error": str(error)})
+            return
+        file_format, intent, result, latency, trace = outcome
+        try:
+            # A BatchWriter returns a Future that fails if the row could not be written
+            written = writer.log(
+                source=os.path.basename(path),
+                filetype=file_format,
+                intent=intent,
+                extracted=result,
+                content_hash=digest,
+                trace=trace
+            )
+        except Exception as e:
+            logger.error(f"Failed to log {path}: {str(e)}")
+            records.append({"path": path, "content_hash": digest, "status": "failed", "error": str(e)})
+            return
+        record = {
+            "path": path,
+            "content_hash": digest,
+            "status": "ok",
+            "format": file_format,
+            "intent": intent,
+            "method": result.get("extraction_method"),
+            "latency_s": round(latency, 4),
+        }
+        records.append(record)
+        logged.append((record, latency, written))
+
+    with StagedPipeline(handle, parse_workers=parse_workers, llm_workers=workers, queue_size=queue_size,
+                        near_duplicates=near_duplicates) as pipeline:
+        for path in paths:
+            try:
+                content = load_document(path)
+            except OSError as e:
+                records.append({"path": path, "status": "failed", "error": str(e)})
+                continue
+
+            digest = content_hash(content)
+            if digest in done_hashes:
+                records.append({"path": path, "content_hash": digest, "status": "skipped"})
+                continue
+            # Identical files in the same run are only processed once
+            done_hashes.add(digest)
+            # Blocks while the LLM stage is behind, so files are only read as fast as they are processed
+            pipeline.submit(os.path.basename(path), content, item=(path, digest), digest=digest)
+
+    latencies = []
+    for record, latency, written in logged:
+        error = written.exception() if isinstance(written, Future) else None
+        if error is not None:
+            # Not in the store, so a resumed run processes the document again
+            record.update(status="failed", error=f"Could not log result: {str(error)}")
+        else:
+            latencies.append(latency)
+
+    elapsed = time.perf_counter() - started
+    processed = len(latencies)
+    report = {
+        "started_at": started_at,
+        "total": len(records),
+        "processed": processed,
+        "skipped": sum(1 for r in records if r["status"] == "skipped"),
+        "failed": sum(1 for r in records if r["status"] == "failed"),
+        "workers": workers,
+        "parse_workers": parse_workers,
+        "elapsed_s": round(elapsed, 3),
+        "docs_per_sec": round(processed / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p95_s": round(percentile(latencies, 95), 4),
+        "latency_max_s": round(max(latencies), 4) if latencies else 0.0,
+        # Intent decisions by tier: "rules", "rules_escalated" (then labelled by "llm")
+        "intent_tiers": tier_stats.counts_since(tiers_before),
+    }
+
+    if summary_path:
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump({"report": report, "documents": records}, f, indent=2)
+
+    return report, records
@@ -0,0 +1,136 @@
+# utils/chunker.py
+import contextvars
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.local_classifier import COMPILED_RULES
+
+# Size of the chunks a long document is split into, and how many tokens of them go into one prompt
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "250"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "600"))
+
+# Upper bound on parallel extraction calls for one document in map-reduce mode
+MAX_MAP_CHUNKS = int(os.getenv("MAX_MAP_CHUNKS", "8"))
+MAP_WORKERS = int(os.getenv("MAP_WORKERS", "4"))
+
+CHUNK_SEPARATOR = "\n[...]\n"
+
+# Regions that usually carry the fields we extract, with their weight per match
+REGION_PATTERNS = [
+    (re.compile(r"(?im)^[ \t>]*(?:from|to|cc|subject|date)[ \t]*:"), 3.0),
+    (re.compile(r"(?i)\b(?:sub[_ ]?total|grand[_ ]total|total(?:[_ ]amount)?|amount[_ ]due|balance[_ ]due)\b"), 2.0),
+    (re.compile(r"(?i)(?:[$€£₹]|\b(?:usd|eur|gbp|inr|rs\.?)[ \t]?)[ \t]?\d[\d,]*(?:\.\d{1,2})?"), 1.0),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"), 1.0),
+    (re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b"), 1.0),
+    (re.compile(r"(?im)^[ \t]*(?:dear|hi|hello|regards|best regards|kind regards|sincerely|thanks|thank you)\b"), 1.5),
+]
+
+# The opening (headers, salutation) and the closing (totals, signature) get a head start
+FIRST_CHUNK_BONUS = 2.0
+LAST_CHUNK_BONUS = 1.0
+
+
+def count_tokens(text):
+    """Token estimate (~4 characters per token), the same heuristic the client uses for rate limiting"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class Chunk:
+    __slots__ = ("index", "text", "tokens", "score")
+
+    def __init__(self, index, text):
+        self.index = index
+        self.text = text
+        self.tokens = count_tokens(text)
+        self.score = 0.0
+
+
+def _pieces(text, max_tokens):
+    """Paragraphs, with oversized ones broken on lines and then on characters"""
+    max_chars = max_tokens * 4
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        for line in paragraph.splitlines():
+            for start in range(0, len(line), max_chars):
+                piece = line[start:start + max_chars].strip()
+                if piece:
+                    yield piece
+
+
+def split_chunks(text, max_tokens=CHUNK_TOKENS):
+    """Split text into chunks of at most max_tokens, packing whole paragraphs where possible"""
+    chunks, current, current_tokens = [], [], 0
+    for piece in _pieces(text, max_tokens):
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(Chunk(len(chunks), "\n\n".join(current)))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(Chunk(len(chunks), "\n\n".join(current)))
+    return chunks
+
+
+def score_chunk(chunk, total):
+    """Relevance: weighted header/totals/entity/signature hits and intent keywords per 100 tokens"""
+    hits = sum(weight * len(pattern.findall(chunk.text)) for pattern, weight in REGION_PATTERNS)
+    for rules in COMPILED_RULES.values():
+        hits += sum(weight * len(pattern.findall(chunk.text)) for pattern, weight in rules)
+    score = 100.0 * hits / max(chunk.tokens, 1)
+    if chunk.index == 0:
+        score += FIRST_CHUNK_BONUS
+    if chunk.index == total - 1:
+        score += LAST_CHUNK_BONUS
+    return score
+
+
+def rank_chunks(chunks):
+    """Chunks sorted best first (ties keep document order)"""
+    for chunk in chunks:
+        chunk.score = score_chunk(chunk, len(chunks))
+    return sorted(chunks, key=lambda chunk: (-chunk.score, chunk.index))
+
+
+def best_chunks(text, budget_tokens=PROMPT_TOKEN_BUDGET, chunk_tokens=CHUNK_TOKENS, limit=None):
+    """The highest-ranked chunks that fit in budget_tokens, back in document order"""
+    chunks = split_chunks(text, min(chunk_tokens, budget_tokens))
+    chosen, used = [], 0
+    for chunk in rank_chunks(chunks):
+        if used + chunk.tokens > budget_tokens:
+            continue
+        chosen.append(chunk)
+        used += chunk.tokens
+        if limit is not None and len(chosen) >= limit:
+            break
+    return sorted(chosen, key=lambda chunk: chunk.index)
+
+
+def select_text(text, budget_tokens=PROMPT_TOKEN_BUDGET, chunk_tokens=CHUNK_TOKENS):
+    """
+    Prompt-ready text of at most budget_tokens: short documents are returned as-is,
+    long ones are reduced to their most relevant chunks with [...] marking the gaps.
+    """
+    if not text or count_tokens(text) <= budget_tokens:
+        return text
+    return CHUNK_SEPARATOR.join(chunk.text for chunk in best_chunks(text, budget_tokens, chunk_tokens))
+
+
+def map_chunks(text, fn, chunk_tokens=CHUNK_TOKENS, max_chunks=MAX_MAP_CHUNKS, workers=MAP_WORKERS):
+    """
+    Apply fn to the best max_chunks chunks of text in parallel and return the
+    results in document order. The caller reduces them.
+    """
+    chunks = best_chunks(text, budget_tokens=chunk_tokens * max_chunks, chunk_tokens=chunk_tokens, limit=max_chunks)
+    if len(chunks) <= 1:
+        return [fn(chunk.text) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        # Copy the context so spans from the workers land in the caller's trace
+        futures = [executor.submit(contextvars.copy_context().run, fn, chunk.text) for chunk in chunks]
+        return [future.result() for future in futures]
@@ -1,31 +1,344 @@
 # utils/nvidia_client.py
 
-from openai import OpenAI
+import asyncio
+import itertools
+import json
+import logging
 import os
-from dotenv import load_dotenv
+import random
+import threading
+import time
 
-load_dotenv()  
+from utils.tracing import metrics, span
 
-client = OpenAI(
-    base_url="https://integrate.api.nvidia.com/v1",
-    api_key=os.getenv("NVIDIA_API_KEY")  
-)
+# openai, httpx and dotenv are imported on first use so importing the pipeline stays cheap.
+# Entry points (app.py, main.py, api.py) load .env before importing this module.
 
-def query_nvidia(prompt: str) -> str:
-    try:
-        response = client.chat.completions.create(
-            model="nvidia/llama-3.3-nemotron-super-49b-v1",
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv("NVIDIA_MODEL", "nvidia/llama-3.3-nemotron-super-49b-v1")
+BASE_URL = os.getenv("NVIDIA_BASE_URL", "https://integrate.api.nvidia.com/v1")
+SYSTEM_PROMPT = "You are a helpful information extraction assistant."
+
+# Pool and limiter settings, overridable per deployment
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+# One httpx pool slows down sharply once many requests queue on it, so connections
+# are spread over several small pools; this is the size of each
+CONNECTIONS_PER_POOL = int(os.getenv("LLM_CONNECTIONS_PER_POOL", "16"))
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "100000"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Calls that pass until= stream their reply and stop early; 0 sends every call unstreamed
+STREAM_REPLIES = os.getenv("LLM_STREAM", "1") != "0"
+# Ask streams for a final usage chunk (stream_options.include_usage). Servers that answer it with
+# a 400 (some llama.cpp / vLLM builds) are retried without it once; usage is then estimated from the text
+STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") != "0"
+
+
+class LLMError(Exception):
+    """Base class for LLM client failures"""
+
+class LLMRateLimitError(LLMError):
+    """HTTP 429 after all retries"""
+
+class LLMServerError(LLMError):
+    """HTTP 5xx after all retries"""
+
+class LLMTimeoutError(LLMError):
+    """Request timed out or the connection failed after all retries"""
+
+class LLMResponseError(LLMError):
+    """Non-retryable HTTP error or an empty completion"""
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at rate_per_minute, holding at most one minute of budget"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1.0):
+        # Requests larger than the bucket are clamped so they can still go through once it is full
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + max(0.0, amount))
+
+
+def estimate_tokens(text):
+    """Rough prompt size estimate (~4 characters per token) used for rate limiting"""
+    return max(1, len(text) // 4)
+
+
+class AsyncLLMClient:
+    """
+    OpenAI-compatible chat client sharing one pooled HTTP connection set, with
+    request/token rate limiting and exponential backoff with full jitter on 429/5xx.
+    """
+
+    def __init__(self, base_url=BASE_URL, api_key=None, model=MODEL_NAME,
+                 max_connections=MAX_CONNECTIONS, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES,
+                 timeout=REQUEST_TIMEOUT, backoff_base=0.5, backoff_cap=20.0, stream_usage=STREAM_USAGE):
+        import httpx
+        from openai import AsyncOpenAI
+
+        self.model = model
+        self.stream_usage = stream_usage
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        shards = max(1, -(-max_connections // CONNECTIONS_PER_POOL))
+        self.http_clients = [
+            httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=-(-max_connections // shards),
+                                    max_keepalive_connections=-(-max_connections // shards)),
+                timeout=timeout
+            )
+            for _ in range(shards)
+        ]
+        self.clients = [
+            AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key or os.getenv("NVIDIA_API_KEY") or "not-set",
+                http_client=http_client,
+                max_retries=0  # retries are handled here so they respect the limiter
+            )
+            for http_client in self.http_clients
+        ]
+        self.client = self.clients[0]
+        self._next_client = itertools.cycle(self.clients)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(self.backoff_cap, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    async def complete(self, prompt, max_tokens=1024, temperature=0.4, system=SYSTEM_PROMPT):
+        content, _ = await self.complete_with_usage(prompt, max_tokens, temperature, system)
+        return content
+
+    async def complete_with_usage(self, prompt, max_tokens=1024, temperature=0.4, system=SYSTEM_PROMPT, stop=None):
+        """Like complete(), but returns (content, usage) with prompt/completion token counts and attempts"""
+        async def request(client):
+            response = await client.chat.completions.create(
+                **self._params(prompt, max_tokens, temperature, system, stop), stream=False
+            )
+            content = response.choices[0].message.content if response.choices else None
+            usage = getattr(response, "usage", None)
+            return content, usage.model_dump() if usage is not None else None, {}
+
+        return await self._with_retries(prompt, max_tokens, system, request)
+
+    async def stream_with_usage(self, prompt, max_tokens=1024, temperature=0.4, system=SYSTEM_PROMPT,
+                                stop=None, until=None):
+        """
+        Streamed completion returning (content, usage) like complete_with_usage().
+        until(text) is called on the client loop with the reply so far after every
+        chunk and must be quick; once it returns True the stream is closed, so
+        callers that only need the start of a reply do not wait for all of it.
+        """
+        import openai
+
+        async def read(client, include_usage):
+            started = time.perf_counter()
+            text, usage, first_token, stopped = "", None, None, False
+            options = {"stream_options": {"include_usage": True}} if include_usage else {}
+            # Raw server-sent events: building an SDK model for every chunk costs more than the chunk itself
+            async with client.chat.completions.with_streaming_response.create(
+                **self._params(prompt, max_tokens, temperature, system, stop), stream=True, **options
+            ) as response:
+                async for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        raise LLMResponseError(f"Malformed stream event: {data[:200]}")
+                    if chunk.get("error"):
+                        raise LLMResponseError(f"Stream error: {chunk['error']}")
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices")
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if not delta:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    text += delta
+                    if until is not None and until(text):
+                        stopped = True
+                        break
+            return text, usage, {
+                "first_token_ms": round(1000 * first_token, 3) if first_token is not None else None,
+                "stopped_early": stopped,
+            }
+
+        async def request(client):
+            if not self.stream_usage:
+                return await read(client, False)
+            try:
+                return await read(client, True)
+            except openai.BadRequestError as e:
+                # Only a retry without stream_options that succeeds shows the server rejected that
+                result = await read(client, False)
+                self.stream_usage = False
+                metrics.inc("llm_stream_usage_disabled_total")
+                logger.warning(f"LLM server at {client.base_url} rejects stream_options ({e.status_code}); "
+                               f"streaming without usage, estimated from the text instead")
+                return result
+
+        return await self._with_retries(prompt, max_tokens, system, request)
+
+    def _params(self, prompt, max_tokens, temperature, system, stop):
+        params = dict(
+            model=self.model,
             messages=[
-                {"role": "system", "content": "You are a helpful information extraction assistant."},
+                {"role": "system", "content": system},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.4,
+            temperature=temperature,
             top_p=0.9,
-            max_tokens=1024,
+            max_tokens=max_tokens,
             frequency_penalty=0,
             presence_penalty=0,
-            stream=False
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error: {str(e)}"
+        if stop:
+            params["stop"] = stop
+        return params
+
+    async def _with_retries(self, prompt, max_tokens, system, request):
+        """
+        Run request(client) -> (content, usage dict or None, extra) under the limiters,
+        retrying 429/5xx/timeouts with backoff. Returns (content, usage).
+        """
+        import httpx
+        import openai
+
+        estimated = estimate_tokens(system) + estimate_tokens(prompt) + max_tokens
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire()
+            await self.token_bucket.acquire(estimated)
+            retry_after = None
+            try:
+                content, usage, extra = await request(next(self._next_client))
+            except openai.RateLimitError as e:
+                last_error = LLMRateLimitError(str(e))
+                retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+            except openai.InternalServerError as e:
+                last_error = LLMServerError(str(e))
+            except (openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError) as e:
+                # httpx errors surface unwrapped when a stream breaks off mid-reply
+                last_error = LLMTimeoutError(str(e))
+            except openai.APIStatusError as e:
+                raise LLMResponseError(f"HTTP {e.status_code}: {str(e)}") from e
+            else:
+                if not content:
+                    raise LLMResponseError("Empty completion")
+                if usage and usage.get("total_tokens"):
+                    prompt_tokens, completion_tokens = usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+                else:
+                    # Streams closed early, or sent without stream_options, carry no usage
+                    prompt_tokens = estimate_tokens(system) + estimate_tokens(prompt)
+                    completion_tokens = estimate_tokens(content)
+                self.token_bucket.refund(estimated - prompt_tokens - completion_tokens)
+                return content.strip(), dict(extra, prompt_tokens=prompt_tokens,
+                                             completion_tokens=completion_tokens, attempts=attempt + 1)
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                metrics.inc("llm_retries_total", reason=type(last_error).__name__)
+                logger.warning(f"LLM call failed ({last_error}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        raise last_error
+
+    async def aclose(self):
+        for client in self.clients:
+            await client.close()
+
+
+# Sync callers share one client whose pool lives on a dedicated event loop thread
+_loop = None
+_async_client = None
+_lock = threading.Lock()
+
+def _get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-client-loop", daemon=True).start()
+        return _loop
+
+def get_async_client() -> AsyncLLMClient:
+    """Process-wide client bound to the background loop used by the sync wrappers, built on first use"""
+    global _async_client
+    loop = _get_loop()
+    with _lock:
+        if _async_client is None:
+            # Picks up NVIDIA_API_KEY from .env when the entry point did not load it
+            from dotenv import load_dotenv
+            load_dotenv()
+            async def build():
+                return AsyncLLMClient()
+            _async_client = asyncio.run_coroutine_threadsafe(build(), loop).result()
+        return _async_client
+
+def run_sync(coro):
+    """Run a coroutine on the shared client loop and block for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+def query_nvidia(prompt: str, max_tokens: int = 1024, task: str = "completion", stop=None, until=None) -> str:
+    """
+    Blocking completion; raises an LLMError subclass instead of returning an error string.
+    The backend is chosen per task by utils.llm_router. With until, the reply is
+    streamed and cut off as soon as until(text) is true (see
+    AsyncLLMClient.stream_with_usage). Each call is traced as an llm.<task> span
+    carrying its backend and token counts.
+    """
+    # Imported here: the router module builds on this one
+    from utils.llm_router import get_router
+
+    with span(f"llm.{task}", streamed=until is not None and STREAM_REPLIES) as current:
+        router = get_router()
+        try:
+            content, usage, backend = run_sync(router.complete(task, prompt, max_tokens=max_tokens,
+                                                               stop=stop, until=until))
+        except LLMError as e:
+            metrics.inc("llm_requests_total", task=task, status=type(e).__name__)
+            raise
+        current.set(backend=backend.name, model=backend.model, **usage)
+        metrics.inc("llm_requests_total", task=task, status="ok")
+        metrics.inc("llm_tokens_total", usage["prompt_tokens"], task=task, kind="prompt")
+        metrics.inc("llm_tokens_total", usage["completion_tokens"], task=task, kind="completion")
+        if usage.get("stopped_early"):
+            metrics.inc("llm_streams_stopped_early_total", task=task)
+        return content
@@ -0,0 +1,159 @@
+# utils/email_parser.py
+import email.policy
+import os
+import re
+from email.parser import BytesFeedParser
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
+
+# Bytes fed to the MIME parser at a time, so a file is never read in one piece
+FEED_CHUNK_SIZE = 64 * 1024
+# Attachments with these extensions are classified as documents of their own; others are only listed
+CHILD_EXTENSIONS = (".pdf", ".json")
+MAX_ATTACHMENTS = int(os.getenv("EMAIL_MAX_ATTACHMENTS", "10"))
+
+HEADERS = ["from", "to", "cc", "date", "subject"]
+
+# Start of the quoted history below a reply: "On <date>, <name> wrote:" (possibly wrapped),
+# Outlook's "-----Original Message-----" or "From: ... Sent: ..." block, or an underscore rule
+_REPLY_HISTORY = re.compile(
+    r"^[ \t]*(?:On\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:[ \t]*$"
+    r"|-{2,}[ \t]*Original Message[ \t]*-{2,}"
+    r"|_{10,}[ \t]*$"
+    r"|From:[^\n]+\n(?:[^\n]+\n){0,3}?[ \t]*Sent:)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_QUOTED_LINE = re.compile(r"^[ \t]*>[^\n]*\n?", re.MULTILINE)
+_SPACES = re.compile(r"[ \t\r\f\v\xa0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*(?:\n\s*)+")
+
+
+class _HTMLText(HTMLParser):
+    """Visible text of an HTML body; blocks become line breaks, quoted replies and scripts are dropped"""
+
+    SKIP = {"script", "style", "head", "title", "blockquote"}
+    BLOCKS = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+        elif tag == "td":
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(markup):
+    parser = _HTMLText()
+    parser.feed(markup)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def strip_quoted(text):
+    """The newest message of a reply chain: text above the quoted history, without '>' lines"""
+    match = _REPLY_HISTORY.search(text)
+    newest = text[:match.start()] if match else text
+    newest = _QUOTED_LINE.sub("", newest)
+    # A bare forward or an inline-only reply has nothing above the history, so keep it all
+    return newest if newest.strip() else text
+
+
+def normalize_text(text):
+    lines = (_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _chunks(content):
+    if isinstance(content, os.PathLike):
+        with open(content, "rb") as f:
+            for block in iter(lambda: f.read(FEED_CHUNK_SIZE), b""):
+                yield block
+        return
+    if hasattr(content, "read"):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        for block in iter(lambda: content.read(FEED_CHUNK_SIZE), b"" if "b" in getattr(content, "mode", "b") else ""):
+            yield block.encode("utf-8", errors="surrogateescape") if isinstance(block, str) else block
+        return
+    if isinstance(content, str):
+        content = content.encode("utf-8", errors="surrogateescape")
+    view = memoryview(content)
+    for start in range(0, len(view), FEED_CHUNK_SIZE):
+        yield bytes(view[start:start + FEED_CHUNK_SIZE])
+
+
+def _header(message, name):
+    value = message.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if name == "date":
+        # ISO dates are what the rule extractor and the doc_date column understand
+        try:
+            return parsedate_to_datetime(value).date().isoformat()
+        except (TypeError, ValueError):
+            return value
+    return value or None
+
+
+def parse_email(content):
+    """
+    Parse an .eml / MIME message, fed to BytesFeedParser in FEED_CHUNK_SIZE pieces.
+    Returns {"headers": {from, to, cc, date, subject}, "text": newest message body
+    (HTML converted to text, quoted history removed), "attachments": [(filename, bytes)]
+    of CHILD_EXTENSIONS, "attachment_names": every attached filename}.
+    """
+    parser = BytesFeedParser(policy=email.policy.default)
+    for block in _chunks(content):
+        parser.feed(block)
+    message = parser.close()
+
+    headers = {name: _header(message, name) for name in HEADERS}
+    body = message.get_body(preferencelist=("plain", "html"))
+    text = ""
+    if body is not None:
+        try:
+            text = body.get_content()
+        except (LookupError, UnicodeError):
+            # Unknown or lying charset
+            text = (body.get_payload(decode=True) or b"").decode("utf-8", errors="ignore")
+        if body.get_content_subtype() == "html":
+            text = html_to_text(text)
+    text = normalize_text(strip_quoted(text.replace("\r\n", "\n")))
+
+    attachments, names = [], []
+    for part in message.walk():
+        if part.is_multipart() or part is body:
+            continue
+        filename = part.get_filename()
+        if not filename:
+            continue
+        filename = os.path.basename(filename)
+        names.append(filename)
+        if filename.lower().endswith(CHILD_EXTENSIONS) and len(attachments) < MAX_ATTACHMENTS:
+            attachments.append((filename, part.get_payload(decode=True) or b""))
+    return {"headers": headers, "text": text, "attachments": attachments, "attachment_names": names}
+
+
+def render_email(parsed):
+    """Prompt text for a parsed email: its headers as "Name: value" lines, then the body"""
+    lines = [f"{name.title()}: {value}" for name, value in parsed["headers"].items() if value]
+    if parsed["attachment_names"]:
+        lines.append(f"Attachments: {', '.join(parsed['attachment_names'])}")
+    return "\n".join(lines) + "\n\n" + parsed["text"] if lines else parsed["text"]
@@ -1,10 +1,19 @@
 # utils/file_parser.py
 import os
 import io
-import pdfplumber
+import mmap
 import json
 import warnings
 
+# Inputs larger than this are rejected before any parsing work is done
+MAX_INPUT_BYTES = int(os.getenv("MAX_INPUT_BYTES", str(50 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "2000"))
+# Full-document parallel extraction only pays off past a few pages
+PARALLEL_MIN_PAGES = 8
+
+class DocumentError(ValueError):
+    """The document itself is unusable: too large, corrupt or empty"""
+
 def detect_format(file_path):
     _, ext = os.path.splitext(file_path.lower())
     if ext == '.pdf':
@@ -15,46 +24,160 @@ def detect_format(file_path):
         return "Email"
     return "Unknown"
 
-def read_file(filename, content):
+def _input_size(content):
+    if isinstance(content, os.PathLike):
+        return os.path.getsize(content)
+    if isinstance(content, (bytes, bytearray, mmap.mmap)):
+        return len(content)
+    if isinstance(content, str):
+        return len(content.encode('utf-8', errors='ignore'))
+    if hasattr(content, "seek") and hasattr(content, "tell"):
+        position = content.tell()
+        size = content.seek(0, io.SEEK_END)
+        content.seek(position)
+        return size
+    return 0
+
+def check_size(content):
+    size = _input_size(content)
+    if size > MAX_INPUT_BYTES:
+        raise DocumentError(f"Input is {size} bytes, larger than the {MAX_INPUT_BYTES} byte limit")
+
+class _PdfSource:
+    """
+    Open a PDF from bytes, a path (memory-mapped, so the file is never copied
+    into the process) or an existing file-like object such as a Streamlit upload.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        if isinstance(self.content, os.PathLike):
+            self._file = open(self.content, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+        if isinstance(self.content, (bytes, bytearray)):
+            return io.BytesIO(self.content)
+        if hasattr(self.content, "seek"):
+            self.content.seek(0)
+        return self.content
+
+    def __exit__(self, *exc):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+def iter_pdf_text(content, max_chars=None, start_page=0, stop_page=None):
+    """
+    Lazily yield the text of each PDF page, stopping as soon as max_chars
+    characters have been produced so long documents are never fully parsed.
+    """
+    import pdfplumber  # deferred: pdfminer is slow to import and most documents are not PDFs
+
+    produced = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with _PdfSource(content) as source, pdfplumber.open(source) as pdf:
+            if len(pdf.pages) > MAX_PDF_PAGES:
+                raise DocumentError(f"PDF has {len(pdf.pages)} pages, more than the {MAX_PDF_PAGES} page limit")
+            for page in pdf.pages[start_page:stop_page]:
+                try:
+                    extracted = page.extract_text()
+                except Exception:
+                    continue
+                finally:
+                    # Drop the parsed layout objects of pages we are done with
+                    close = getattr(page, "close", None)
+                    if close:
+                        close()
+                if not extracted:
+                    continue
+                if max_chars is not None and produced + len(extracted) >= max_chars:
+                    yield extracted[:max_chars - produced]
+                    return
+                produced += len(extracted) + 1
+                yield extracted
+
+def pdf_page_count(content):
+    import pdfplumber
+    with _PdfSource(content) as source, pdfplumber.open(source) as pdf:
+        return len(pdf.pages)
+
+def _extract_page_range(content, start_page, stop_page):
+    # Runs in a worker process, so content is a path or bytes
+    return list(iter_pdf_text(content, start_page=start_page, stop_page=stop_page))
+
+def read_pdf_parallel(content, workers=None):
+    """Extract every page of a PDF, splitting page ranges across a process pool"""
+    if not isinstance(content, (os.PathLike, bytes)):
+        with _PdfSource(content) as source:
+            content = source.read()
+    page_count = pdf_page_count(content)
+    workers = workers or os.cpu_count() or 1
+    if page_count < PARALLEL_MIN_PAGES or workers == 1:
+        return "\n".join(iter_pdf_text(content))
+
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_extract_page_range, content, start, stop) for start, stop in ranges]
+        return "\n".join(text for future in futures for text in future.result())
+
+def read_file(filename, content, max_chars=None, parallel=False):
     """
     Read and parse different file types from content
     Args:
         filename: Name of the file
-        content: File content (can be bytes or string)
+        content: File content (bytes, string, file path or file-like object)
+        max_chars: Stop parsing PDFs/text once this many characters are available
+        parallel: Extract all PDF pages in a process pool (ignored when max_chars is set)
     Returns:
         str: Parsed content as text
     """
     file_format = detect_format(filename)
-    
+    check_size(content)
+
     if file_format == "PDF":
         try:
-            # Handle PDF content with warning suppression
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                with pdfplumber.open(io.BytesIO(content)) as pdf:
-                    text = ""
-                    for page in pdf.pages:
-                        try:
-                            extracted = page.extract_text()
-                            if extracted:
-                                text += extracted + "\n"
-                        except Exception:
-                            continue
-                    return text.strip()
+            if parallel and max_chars is None:
+                return read_pdf_parallel(content).strip()
+            return "\n".join(iter_pdf_text(content, max_chars=max_chars)).strip()
+        except DocumentError:
+            raise
         except Exception as e:
-            raise Exception(f"Error parsing PDF: {str(e)}")
-            
-    elif file_format == "JSON":
+            raise DocumentError(f"Error parsing PDF: {str(e)}") from e
+
+    if filename.lower().endswith(".eml"):
+        # MIME-aware: headers, the newest body as text, no attachments or quoted history
+        from utils.email_parser import parse_email, render_email
+        text = render_email(parse_email(content))
+        return text[:max_chars] if max_chars is not None else text
+
+    if isinstance(content, os.PathLike):
+        with open(content, "rb") as f:
+            content = f.read()
+    elif hasattr(content, "read"):
+        content = content.read()
+
+    if file_format == "JSON":
         try:
-            # Handle JSON content
+            # Handle JSON content; it is validated but passed on as-is rather than re-indented
             if isinstance(content, bytes):
                 content = content.decode('utf-8')
-            return json.dumps(json.loads(content), indent=2)
+            json.loads(content)
+            content = content.strip()
+            return content[:max_chars] if max_chars is not None else content
         except Exception as e:
-            raise Exception(f"Error parsing JSON: {str(e)}")
-            
+            raise DocumentError(f"Error parsing JSON: {str(e)}") from e
+
     else:
         # Handle text/email content
         if isinstance(content, bytes):
-            return content.decode('utf-8', errors='ignore')
-        return content
+            content = content.decode('utf-8', errors='ignore')
+        return content[:max_chars] if max_chars is not None else content
@@ -1,134 +1,151 @@
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List
+
+# Fields shared by the AI extraction prompt and the rule-based extractor
+EXTRACTION_SCHEMA = ["sender", "recipients", "dates", "emails", "amounts", "key_details"]
+
+# Declared type of each field; LLM replies are validated and coerced against it
+EXTRACTION_TYPES = {
+    "sender": str,
+    "recipients": list,
+    "dates": list,
+    "emails": list,
+    "amounts": list,
+    "key_details": dict,
+}
+
+_MONTHS = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+
+# One alternation so the whole text is scanned in a single pass; the named group tells us what matched
+_TOKEN_PATTERN = re.compile(
+    r"(?im)"
+    r"^[ \t>]*(?P<header>from|to|cc|subject|date)[ \t]*:[ \t]*(?P<header_value>[^\r\n]+)"
+    r"|(?P<email>\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b)"
+    r"|(?P<date>\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"
+    r"|\b" + _MONTHS + r"\.?[ \t]+\d{1,2}(?:st|nd|rd|th)?,?[ \t]+\d{4}\b"
+    r"|\b\d{1,2}(?:st|nd|rd|th)?[ \t]+" + _MONTHS + r"\.?,?[ \t]+\d{4}\b)"
+    r"|(?P<money>(?:[$€£₹]|\b(?:usd|eur|gbp|inr|rs\.?)[ \t]?)[ \t]?\d[\d,]*(?:\.\d{1,2})?"
+    r"|\b\d[\d,]*(?:\.\d{1,2})?[ \t]?(?:usd|eur|gbp|inr)\b)"
+    r"|(?P<labelled_amount>\b(?:sub[_ ]?total|total(?:[_ ]amount)?|amount(?:[_ ]due)?|balance(?:[_ ]due)?|grand[_ ]total)\b\"?[ \t]*[:=]?[ \t]*\"?(?P<labelled_value>\d[\d,]*(?:\.\d+)?))"
+    r"|(?P<invoice_id>\binv(?:oice)?[-_ ]?(?:no\.?|number|num|#)?[\"']?[ \t]*[:#]?[ \t]*[\"']?(?P<invoice_value>[A-Z]{0,4}-?\d[\w-]*))"
+    r"|(?P<order_id>\b(?:order|po|purchase[ \t]order)[-_ ]?(?:no\.?|number|id|#)?[\"']?[ \t]*[:#]?[ \t]*[\"']?(?P<order_value>[A-Z]{0,4}-?\d[\w-]*))"
+    r"|(?P<salutation>^[ \t]*(?:dear|hi|hello)[ \t]+(?P<salutation_name>[^,\r\n]{2,60}),)"
+    r"|(?P<signoff>^[ \t]*(?:regards|best regards|kind regards|sincerely|thanks|thank you|cheers),?[ \t]*\r?\n[ \t]*(?P<signoff_name>[^\r\n]{2,60}))"
+)
+
+_ADDRESS_SPLIT = re.compile(r"[;,]")
+_NAME_EMAIL = re.compile(r"^\s*\"?([^\"<]*?)\"?\s*<([^>]+)>\s*$")
+
+
+def _append_unique(values: List[str], value: str):
+    value = value.strip().strip("\"'")
+    if value and value not in values:
+        values.append(value)
+
+
+def _split_addresses(header_value: str) -> List[str]:
+    addresses = []
+    for part in _ADDRESS_SPLIT.split(header_value):
+        match = _NAME_EMAIL.match(part)
+        _append_unique(addresses, match.group(2) if match else part)
+    return addresses
+
+
+def extract_with_rules(content: str) -> Dict[str, Any]:
+    """
+    Deterministic, offline extraction of the EXTRACTION_SCHEMA fields using
+    precompiled patterns for headers, emails, dates, amounts and document IDs.
+    Fields with no evidence are None so callers can ask the LLM for just those.
+    """
+    headers = {}
+    emails, dates, amounts, invoice_ids, order_ids = [], [], [], [], []
+    salutation = signoff = None
+
+    for match in _TOKEN_PATTERN.finditer(content or ""):
+        if match.group("header"):
+            headers.setdefault(match.group("header").lower(), match.group("header_value").strip())
+            for address in re.findall(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+", match.group("header_value")):
+                _append_unique(emails, address)
+        elif match.group("email"):
+            _append_unique(emails, match.group("email"))
+        elif match.group("date"):
+            _append_unique(dates, match.group("date"))
+        elif match.group("money"):
+            _append_unique(amounts, match.group("money"))
+        elif match.group("labelled_amount"):
+            _append_unique(amounts, match.group("labelled_value"))
+        elif match.group("invoice_id"):
+            _append_unique(invoice_ids, match.group("invoice_value"))
+        elif match.group("order_id"):
+            _append_unique(order_ids, match.group("order_value"))
+        elif match.group("salutation") and salutation is None:
+            salutation = match.group("salutation_name").strip()
+        elif match.group("signoff"):
+            signoff = match.group("signoff_name").strip()
+
+    if "date" in headers:
+        _append_unique(dates, headers["date"])
+
+    sender = headers.get("from") or signoff
+    recipients = []
+    for header in ("to", "cc"):
+        if header in headers:
+            recipients.extend(r for r in _split_addresses(headers[header]) if r not in recipients)
+    if not recipients and salutation:
+        recipients = [salutation]
+
+    key_details = {}
+    if headers.get("subject"):
+        key_details["subject"] = headers["subject"]
+    if invoice_ids:
+        key_details["invoice_ids"] = invoice_ids
+    if order_ids:
+        key_details["order_ids"] = order_ids
+
+    return {
+        "sender": sender or None,
+        "recipients": recipients or None,
+        "dates": dates or None,
+        "emails": emails or None,
+        "amounts": amounts or None,
+        "key_details": key_details or None,
+    }
+
+
+def missing_fields(result: Dict[str, Any]) -> List[str]:
+    return [field for field in EXTRACTION_SCHEMA if not result.get(field)]
+
 
 def clean_json_string(json_str: str) -> str:
     """Remove comments and clean JSON string for parsing"""
-    import re
-    
     # Remove single-line comments
     json_str = re.sub(r'//.*$', '', json_str, flags=re.MULTILINE)
-    
+
     # Remove multi-line comments
     json_str = re.sub(r'/\*.*?\*/', '', json_str, flags=re.DOTALL)
-    
+
     return json_str
 
+
 def extract_information(content: str) -> Dict[str, Any]:
+    """No-network extraction fallback built on extract_with_rules"""
     from datetime import datetime
-    from .client import query_nvidia
-    import json
 
-    def create_error_response(error_msg: str, ai_result: str = None) -> Dict[str, Any]:
-        response = {
-            "error": error_msg,
+    if not content:
+        return {
+            "error": "Empty content provided",
             "timestamp": datetime.now().isoformat(),
-            "raw_content": content[:100] if content else "",
+            "raw_content": "",
             "status": "error"
         }
-        if ai_result:
-            response["ai_result"] = ai_result
-        return response
 
-    if not content:
-        return create_error_response("Empty content provided")
-
-    try:
-        # First determine if input is JSON
-        try:
-            json_content = json.loads(content)
-            extraction_prompt = f"""
-            Analyze this JSON document and extract key information into a clean JSON structure.
-            Format requirements:
-            - All strings must use double quotes
-            - No comments in the JSON
-            - No trailing commas
-            - No control characters
-
-            Required fields:
-            - sender: Extract from From/Sender fields or main content
-            - recipients: Array of recipient email addresses
-            - subject: Message or document subject
-            - body: Main message content
-            - dates: Array of all dates found
-            - emails: Array of all email addresses
-            - key_details: Object containing any important transaction/business details
-
-            Source JSON:
-            {json.dumps(json_content, indent=2)}
-            """
-        except json.JSONDecodeError:
-            # Check if it might be PDF content
-            if isinstance(content, bytes) or content.startswith('%PDF'):
-                extraction_prompt = f"""
-                Extract key information from this PDF content.
-                Return a clean JSON object with these fields:
-                - sender: Author or sender information
-                - recipients: Array of intended recipients
-                - subject: Document title or subject
-                - body: Main document content (summarized if long)
-                - dates: Array of dates found
-                - emails: Array of email addresses
-                - key_details: Object with key document information
-
-                Note: Return valid JSON with double quotes, no comments, no trailing commas.
-                """
-            else:
-                # Plain text prompt
-                extraction_prompt = f"""
-                Extract information from this text content.
-                Return a clean JSON object with these fields:
-                - sender: Who sent or authored this
-                - recipients: Array of recipients
-                - subject: Message or document subject
-                - body: Main content (summarized if needed)
-                - dates: Array of any dates found
-                - emails: Array of email addresses found
-                - key_details: Object with important details
-
-                Return valid JSON:
-                - Use double quotes for strings
-                - No comments
-                - No trailing commas
-                - Arrays for multiple values
-                - Null for missing fields
-
-                Content:
-                {content[:2000]}
-                """
-
-        ai_result = query_nvidia(extraction_prompt)
-        
-        if not ai_result:
-            return create_error_response("AI returned empty response")
-            
-        if not isinstance(ai_result, str):
-            return create_error_response(f"AI returned invalid type: {type(ai_result)}")
-            
-        ai_result = ai_result.strip()
-        
-        # Look for JSON content within markdown or other formatting
-        json_start = ai_result.find('{')
-        json_end = ai_result.rfind('}')
-        
-        if json_start >= 0 and json_end > json_start:
-            try:
-                ai_result = ai_result[json_start:json_end + 1]
-                # Clean the JSON string before parsing
-                cleaned_json = clean_json_string(ai_result)
-                parsed_result = json.loads(cleaned_json)
-            except json.JSONDecodeError as e:
-                return create_error_response(f"Failed to parse AI JSON: {str(e)}", ai_result)
-        else:
-            return create_error_response("No JSON object found in AI response", ai_result)
-
-        # Add metadata
-        parsed_result.update({
-            "timestamp": datetime.now().isoformat(),
-            "content_length": len(content),
-            "extraction_method": "nvidia_ai",
-            "content_type": "json" if "json_content" in locals() else "text",
-            "status": "success"
-        })
-        return parsed_result
-
-    except Exception as e:
-        return create_error_response(f"Unexpected error: {str(e)}")
\ No newline at end of file
+    result = extract_with_rules(content)
+    result.update({
+        "timestamp": datetime.now().isoformat(),
+        "content_length": len(content),
+        "extraction_method": "regex",
+        "missing_fields": missing_fields(result),
+        "status": "success"
+    })
+    return result
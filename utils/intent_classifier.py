@@ -1,8 +1,44 @@
 # utils/intent_classifier.py
+import re
 
 from utils.client import query_nvidia
+from utils.chunker import select_text
+
+ALLOWED_INTENTS = [
+    "Email",
+    "Email+Invoice",
+    "Email+RFQ",
+    "Email+Complaint",
+    "Email+Regulation"
+]
+
+# A label needs only a few tokens; the stream is closed as soon as one is complete
+LABEL_MAX_TOKENS = 32
+
+# An allowed label opening the reply, followed by something that cannot extend it
+_LABEL_AT_START = re.compile(
+    r"^[\s'\"`*]*(" + "|".join(re.escape(label) for label in sorted(ALLOWED_INTENTS, key=len, reverse=True)) + r")(?=[^\w+])"
+)
+
+def label_complete(text):
+    """Stream stop condition: the reply so far opens with a whole allowed label"""
+    return _LABEL_AT_START.match(text) is not None
+
+def normalize_intent(label):
+    """Map a model label onto ALLOWED_INTENTS, or return None if it is not a valid intent"""
+    if not label or not isinstance(label, str):
+        return None
+    label = label.strip().strip("'\"`.").strip()
+    if not label.lower().startswith("email"):
+        label = f"Email+{label}"
+    for allowed in ALLOWED_INTENTS:
+        if label.lower().replace(" ", "") == allowed.lower():
+            return allowed
+    return None
 
 def classify_intent(text: str) -> str:
+    # Bounded prompt: long inputs are reduced to their most relevant chunks
+    text = select_text(text)
     prompt = f"""Classify the intent of the following content.
 Base intents are: Invoice, RFQ, Complaint, Regulation.
 Since all content is from emails, always prefix the intent with 'Email+'.
@@ -16,8 +52,11 @@ Content:
 
 Return only the label (e.g., 'Email+Invoice', 'Email+RFQ', 'Email').
 """
-    result = query_nvidia(prompt)
-    
+    result = query_nvidia(prompt, max_tokens=LABEL_MAX_TOKENS, task="classify", until=label_complete)
+    match = _LABEL_AT_START.match(f"{result}\n")
+    if match:
+        return match.group(1)
+
     # Ensure result is properly formatted
     if result and isinstance(result, str):
         result = result.strip()
@@ -0,0 +1,149 @@
+# utils/job_workers.py
+import logging
+import os
+import pathlib
+import threading
+from concurrent.futures import Future
+
+from agents.classifier_agent import classify_and_route
+from memory.job_queue import JobQueue
+from memory.result_cache import content_hash
+from utils.batch_runner import load_document
+from utils.tracing import start_trace
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# Progress reported when a pipeline span starts; anything unlisted keeps the last value
+STAGE_PROGRESS = [
+    ("json.mapping", 0.3, "mapping JSON"),
+    ("parse", 0.2, "parsing"),
+    ("rules", 0.35, "rules"),
+    ("llm.", 0.5, "waiting for LLM"),
+    ("json.parse", 0.85, "parsing reply"),
+    ("db.", 0.95, "saving"),
+]
+
+
+def stage_progress(span_name):
+    for prefix, progress, stage in STAGE_PROGRESS:
+        if span_name.startswith(prefix):
+            return progress, stage
+    return None
+
+
+class WorkerPool:
+    """
+    Threads draining a JobQueue: each claims a job, runs classify_and_route,
+    logs the result (with its trace) through writer (the store, or a shared
+    BatchWriter) and marks the job done. The threads only block on their own
+    job, never on the UI.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, cache=None, near_duplicates=None, poll_interval=POLL_INTERVAL,
+                 writer=None):
+        self.store = store
+        self.writer = writer or store
+        self.queue = JobQueue(store)
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return self
+        self.queue.requeue_stale()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"worker-{os.getpid()}-{index}",),
+                                      name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def notify(self):
+        """Wake idle workers right away instead of at the next poll"""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def process(self, job_id, source, content):
+        if isinstance(content, pathlib.PurePath):
+            # Spooled upload: PDFs and emails stay on disk, text documents are read now
+            content = load_document(str(content))
+
+        def on_span(name):
+            update = stage_progress(name)
+            if update is not None:
+                self.queue.progress(job_id, *update)
+
+        with start_trace("document", on_span=on_span, source=source, job_id=job_id) as trace:
+            file_format, intent, result = classify_and_route(source, content, cache=self.cache,
+                                                           near_duplicates=self.near_duplicates)
+        self.queue.progress(job_id, 0.95, "saving")
+        log_id = self.writer.log(
+            source=source,
+            filetype=file_format,
+            intent=intent,
+            extracted=result,
+            content_hash=content_hash(content),
+            # The Trace itself, so the DB write's span is stored with it
+            trace=trace
+        )
+        if isinstance(log_id, Future):
+            # A BatchWriter's row is written with the next batch; a failed write fails the job
+            log_id = log_id.result()
+        self.queue.complete(job_id, file_format, intent, log_id)
+
+    def _run(self, name):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(name)
+            except Exception as e:
+                logger.error(f"{name} could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            job_id, source, content = job
+            try:
+                self.process(job_id, source, content)
+            except Exception as e:
+                retried = self.queue.fail(job_id, str(e))
+                logger.error(f"Job {job_id} ({source}) failed{', requeued' if retried else ''}: {str(e)}")
+
+
+if __name__ == "__main__":
+    # Standalone workers draining memory.db, alongside or instead of the Streamlit ones
+    import argparse
+    from memory.memory_store import MemoryStore
+    from memory.result_cache import ResultCache
+    from memory.near_duplicates import NearDuplicateIndex
+
+    parser = argparse.ArgumentParser(description="Drain the document job queue in memory.db")
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = MemoryStore(args.db)
+    pool = WorkerPool(store, workers=args.workers, cache=ResultCache(store),
+                      near_duplicates=NearDuplicateIndex(store)).start()
+    print(f"{args.workers} workers draining {args.db}; Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()
+        store.close()
@@ -0,0 +1,356 @@
+# utils/json_repair.py
+import json
+import re
+
+# ```json ... ``` blocks, including one left open by a truncated reply
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\r?\n?(.*?)(?:```|$)", re.DOTALL)
+_BARE_WORD = re.compile(r"[\w.+\-$€£₹]+")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$")
+_LITERALS = {"true": "true", "false": "false", "null": "null",
+             "True": "true", "False": "false", "None": "null", "NaN": "null", "undefined": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_OPENERS = {"}": "{", "]": "["}
+
+# Placeholder strings models use for "nothing found"; they must not block the rule-based values
+_EMPTY_VALUES = {"", "n/a", "na", "none", "null", "unknown", "not found", "not available",
+                 "not specified", "not mentioned", "-"}
+
+
+def _read_string(text, i):
+    """
+    Double-quoted JSON copy of the string literal opening at text[i] (either quote
+    style). Returns (literal, next index, closed).
+    """
+    quote = text[i]
+    chars = []
+    i += 1
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\":
+            if i + 1 >= len(text):
+                break
+            escaped = text[i + 1]
+            if escaped == "'":
+                chars.append("'")
+            elif escaped in '"\\/bfnrtu':
+                chars.append(ch + escaped)
+            else:
+                chars.append("\\\\" + escaped)
+            i += 2
+            continue
+        if ch == quote:
+            return '"' + "".join(chars) + '"', i + 1, True
+        if ch == '"':
+            chars.append('\\"')
+        elif ch in "\n\r\t":
+            chars.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}[ch])
+        else:
+            chars.append(ch)
+        i += 1
+    return '"' + "".join(chars), len(text), False
+
+
+def _repair(text, start):
+    """
+    Rewrite the JSON-like value starting at text[start] into strict JSON. Truncated
+    output is cut back to the last complete value and its open containers are closed.
+    Returns (json_text, repairs, end index).
+    """
+    out = []
+    repairs = set()
+    stack = []
+    expect_key = []
+    # Per open container: a value was just completed, so the next one needs a comma first
+    after_value = []
+    # Output length and open containers right after the last complete value
+    safe = (0, ())
+    i = start
+
+    def complete(value=True):
+        nonlocal safe
+        safe = (len(out), tuple(stack))
+        if value and stack:
+            after_value[-1] = True
+
+    def close():
+        drop_trailing_comma()
+        out.append(_CLOSERS[stack.pop()])
+        expect_key.pop()
+        after_value.pop()
+
+    def drop_trailing_comma():
+        j = len(out) - 1
+        while j >= 0 and out[j].isspace():
+            j -= 1
+        if j >= 0 and out[j] == ",":
+            del out[j]
+            repairs.add("trailing_comma")
+
+    while i < len(text):
+        ch = text[i]
+        if stack and after_value[-1] and (ch in "{[\"'" or _BARE_WORD.match(text, i)):
+            # {"a": "b" "c": "d"}: two members with no comma between them
+            out.append(",")
+            repairs.add("missing_comma")
+            after_value[-1] = False
+            if stack[-1] == "{":
+                expect_key[-1] = True
+        in_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+        if ch.isspace():
+            out.append(ch)
+            i += 1
+        elif text.startswith(("//", "/*"), i):
+            repairs.add("comment")
+            end = text.find("\n", i) if text[i + 1] == "/" else text.find("*/", i)
+            if end < 0:
+                break
+            i = end if text[i + 1] == "/" else end + 2
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key.append(ch == "{")
+            after_value.append(False)
+            out.append(ch)
+            i += 1
+            complete(value=False)
+        elif ch in "}]":
+            if _CLOSERS[stack[-1]] != ch:
+                repairs.add("brackets")
+                # {"a": [1, 2}: close what was left open inside the container this closes
+                while len(stack) > 1 and _OPENERS[ch] in stack and _CLOSERS[stack[-1]] != ch:
+                    close()
+            close()
+            i += 1
+            complete()
+            if not stack:
+                return "".join(out), repairs, i
+        elif ch == ",":
+            out.append(ch)
+            i += 1
+            after_value[-1] = False
+            if stack[-1] == "{":
+                expect_key[-1] = True
+        elif ch == ":":
+            out.append(ch)
+            i += 1
+            expect_key[-1] = False
+        elif ch in "\"'":
+            if ch == "'":
+                repairs.add("single_quotes")
+            literal, i, closed = _read_string(text, i)
+            if not closed:
+                # A cut-off string is dropped rather than kept half-written
+                break
+            out.append(literal)
+            if not in_key:
+                complete()
+        else:
+            match = _BARE_WORD.match(text, i)
+            if not match:
+                repairs.add("stray_characters")
+                i += 1
+                continue
+            word = match.group()
+            i = match.end()
+            if i >= len(text):
+                # Could be the start of a longer word or number
+                break
+            if in_key:
+                out.append(json.dumps(word))
+                repairs.add("unquoted")
+            elif word in _LITERALS:
+                if _LITERALS[word] != word:
+                    repairs.add("literals")
+                out.append(_LITERALS[word])
+                complete()
+            elif _NUMBER.match(word):
+                out.append(word)
+                complete()
+            else:
+                out.append(json.dumps(word))
+                repairs.add("unquoted")
+                complete()
+
+    repairs.add("truncated")
+    length, open_containers = safe
+    del out[length:]
+    drop_trailing_comma()
+    out.extend(_CLOSERS[opener] for opener in reversed(open_containers))
+    return "".join(out), repairs, len(text)
+
+
+def repair_json(text):
+    """
+    Decode model output that should hold one JSON object or array. Returns
+    (value, repairs) where repairs names what had to be fixed, e.g. "fence",
+    "prose", "single_quotes", "trailing_comma", "missing_comma", "brackets" or
+    "truncated" (only when the reply ends with containers still open); it is
+    empty for valid JSON. Raises ValueError when nothing decodable is left.
+    """
+    try:
+        return json.loads(text), []
+    except ValueError:
+        pass
+
+    repairs = set()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+        repairs.add("fence")
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        raise ValueError("No JSON object in reply")
+    start = min(starts)
+
+    repaired, fixes, end = _repair(text, start)
+    repairs |= fixes
+    if text[:start].strip() or text[end:].strip():
+        repairs.add("prose")
+    return json.loads(repaired), sorted(repairs)
+
+
+def _is_empty(value):
+    if isinstance(value, str):
+        return value.strip().lower() in _EMPTY_VALUES
+    return value is None or value == [] or value == {}
+
+
+def _scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _coerce(value, expected):
+    """value as the expected type (str, list or dict); raises TypeError when the intent is unclear"""
+    if expected is str:
+        if isinstance(value, str):
+            return value
+        if _scalar(value):
+            return str(value)
+        if isinstance(value, list) and value and all(_scalar(item) for item in value):
+            return ", ".join(str(item) for item in value)
+        if isinstance(value, dict) and (value.get("name") or value.get("email")):
+            name, email = value.get("name"), value.get("email")
+            return f"{name} <{email}>" if name and email else str(name or email)
+    elif expected is list:
+        if isinstance(value, list):
+            items = [str(item) if _scalar(item) else item for item in value if not _is_empty(item)]
+            if any(isinstance(item, (bool, list)) for item in items):
+                raise TypeError(f"unexpected list items in {value!r}")
+            return value if items == value else items
+        if _scalar(value):
+            return [str(value)]
+        if isinstance(value, dict):
+            return [value]
+    elif expected is dict:
+        if isinstance(value, dict):
+            return value
+        if isinstance(value, str):
+            return {"summary": value}
+        if isinstance(value, list):
+            return {"items": value}
+    raise TypeError(f"cannot use {type(value).__name__} as {expected.__name__}")
+
+
+def coerce_fields(data, types):
+    """
+    Validate a decoded extraction against {field: type}. Values are coerced where
+    the meaning is clear (a lone string for a list field, numbers to strings,
+    "N/A" to None) and keys outside the schema are dropped. Returns
+    (result, coerced, invalid); invalid fields are left out of result.
+    """
+    result, coerced, invalid = {}, [], []
+    for field, expected in types.items():
+        if field not in data:
+            continue
+        value = data[field]
+        if _is_empty(value):
+            result[field] = None
+            if value is not None and value != [] and value != {}:
+                coerced.append(field)
+            continue
+        try:
+            fixed = _coerce(value, expected)
+        except TypeError:
+            invalid.append(field)
+            continue
+        if fixed is not value:
+            coerced.append(field)
+        result[field] = fixed
+    return result, coerced, invalid
+
+
+class StreamingObjectParser:
+    """
+    Incremental decoder for a JSON object reply that is still streaming in.
+    feed() takes the reply so far and decodes each top-level member as soon as
+    the comma or brace ending it arrives, so parsing overlaps generation. It
+    returns True once the object has closed; value then holds the members and
+    repairs what had to be fixed. failed is set when a member would not decode,
+    in which case the whole reply should go through repair_json() instead.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.quote = None
+        self.escaped = False
+        self.member_start = None
+        self.value = {}
+        self.repairs = set()
+        self.done = False
+        self.failed = False
+
+    def feed(self, text):
+        if not text.startswith(self.text):
+            # The reply started over, e.g. after a retry
+            self.reset()
+        self.text = text
+        while self.pos < len(text) and not self.done:
+            ch = text[self.pos]
+            if self.quote is not None:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == self.quote:
+                    self.quote = None
+            elif self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+                    before = text[:self.pos].strip()
+                    if before:
+                        self.repairs.add("fence" if before.startswith("```") else "prose")
+            elif ch in "\"'":
+                self.quote = ch
+            elif ch in "{[":
+                self.depth += 1
+            elif ch == "," and self.depth == 1:
+                self._member(text[self.member_start:self.pos])
+                self.member_start = self.pos + 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._member(text[self.member_start:self.pos])
+                    self.done = True
+            self.pos += 1
+        return self.done
+
+    def _member(self, raw):
+        if not raw.strip():
+            if self.value:
+                self.repairs.add("trailing_comma")
+            return
+        try:
+            member, repairs = repair_json("{" + raw + "}")
+        except ValueError:
+            self.failed = True
+            return
+        if not isinstance(member, dict) or "truncated" in repairs:
+            self.failed = True
+            return
+        self.value.update(member)
+        self.repairs.update(repairs)
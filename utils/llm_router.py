@@ -0,0 +1,319 @@
+# utils/llm_router.py
+import asyncio
+import collections
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.client import (AsyncLLMClient, LLMError, LLMRateLimitError, LLMServerError, LLMTimeoutError, BASE_URL, MODEL_NAME, MAX_CONNECTIONS, MAX_RETRIES,
+                          REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, REQUEST_TIMEOUT, STREAM_REPLIES, STREAM_USAGE,
+                          estimate_tokens, run_sync)
+from utils.tracing import metrics
+
+logger = logging.getLogger(__name__)
+
+# Backend registry: a JSON list (or the path of a JSON file) of
+#   {"name", "base_url", "model", "api_key_env", "tasks", "cost_per_1k_prompt_tokens",
+#    "cost_per_1k_completion_tokens", "latency_ms", "max_retries", "stream_usage", ...}
+# Unset means the single NVIDIA_BASE_URL / NVIDIA_MODEL backend.
+BACKENDS_CONFIG = os.getenv("LLM_BACKENDS")
+# p95 latency each task should stay under; the cheapest backend meeting it is preferred
+TASK_BUDGETS_MS = dict({"classify": 2000, "repair": 10000, "extract": 15000, "fused": 20000, "completion": 30000},
+                       **json.loads(os.getenv("LLM_TASK_BUDGETS_MS", "{}")))
+# Send a second copy of a call to the next backend once it outlasts the first backend's p95
+HEDGE_REQUESTS = os.getenv("LLM_HEDGE", "1") != "0"
+HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "50"))
+# Consecutive failures that take a backend out of rotation, and for how long (doubling per trip).
+# Only errors saying the backend itself is unwell count; a 4xx or an empty reply is about the request.
+BREAKER_ERRORS = (LLMTimeoutError, LLMServerError, LLMRateLimitError)
+FAILURE_THRESHOLD = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))
+COOLDOWN_SECONDS = float(os.getenv("LLM_COOLDOWN_SECONDS", "30"))
+MAX_COOLDOWN_SECONDS = 600
+# Recent calls per backend and task that latency estimates are drawn from
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+
+def load_registry(config=BACKENDS_CONFIG):
+    """Backend definitions from LLM_BACKENDS (inline JSON or a file path), or the default NVIDIA backend"""
+    if not config:
+        return [{"name": "nvidia", "base_url": BASE_URL, "model": MODEL_NAME}]
+    if not config.lstrip().startswith("["):
+        with open(config, encoding="utf-8") as f:
+            config = f.read()
+    backends = json.loads(config)
+    if not backends:
+        raise ValueError("LLM_BACKENDS lists no backends")
+    names = [backend["name"] for backend in backends]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate backend names in LLM_BACKENDS: {names}")
+    return backends
+
+
+def _models(registry):
+    return "+".join(sorted({backend["model"] for backend in registry}))
+
+
+def model_key():
+    """Identifies the configured models, e.g. for result cache keys; the registry is only read once"""
+    global _model_key
+    if _model_key is None:
+        _model_key = _models(load_registry())
+    return _model_key
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Backend:
+    """One OpenAI-compatible endpoint with its own client, prices and health/latency record"""
+
+    def __init__(self, name, base_url, model, api_key_env="NVIDIA_API_KEY", tasks=None,
+                 cost_per_1k_tokens=0.0, cost_per_1k_prompt_tokens=None, cost_per_1k_completion_tokens=None,
+                 latency_ms=None, max_connections=MAX_CONNECTIONS, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT,
+                 stream_usage=STREAM_USAGE):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key_env = api_key_env
+        self.tasks = set(tasks) if tasks else None
+        self.prompt_cost = cost_per_1k_tokens if cost_per_1k_prompt_tokens is None else cost_per_1k_prompt_tokens
+        self.completion_cost = (cost_per_1k_tokens if cost_per_1k_completion_tokens is None
+                                else cost_per_1k_completion_tokens)
+        # Assumed p95 until enough calls have been timed; None counts as just meeting the task budget
+        self.prior_latency_ms = latency_ms
+        self.client_options = dict(max_connections=max_connections, requests_per_minute=requests_per_minute,
+                                   tokens_per_minute=tokens_per_minute, max_retries=max_retries, timeout=timeout,
+                                   stream_usage=stream_usage)
+        self.client = None
+
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.completion_tokens = {}
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.down_until = 0.0
+        self.cost = 0.0
+
+    def build(self):
+        # Must run on the client loop, which owns the connection pools
+        api_key = os.getenv(self.api_key_env) if self.api_key_env else None
+        self.client = AsyncLLMClient(base_url=self.base_url, api_key=api_key or "not-set", model=self.model,
+                                     **self.client_options)
+
+    def serves(self, task):
+        return self.tasks is None or task in self.tasks
+
+    def available(self, now):
+        return now >= self.down_until
+
+    def latency_ms(self, task):
+        """p95 of recent calls for task, or the configured prior"""
+        with self.lock:
+            samples = list(self.latencies.get(task, ()))
+        if len(samples) >= MIN_SAMPLES:
+            return 1000 * _percentile(samples, 95)
+        return self.prior_latency_ms
+
+    def estimated_cost(self, task, prompt_tokens, max_tokens):
+        completion = self.completion_tokens.get(task, max_tokens)
+        return (prompt_tokens * self.prompt_cost + completion * self.completion_cost) / 1000
+
+    def record_success(self, task, seconds, usage):
+        cost = (usage["prompt_tokens"] * self.prompt_cost + usage["completion_tokens"] * self.completion_cost) / 1000
+        with self.lock:
+            self.latencies[task].append(seconds)
+            previous = self.completion_tokens.get(task, usage["completion_tokens"])
+            self.completion_tokens[task] = 0.9 * previous + 0.1 * usage["completion_tokens"]
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.trips = 0
+            self.cost += cost
+        metrics.inc("llm_backend_requests_total", backend=self.name, task=task, status="ok")
+        metrics.observe("llm_backend_latency_seconds", seconds, backend=self.name, task=task)
+        metrics.inc("llm_backend_cost_total", cost, backend=self.name)
+
+    def record_cancelled(self, task, seconds):
+        """A call abandoned after seconds, e.g. the slower half of a hedge: its latency was at least that"""
+        with self.lock:
+            self.latencies[task].append(seconds)
+        metrics.inc("llm_backend_requests_total", backend=self.name, task=task, status="cancelled")
+
+    def record_failure(self, task, error):
+        with self.lock:
+            self.requests += 1
+            self.failures += 1
+            tripped = False
+            if isinstance(error, BREAKER_ERRORS):
+                self.consecutive_failures += 1
+                tripped = self.consecutive_failures >= FAILURE_THRESHOLD
+            if tripped:
+                self.trips += 1
+                cooldown = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** (self.trips - 1))
+                self.down_until = time.monotonic() + cooldown
+        metrics.inc("llm_backend_requests_total", backend=self.name, task=task, status=type(error).__name__)
+        if tripped:
+            metrics.inc("llm_backend_unhealthy_total", backend=self.name)
+            logger.warning(f"LLM backend {self.name} failed {self.consecutive_failures} times in a row, "
+                           f"out of rotation for {cooldown:.0f}s: {error}")
+
+    def stats(self):
+        with self.lock:
+            latencies = {task: list(samples) for task, samples in self.latencies.items() if samples}
+            return {
+                "model": self.model,
+                "requests": self.requests,
+                "failures": self.failures,
+                "healthy": self.available(time.monotonic()),
+                "cost": round(self.cost, 6),
+                "latency_ms": {task: {"count": len(samples),
+                                      "p50": round(1000 * _percentile(samples, 50), 1),
+                                      "p95": round(1000 * _percentile(samples, 95), 1)}
+                               for task, samples in latencies.items()},
+            }
+
+
+class Router:
+    """
+    Sends each call to the cheapest healthy backend whose recent p95 latency for
+    the task fits TASK_BUDGETS_MS (or the fastest one when none does). Failed
+    calls move on to the next backend, and a call that outlasts its backend's
+    p95 is hedged on the next one, keeping whichever answers first.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def candidates(self, task, prompt_tokens, max_tokens):
+        """Backends to try for task, best first"""
+        serving = [backend for backend in self.backends if backend.serves(task)] or self.backends
+        now = time.monotonic()
+        healthy = [backend for backend in serving if backend.available(now)]
+        if not healthy:
+            # Everything is cooling down: try the one that recovers first rather than fail outright
+            return sorted(serving, key=lambda backend: backend.down_until)
+        budget = TASK_BUDGETS_MS.get(task, TASK_BUDGETS_MS["completion"])
+
+        def rank(backend):
+            latency = backend.latency_ms(task)
+            if latency is None:
+                # Not measured yet: assumed to just meet the budget, so measured backends win ties
+                latency = budget
+            if latency <= budget:
+                return 0, backend.estimated_cost(task, prompt_tokens, max_tokens), latency
+            return 1, latency, 0.0
+
+        return sorted(healthy, key=rank)
+
+    async def _call(self, backend, task, prompt, max_tokens, stop, until):
+        started = time.perf_counter()
+        try:
+            if until is not None and STREAM_REPLIES:
+                content, usage = await backend.client.stream_with_usage(prompt, max_tokens=max_tokens,
+                                                                        stop=stop, until=until)
+            else:
+                content, usage = await backend.client.complete_with_usage(prompt, max_tokens=max_tokens, stop=stop)
+        except LLMError as e:
+            backend.record_failure(task, e)
+            raise
+        except asyncio.CancelledError:
+            # Lost a hedge race; without this sample a slow backend would never look slow
+            backend.record_cancelled(task, time.perf_counter() - started)
+            raise
+        backend.record_success(task, time.perf_counter() - started, usage)
+        return content, usage, backend
+
+    async def _hedged(self, backend, alternates, task, prompt, max_tokens, stop, until):
+        """Call backend; once it outlasts its p95, race it against alternates[0] (which is then used up)"""
+        first = asyncio.ensure_future(self._call(backend, task, prompt, max_tokens, stop, until))
+        delay = backend.latency_ms(task) if HEDGE_REQUESTS and alternates else None
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=max(delay, HEDGE_MIN_MS) / 1000)
+        if done:
+            return first.result()
+
+        hedge = alternates.pop(0)
+        metrics.inc("llm_hedged_requests_total", task=task, backend=hedge.name)
+        # until may hold parser state (StreamingObjectParser.feed), so the second stream gets its own copy
+        second = asyncio.ensure_future(self._call(hedge, task, prompt, max_tokens, stop, copy.deepcopy(until)))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        if finished is second:
+                            metrics.inc("llm_hedge_wins_total", task=task, backend=hedge.name)
+                        return finished.result()
+                    error = error or finished.exception()
+            raise error
+        finally:
+            for task_future in pending:
+                task_future.cancel()
+
+    async def complete(self, task, prompt, max_tokens=1024, stop=None, until=None):
+        """(content, usage, backend) from the first backend that answers"""
+        prompt_tokens = estimate_tokens(prompt)
+        remaining = self.candidates(task, prompt_tokens, max_tokens)
+        last_error = None
+        while remaining:
+            backend = remaining.pop(0)
+            try:
+                return await self._hedged(backend, remaining, task, prompt, max_tokens, stop, until)
+            except LLMError as e:
+                last_error = e
+                if remaining:
+                    metrics.inc("llm_failovers_total", task=task, backend=backend.name)
+                    logger.warning(f"LLM backend {backend.name} failed for {task} ({e}), trying {remaining[0].name}")
+        raise last_error
+
+    def stats(self):
+        return {backend.name: backend.stats() for backend in self.backends}
+
+    async def aclose(self):
+        for backend in self.backends:
+            if backend.client is not None:
+                await backend.client.aclose()
+
+
+_router = None
+_model_key = None
+_lock = threading.Lock()
+
+def get_router() -> Router:
+    """Process-wide router over the LLM_BACKENDS registry, built on first use on the client loop"""
+    global _router, _model_key
+    with _lock:
+        if _router is None:
+            # Picks up API keys from .env when the entry point did not load it
+            from dotenv import load_dotenv
+            load_dotenv()
+            registry = load_registry()
+            _model_key = _models(registry)
+            backends = []
+            for options in registry:
+                if len(registry) > 1:
+                    # Failing over beats retrying one backend through long backoffs
+                    options = dict({"max_retries": 1}, **options)
+                backends.append(Backend(**options))
+
+            async def build():
+                for backend in backends:
+                    backend.build()
+
+            run_sync(build())
+            _router = Router(backends)
+        return _router
+
+def router_stats():
+    """Per-backend request, failure, cost and latency stats; empty before the first LLM call"""
+    return _router.stats() if _router is not None else {}
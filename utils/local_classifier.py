@@ -0,0 +1,139 @@
+# utils/local_classifier.py
+import os
+import re
+import threading
+import time
+
+from utils.tracing import metrics
+
+# Below this confidence the local verdict is discarded and the LLM is asked instead
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", "0.75"))
+
+# Evidence the rules need before they trust themselves; larger values mean more LLM escalations
+CONFIDENCE_SMOOTHING = 1.5
+
+# (pattern, weight) per intent. Each pattern counts at most MAX_PATTERN_HITS times.
+INTENT_RULES = {
+    "Email+Invoice": [
+        (r"\binvoice\b", 1.0),
+        (r"\binvoice[_ ]?(?:number|no|#|date)\b|\bINV-?\d+", 1.5),
+        (r"\b(?:amount|balance|payment) due\b|\bdue[_ ]date\b", 1.0),
+        (r"\bsub[_ ]?total\b|\btotal[_ ]amount\b|\bgrand total\b", 1.0),
+        (r"\btax(?:[_ ]amount|[_ ]rate)?\b|\bgst\b|\bvat\b", 0.5),
+        (r"\bbill(?:ed)? to\b|\bremit\b|\bpayment terms\b", 0.75),
+    ],
+    "Email+RFQ": [
+        (r"\brfq\b|\brequest for (?:quotation|quote|proposal)\b", 2.0),
+        (r"\bquot(?:e|ation)s?\b", 1.0),
+        (r"\b(?:please|kindly) (?:quote|provide (?:a )?(?:quote|pricing))\b", 1.5),
+        (r"\blead time\b|\bmoq\b|\bminimum order\b|\bunit pric(?:e|ing)\b", 0.5),
+    ],
+    "Email+Complaint": [
+        (r"\bcomplain(?:t|ts|ing|ed)?\b", 2.0),
+        (r"\b(?:dis)?satisf(?:ied|action)\b|\bdisappoint(?:ed|ing|ment)\b|\bfrustrat(?:ed|ing)\b", 1.0),
+        (r"\brefund\b|\breplacement\b|\bcompensation\b", 0.75),
+        (r"\bdefective\b|\bdamaged\b|\bbroken\b|\bnot working\b|\bfaulty\b", 1.0),
+        (r"\bunacceptable\b|\bpoor (?:service|quality)\b|\bdelayed?\b", 0.75),
+    ],
+    "Email+Regulation": [
+        (r"\bregulat(?:ion|ions|ory)\b", 2.0),
+        (r"\bcomplian(?:ce|t)\b|\bgdpr\b|\bhipaa\b|\bdirective\b", 1.5),
+        (r"\bstatut(?:e|ory)\b|\blegal requirement\b|\bpolicy update\b|\baudit\b", 1.0),
+        (r"\bsection \d+(?:\.\d+)*\b|\bact of \d{4}\b|\beffective (?:date|from)\b", 0.5),
+    ],
+}
+MAX_PATTERN_HITS = 3
+
+COMPILED_RULES = {
+    intent: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+    for intent, rules in INTENT_RULES.items()
+}
+
+
+class TierStats:
+    """Thread-safe per-tier hit counters and latency totals for tuning the threshold"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.seconds = {}
+
+    def record(self, tier, seconds):
+        with self.lock:
+            self.counts[tier] = self.counts.get(tier, 0) + 1
+            self.seconds[tier] = self.seconds.get(tier, 0.0) + seconds
+        metrics.inc("intent_tier_total", tier=tier)
+
+    def snapshot(self):
+        with self.lock:
+            total = sum(self.counts.values())
+            return {
+                tier: {
+                    "count": count,
+                    "hit_rate": count / total if total else 0.0,
+                    "avg_latency_ms": 1000 * self.seconds[tier] / count,
+                }
+                for tier, count in self.counts.items()
+            }
+
+    def counts_since(self, before):
+        """Decisions per tier since before, an earlier copy of counts"""
+        with self.lock:
+            return {tier: count - before.get(tier, 0) for tier, count in self.counts.items()
+                    if count > before.get(tier, 0)}
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.seconds.clear()
+
+
+tier_stats = TierStats()
+
+
+def score_intents(text: str) -> dict:
+    scores = {}
+    for intent, rules in COMPILED_RULES.items():
+        score = 0.0
+        for pattern, weight in rules:
+            hits = 0
+            for _ in pattern.finditer(text):
+                hits += 1
+                if hits == MAX_PATTERN_HITS:
+                    break
+            score += weight * hits
+        scores[intent] = score
+    return scores
+
+
+def classify_local(text: str):
+    """
+    Keyword/regex intent classifier. Returns (intent, confidence) where confidence
+    is in [0, 1) and grows with the margin of the best intent over the runner-up.
+    """
+    ranked = sorted(score_intents(text or "").items(), key=lambda item: item[1], reverse=True)
+    (best, top), (_, second) = ranked[0], ranked[1]
+    if top == 0:
+        return "Email", 0.0
+    return best, top / (top + second + CONFIDENCE_SMOOTHING)
+
+
+def local_verdict(text: str, threshold: float = None):
+    """
+    classify_with_threshold without touching tier_stats: returns (intent or None, confidence,
+    tier, seconds), so a parse worker process can hand the tier back to the parent to record
+    """
+    threshold = LOCAL_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    started = time.perf_counter()
+    intent, confidence = classify_local(text)
+    elapsed = time.perf_counter() - started
+    if confidence >= threshold:
+        return intent, confidence, "rules", elapsed
+    return None, confidence, "rules_escalated", elapsed
+
+
+def classify_with_threshold(text: str, threshold: float = None):
+    """Return the local intent if it clears the threshold, otherwise None so the caller escalates"""
+    intent, confidence, tier, elapsed = local_verdict(text, threshold)
+    tier_stats.record(tier, elapsed)
+    return intent, confidence
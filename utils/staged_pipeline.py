@@ -0,0 +1,125 @@
+# utils/staged_pipeline.py
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from agents.classifier_agent import prepare_document, complete_document
+from utils.tracing import start_trace, replay_spans
+
+logger = logging.getLogger(__name__)
+
+# Processes running prepare_document (PDF text, rules, signatures), one per core unless set;
+# an explicit 0 parses on the LLM stage threads and starts no processes
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1)
+# Threads running complete_document; each mostly waits on the LLM client's event loop
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
+# Parsed documents allowed to wait for the LLM stage before parsing pauses; 0 means twice PARSE_WORKERS
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "0"))
+
+
+def _prepare(filename, content, near_duplicates):
+    # Runs in a parse worker; its spans are replayed into the document trace by the LLM stage
+    started = time.time()
+    with start_trace("parse") as trace:
+        prepared = prepare_document(filename, content, near_duplicates=near_duplicates)
+    return prepared, started, trace.spans
+
+
+class StagedPipeline:
+    """
+    classify_and_route split into two independently sized stages: a process pool
+    for the CPU-bound prepare_document (so parsing is not serialised by the GIL)
+    and threads for the I/O-bound complete_document. submit() blocks while
+    queue_size documents are already parsed or parsing ahead of the LLM stage,
+    so a slow API throttles parsing instead of piling up parsed text in memory.
+
+    handle(item, outcome, error) is called on an LLM stage thread for every
+    document, with outcome = (file_format, intent, result, latency, trace) or
+    error set to the exception that failed it. trace is the document's
+    utils.tracing.Trace, for the writer to store with its own spans.
+    """
+
+    def __init__(self, handle, parse_workers=PARSE_WORKERS, llm_workers=LLM_WORKERS, queue_size=STAGE_QUEUE_SIZE,
+                 near_duplicates=None, mode=None):
+        self.handle = handle
+        self.parse_workers = parse_workers
+        self.llm_workers = max(1, llm_workers)
+        self.queue_size = queue_size or 2 * max(1, parse_workers)
+        self.near_duplicates = near_duplicates
+        self.mode = mode
+        self._slots = threading.Semaphore(self.queue_size + (parse_workers or self.llm_workers))
+        self._ready = queue.Queue()
+        self._pool = None
+        if parse_workers:
+            # spawn, not fork: the parent already runs client, writer and index threads
+            self._pool = ProcessPoolExecutor(max_workers=parse_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        self._threads = []
+        for index in range(self.llm_workers):
+            thread = threading.Thread(target=self._run, name=f"llm-stage-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, filename, content, item=None, digest=None):
+        """
+        Queue one document (content as for classify_and_route), waiting while the
+        LLM stage is queue_size documents behind. item is passed back to handle().
+        """
+        self._slots.acquire()
+        job = (filename, content, item, digest, time.perf_counter(), time.time())
+        if self._pool is None:
+            self._ready.put((job, None))
+            return
+        future = self._pool.submit(_prepare, filename, content, self.near_duplicates is not None)
+        future.add_done_callback(lambda done: self._ready.put((job, done)))
+
+    def close(self):
+        """Finish every submitted document, then stop both stages"""
+        if self._pool is not None:
+            # Returns once every parse has finished and been handed to the LLM stage
+            self._pool.shutdown(wait=True)
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _complete(self, job, future):
+        filename, content, _, digest, submitted, submitted_at = job
+        with start_trace("document", started=submitted, source=filename) as trace:
+            if future is None:
+                prepared = prepare_document(filename, content, near_duplicates=self.near_duplicates is not None)
+            else:
+                prepared, parse_started, spans = future.result()
+                replay_spans(spans, offset=parse_started - submitted_at)
+            file_format, intent, result = complete_document(prepared, digest, mode=self.mode,
+                                                            near_duplicates=self.near_duplicates)
+        return file_format, intent, result, trace.duration, trace
+
+    def _run(self):
+        while True:
+            entry = self._ready.get()
+            if entry is None:
+                return
+            job, future = entry
+            # The document left the hand-off queue, so one more may start parsing
+            self._slots.release()
+            outcome, error = None, None
+            try:
+                outcome = self._complete(job, future)
+            except Exception as e:
+                error = e
+            try:
+                self.handle(job[2], outcome, error)
+            except Exception as e:
+                logger.error(f"Result handler failed for {job[0]}: {str(e)}")
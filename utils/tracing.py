@@ -0,0 +1,257 @@
+# utils/tracing.py
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# When set, every finished trace is appended to this file as one JSON line
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """Minimal thread-safe counters and latency histograms with Prometheus text exposition"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def total(self, name, **labels):
+        """Sum of a counter over every label set that includes the given labels"""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (key, items), value in self.counters.items()
+                       if key == name and wanted <= set(items))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render_prometheus(self):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{fmt(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """Spans recorded while processing one document"""
+
+    def __init__(self, name, on_span=None, started=None, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.on_span = on_span
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.perf_counter() if started is None else started
+        self.duration = None
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def record(self, name, started, elapsed, **attrs):
+        """Add a span timed elsewhere: started is a time.perf_counter() value, elapsed in seconds"""
+        self.add({
+            "name": name,
+            "start_ms": round(1000 * (started - self.started), 3),
+            "ms": round(1000 * elapsed, 3),
+            "attrs": attrs,
+        })
+
+    def summary(self):
+        """JSON-serialisable view stored with the record and written to TRACE_FILE"""
+        tokens = {"prompt": 0, "completion": 0}
+        for span in self.spans:
+            tokens["prompt"] += span["attrs"].get("prompt_tokens", 0)
+            tokens["completion"] += span["attrs"].get("completion_tokens", 0)
+        total = self.duration if self.duration is not None else time.perf_counter() - self.started
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "total_ms": round(1000 * total, 3),
+            "tokens": tokens,
+            "spans": list(self.spans),
+        }
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_trace_file_lock = threading.Lock()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name="document", on_span=None, started=None, **attrs):
+    """
+    Collect spans for one document; on_span(name) is called as each span starts (e.g. for progress).
+    started is an earlier time.perf_counter() value to date the trace back to, e.g. when the document was queued.
+    """
+    trace = Trace(name, on_span=on_span, started=started, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.started
+        _current_trace.reset(token)
+        metrics.observe("pipeline_trace_seconds", trace.duration, trace=name)
+        if TRACE_FILE:
+            line = json.dumps(trace.summary(), default=str)
+            with _trace_file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@contextmanager
+def resume_trace(trace):
+    """Make a finished trace current again, so spans opened later (e.g. the DB write) still join it"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a pipeline stage. The duration always feeds the pipeline_span_seconds
+    histogram; inside start_trace() the span is also added to the current trace.
+    """
+    current = Span(name, dict(attrs))
+    started = time.perf_counter()
+    trace = current_trace()
+    if trace is not None and trace.on_span is not None:
+        try:
+            trace.on_span(name)
+        except Exception:
+            # Progress reporting must never fail the stage it reports on
+            pass
+    try:
+        yield current
+    except Exception as e:
+        current.attrs["error"] = f"{type(e).__name__}: {str(e)[:200]}"
+        metrics.inc("pipeline_span_errors_total", span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("pipeline_span_seconds", elapsed, span=name)
+        if trace is not None:
+            trace.record(name, started, elapsed, **current.attrs)
+
+
+def event(name, **attrs):
+    """Zero-duration marker, e.g. for a fallback path being taken"""
+    metrics.inc("pipeline_events_total", event=name)
+    trace = current_trace()
+    if trace is not None:
+        trace.add({
+            "name": name,
+            "start_ms": round(1000 * (time.perf_counter() - trace.started), 3),
+            "ms": 0.0,
+            "attrs": attrs,
+        })
+
+
+def replay_spans(spans, offset=0.0):
+    """
+    Record spans finished in another process (e.g. a parse worker) as if they ran
+    here: they feed the span metrics and join the current trace, shifted by offset
+    seconds from its start.
+    """
+    trace = current_trace()
+    for item in spans:
+        metrics.observe("pipeline_span_seconds", item["ms"] / 1000, span=item["name"])
+        if "error" in item["attrs"]:
+            metrics.inc("pipeline_span_errors_total", span=item["name"])
+        if trace is not None:
+            trace.add(dict(item, start_ms=round(item["start_ms"] + 1000 * offset, 3)))
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve GET /metrics in Prometheus text format from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server